@@ -0,0 +1,99 @@
+import heapq
+
+
+class Atlas(object):
+    """Packs equally sized cells into square texture pages.
+
+    Every key gets one cellWidth x cellHeight cell of a pageSize x pageSize
+    page. Cells are handed out from the lowest-numbered page that has room,
+    so as keys come and go the live cells drift towards the first pages and
+    the last ones empty out; a page that no longer holds any cell is
+    released straight away. Pages are created and released through
+    createPage() -> handle and deletePage(handle), if given.
+
+    >>> handles = iter(range(1, 100))
+    >>> deleted = []
+    >>> atlas = Atlas(1024, 512, 512, lambda: next(handles), deleted.append)
+    >>> [atlas.allocate(key)[:3] for key in 'abcde']
+    [(1, 0, 0), (1, 512, 0), (1, 0, 512), (1, 512, 512), (2, 0, 0)]
+    >>> atlas.getTexCoords('b')
+    (0.5, 0.0, 1.0, 0.5)
+    >>> atlas.free('b'); atlas.free('e')
+    >>> deleted, atlas.allocate('f')[:3]
+    ([2], (1, 512, 0))
+    >>> sorted(atlas.getStatistics().items())
+    [('capacity', 4), ('cells', 4), ('pages', 1)]
+    """
+
+    def __init__(self, pageSize, cellWidth, cellHeight, createPage=None, deletePage=None):
+        self._pageSize = pageSize
+        self._cellWidth = cellWidth
+        self._cellHeight = cellHeight
+        self._columns = max(1, pageSize // cellWidth)
+        self._cellsPerPage = self._columns * max(1, pageSize // cellHeight)
+        self._createPage = createPage if createPage is not None else lambda: None
+        self._deletePage = deletePage if deletePage is not None else lambda handle: None
+        # per page: [handle, free cells (a heap)], or None once released
+        self._pages = []
+        # key -> (page, cell)
+        self._cells = {}
+
+    def __len__(self): return len(self._cells)
+
+    def __contains__(self, key): return key in self._cells
+
+    def getCellSize(self): return (self._cellWidth, self._cellHeight)
+
+    def getStatistics(self):
+        pages = sum(1 for page in self._pages if page is not None)
+        return { 'pages': pages, 'cells': len(self._cells), 'capacity': pages * self._cellsPerPage }
+
+    def allocate(self, key):
+        """Return the region (page handle, x, y, width, height) of key's cell, allocating one if needed."""
+        if key not in self._cells:
+            for index, page in enumerate(self._pages):
+                if page is not None and page[1]:
+                    break
+            else:
+                # reuse the first released slot, if any
+                index = self._pages.index(None) if None in self._pages else len(self._pages)
+                page = [self._createPage(), list(range(self._cellsPerPage))]
+                if index == len(self._pages):
+                    self._pages.append(page)
+                else:
+                    self._pages[index] = page
+            self._cells[key] = (index, heapq.heappop(page[1]))
+        return self.getRegion(key)
+
+    def free(self, key):
+        index, cell = self._cells.pop(key)
+        page = self._pages[index]
+        heapq.heappush(page[1], cell)
+        if len(page[1]) == self._cellsPerPage:
+            self._pages[index] = None
+            self._deletePage(page[0])
+
+    def getRegion(self, key):
+        index, cell = self._cells[key]
+        x = (cell % self._columns) * self._cellWidth
+        y = (cell // self._columns) * self._cellHeight
+        return (self._pages[index][0], x, y, self._cellWidth, self._cellHeight)
+
+    def getTexCoords(self, key, inset=0.):
+        """Return (u0, v0, u1, v1) of key's cell; inset (in texels) keeps filtering inside the cell."""
+        handle, x, y, width, height = self.getRegion(key)
+        size = float(self._pageSize)
+        return ((x + inset) / size, (y + inset) / size, (x + width - inset) / size, (y + height - inset) / size)
+
+    def clear(self):
+        """Release every page."""
+        for page in self._pages:
+            if page is not None:
+                self._deletePage(page[0])
+        self._pages = []
+        self._cells = {}
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
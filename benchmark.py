@@ -0,0 +1,1021 @@
+"""Benchmarks for video-coverflow.
+
+Usage:
+
+    python benchmark.py scan [--titles N] [--episodes N] [--workers 1,2,4,8]
+    python benchmark.py index [--titles N] [--episodes N] [--touch N]
+    python benchmark.py parse [--names N] [--seed N]
+    python benchmark.py search [--titles N] [--legacy N]
+    python benchmark.py download [--covers N] [--latency MS] [--workers 1,4,8] [--rate N]
+    python benchmark.py library [--titles 1000,10000,100000] [--seed N] [--memory]
+    python benchmark.py trie [--titles 1000,10000,100000]
+    python benchmark.py order [--titles 1000000] [--operations N]
+    python benchmark.py catalog [--titles 10000,100000] [--operations N]
+    python benchmark.py layout [--tiles 10,100,1000] [--frames N]
+    python benchmark.py covers [--titles 1000,10000] [--images N] [--size KB]
+    xvfb-run -a python benchmark.py render [--titles 100,10000,100000] [--renderer lists,batch]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from threading import Thread
+
+if sys.version_info[0] >= 3:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.request import urlopen
+else:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib2 import urlopen
+
+from catalog import Catalog
+from coverdownload import DownloadPool, Pipeline
+from coverstore import CoverStore
+from layout import Layout
+from renderer import Batch, tileTransform
+from scanindex import ScanIndex
+from scanner import Scanner
+from searchindex import SearchIndex
+from sortedcollection import SortedCollection
+from titleparser import TitleParser, parseReference
+from prefixindex import PrefixIndex
+from radix import RadixTrie
+from trie import NeedMore, Trie
+
+_extensions = ['.avi', '.mkv', '.mp4']
+
+
+def makeTree(root, titles, episodes):
+    """Create a synthetic library of empty files beneath root.
+
+    Half of the titles are loose movie files placed directly in the root and
+    the other half are show directories with one season subdirectory holding
+    `episodes` episode files and a non-video file each. Returns the number of
+    video files created.
+    """
+    count = 0
+    for i in range(titles):
+        if i % 2 == 0:
+            open(os.path.join(root, 'Movie.%06d.2001.720p.mkv' % i), 'w').close()
+            count += 1
+        else:
+            season = os.path.join(root, 'Show.%06d' % i, 'Season 1')
+            os.makedirs(season)
+            open(os.path.join(season, 'info.nfo'), 'w').close()
+            for j in range(episodes):
+                open(os.path.join(season, 'Show.%06d.S01E%02d.avi' % (i, j + 1)), 'w').close()
+                count += 1
+    return count
+
+
+_words = ('the dark knight star wars return of king lost city alien house blue night last man earth red river ghost '
+          'black white empire strikes back hope phantom menace clone attack revenge sith force awakens rise fall '
+          'planet apes mission impossible fast furious die hard lethal weapon back future toy story finding nemo '
+          'inside out up coco cars frozen shrek matrix reloaded revolutions terminator judgment day predator '
+          'godfather part casino goodfellas heat fargo psycho vertigo rope notorious rear window birds marnie').split()
+_tags = ['720p', '1080p', '2160p', 'BluRay', 'BRRip', 'BDRip', 'DVDRip', 'DVDSCR', 'WEBRip', 'HDRip', 'HDCAM', 'XviD', 'x264', 'DD5.1', 'AAC', 'TS', 'Subs', 'NL', '[eztv]']
+
+
+def makeNames(count, seed=0):
+    """Return a deterministic list of release-style file names.
+
+    Names mix movies with and without years, episodes (SxxEyy), leading
+    [group] tags, assorted delimiters and trailing release tags. About a
+    quarter of the names are duplicates of earlier ones.
+    """
+    rng = random.Random(seed)
+    names = []
+    for i in range(count):
+        if names and rng.random() < 0.25:
+            names.append(rng.choice(names))
+            continue
+        words = [rng.choice(_words).capitalize() for k in range(rng.randint(1, 4))] + [str(i)]
+        kind = rng.random()
+        if kind < 0.4:
+            words.append(rng.choice(['%d', '(%d)']) % rng.randint(1950, 2015))
+        elif kind < 0.7:
+            words.append('S%02dE%02d' % (rng.randint(1, 12), rng.randint(1, 24)))
+        words.extend(rng.choice(_tags) for k in range(rng.randint(0, 3)))
+        name = rng.choice(['.', ' ', '_', '-']).join(words)
+        if rng.random() < 0.1:
+            name = '[%s] %s' % (rng.choice(_words), name)
+        names.append(name)
+    return names
+
+
+class Title(object):
+    """Stand-in for VideoCoverflow.Media, which needs a running Qt."""
+    __slots__ = 'key name'.split()
+
+    def __init__(self, name, year):
+        self.name = name
+        self.key = (''.join([name, '_', year]) if year is not None else name).lower()
+
+    def getKey(self): return self.key
+    def getName(self): return self.name
+
+
+def makeTitles(count, seed=0):
+    """Return distinct Titles parsed from a release-name corpus, in key order."""
+    titles = {}
+    for name, year in TitleParser().parseBatch(makeNames(count, seed)):
+        if name != '':
+            title = Title(name, year)
+            titles[title.getKey()] = title
+    return [ titles[key] for key in sorted(titles) ]
+
+
+def makeRelease(rng, words, year):
+    tags = rng.sample(_tags, rng.randint(0, 3))
+    parts = words + ([year] if year is not None else []) + tags
+    return rng.choice(['.', ' ', '_', '-']).join(parts)
+
+
+def makeLibrary(root, titles, episodes=12, seed=0):
+    """Create a deterministic synthetic library of scene-style releases beneath root.
+
+    Titles are loose release files, movie directories (with an .nfo and a
+    sample) or show directories with nested season directories. About one
+    in ten movies is present twice under different release names, and
+    titles drawn from the same words collide, so the library has
+    duplicates to merge like a real one. Returns the number of video files
+    created.
+    """
+    rng = random.Random(seed)
+    count = 0
+    for i in range(titles):
+        words = [ rng.choice(_words).title() for k in range(rng.randint(1, 4)) ]
+        year = str(rng.randint(1950, 2019)) if rng.random() < 0.7 else None
+        kind = rng.random()
+        if kind < 0.45:
+            releases = [makeRelease(rng, words, year) for k in range(2 if rng.random() < 0.1 else 1)]
+            paths = [ os.path.join(root, release + rng.choice(_extensions)) for release in releases ]
+        elif kind < 0.75:
+            directory = os.path.join(root, ' '.join(words) + (' (%s)' % (year) if year is not None else ''))
+            release = makeRelease(rng, words, year)
+            paths = [os.path.join(directory, release + rng.choice(_extensions)), os.path.join(directory, 'Sample', 'sample-' + release + '.mkv')]
+            if not os.path.isdir(directory):
+                os.makedirs(os.path.join(directory, 'Sample'))
+                open(os.path.join(directory, release + '.nfo'), 'w').close()
+        else:
+            directory = os.path.join(root, ' '.join(words))
+            paths = []
+            for season in range(1, rng.randint(1, 4) + 1):
+                tags = '.'.join(rng.sample(_tags, 2))
+                for episode in range(1, rng.randint(1, episodes) + 1):
+                    paths.append(os.path.join(directory, 'Season %02d' % (season), '%s.S%02dE%02d.%s.mkv' % ('.'.join(words), season, episode, tags)))
+        for path in paths:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            if not os.path.exists(path):
+                open(path, 'w').close()
+                count += 1
+    return count
+
+
+class LibraryTitle(Title):
+    """Stand-in for VideoCoverflow.Media, with its files."""
+    __slots__ = ['filePaths']
+
+    def __init__(self, name, year, filePaths):
+        Title.__init__(self, name, year)
+        self.filePaths = filePaths[:]
+
+
+def populateStages():
+    """Return the stages of VideoCoverflow.populate and buildTrie, as (name, function of the previous result)."""
+    def scanStage(root):
+        return list(Scanner(_extensions).scan([root]))
+
+    def parseStage(records):
+        # VideoCoverflow.addMedia
+        parser = TitleParser()
+        return [ parser.parse(name) + (filePaths, collectionPath) for name, filePaths, collectionPath in records ]
+
+    def trieStage(records):
+        # VideoCoverflow.insertMedia
+        trie = RadixTrie()
+        for name, year, filePaths, collectionPath in records:
+            if name == '': continue
+            title = LibraryTitle(name, year, filePaths)
+            try:
+                trie[title.getKey()].filePaths.extend(filePaths)
+            except (KeyError, NeedMore):
+                trie[title.getKey()] = title
+        return trie
+
+    def indexStage(trie):
+        return SearchIndex(trie.itervalues())
+
+    def searchStage(index):
+        # VideoCoverflow.buildTrie, as a query is typed
+        results = 0
+        for query in ['star wars', 'the dark knight 2008', 'ghost', 'red river', 'zz']:
+            previous = []
+            collection = None
+            for k in range(1, len(query) + 1):
+                tokens = SearchIndex.tokenize(query[:k])
+                collection = index.search(query[:k], collection if SearchIndex.narrows(previous, tokens) else None)
+                previous = tokens
+            results += len(collection)
+        return results
+
+    return [('scan', scanStage), ('parse', parseStage), ('trie', trieStage), ('index', indexStage), ('search', searchStage)]
+
+
+def library(args):
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+        if args.memory:
+            sys.stdout.write('tracemalloc is not available: peak memory is not reported\n')
+
+    stages = populateStages()
+    sys.stdout.write('%-10s %8s %8s' % ('titles', 'files', 'media') + ''.join(' %10s' % ('%s (s)' % (name)) for name, stage in stages))
+    if args.memory and tracemalloc is not None:
+        sys.stdout.write(''.join(' %10s' % ('%s (MB)' % (name)) for name, stage in stages))
+    sys.stdout.write('\n')
+    for titles in args.titles:
+        root = tempfile.mkdtemp(prefix='video-coverflow-')
+        try:
+            files = makeLibrary(root, titles, seed=args.seed)
+            # warm the dentry cache so that the scan does not time the disk
+            list(Scanner(_extensions).scan([root]))
+
+            elapsed = []
+            result = root
+            for name, stage in stages:
+                start = time.time()
+                result = stage(result)
+                elapsed.append(time.time() - start)
+                if name == 'trie':
+                    medias = sum(1 for title in result.itervalues())
+            sys.stdout.write('%-10d %8d %8d' % (titles, files, medias) + ''.join(' %10.3f' % (seconds) for seconds in elapsed))
+
+            # traced separately, as tracing slows everything down
+            if args.memory and tracemalloc is not None:
+                result = root
+                for name, stage in stages:
+                    tracemalloc.start()
+                    result = stage(result)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    sys.stdout.write(' %10.1f' % (peak / float(1 << 20)))
+            sys.stdout.write('\n')
+        finally:
+            shutil.rmtree(root)
+
+
+def timeTrie(cls, keys, tracemalloc):
+    """Return the timings (and allocated memory) of building, querying and iterating a trie of keys."""
+    timings = {}
+    if tracemalloc is not None:
+        # traced separately, as tracing slows insertion down
+        tracemalloc.start()
+        trie = cls()
+        for key in keys:
+            trie[key] = key
+        timings['memory'] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del trie
+
+    start = time.time()
+    trie = cls()
+    for key in keys:
+        trie[key] = key
+    timings['insert'] = time.time() - start
+
+    start = time.time()
+    for key in keys:
+        assert trie[key] == key
+    timings['lookup'] = time.time() - start
+    start = time.time()
+    assert sum(1 for value in trie.itervalues()) == len(keys)
+    timings['values'] = time.time() - start
+    start = time.time()
+    # (trie.Trie.__iter__ and iteritems never end on Python 3, see Node.keypath)
+    if cls is not Trie or sys.version_info[0] < 3:
+        assert sum(1 for item in trie.iteritems()) == len(keys)
+        timings['items'] = time.time() - start
+    return timings
+
+
+def trieBenchmark(args):
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+        sys.stdout.write('tracemalloc is not available: memory is not reported\n')
+
+    sys.stdout.write('%-22s %10s %10s %12s %12s %10s\n' % ('titles', 'insert (s)', 'lookup (s)', 'values (ms)', 'items (ms)', 'memory (MB)'))
+    for count in args.titles:
+        keys = [ title.getKey() for title in makeTitles(count) ]
+        for cls in [Trie, RadixTrie]:
+            timings = timeTrie(cls, keys, tracemalloc)
+            items = '%12.1f' % (timings['items'] * 1000.) if 'items' in timings else '%12s' % ('-')
+            memory = '%10.1f' % (timings['memory'] / float(1 << 20)) if 'memory' in timings else '%10s' % ('-')
+            sys.stdout.write('%-22s %10.3f %10.3f %12.1f %s %s\n' % ('%d (%s)' % (len(keys), cls.__name__), timings['insert'], timings['lookup'], timings['values'] * 1000., items, memory))
+
+
+def order(args):
+    rng = random.Random(0)
+    keys = sorted(set('%s %d' % (rng.choice(_words), k) for k in range(args.titles)))
+    sys.stdout.write('%d keys\n' % (len(keys)))
+
+    start = time.time()
+    collection = SortedCollection(keys)
+    sys.stdout.write('built in %.3f seconds\n' % (time.time() - start))
+
+    # the library used to be walked in key order to find a position
+    trie = RadixTrie((key, key) for key in keys)
+    start = time.time()
+    target = keys[len(keys) // 2]
+    for position, key in enumerate(trie.itervalues()):
+        if key == target: break
+    walk = time.time() - start
+
+    # search results are in relevance order, so typed prefixes go through a PrefixIndex
+    view = keys[:]
+    rng.shuffle(view)
+    start = time.time()
+    index = PrefixIndex(view)
+    sys.stdout.write('prefix index of a %d title view built in %.3f seconds\n' % (len(view), time.time() - start))
+
+    positions = [ rng.randrange(len(keys)) for k in range(args.operations) ]
+    probes = [ keys[position] for position in positions ]
+    fresh = [ '%s %d' % (rng.choice(_words), args.titles + k) for k in range(args.operations) ]
+    sys.stdout.write('%-28s %14s\n' % ('operation', 'us/operation'))
+    for label, run in [ \
+          ('select (collection[i])', lambda: [ collection[position] for position in positions ]) \
+        , ('rank (index(key))', lambda: [ collection.index(key) for key in probes ]) \
+        , ('jump (bisect(prefix))', lambda: [ collection.bisect(key[:2]) for key in probes ]) \
+        , ('jump (view, typed prefix)', lambda: [ index.locate(key[:6]) for key in probes ]) \
+        , ('add', lambda: [ collection.add(key) for key in fresh ]) \
+        , ('remove', lambda: [ collection.remove(key) for key in fresh ]) \
+    ]:
+        start = time.time()
+        run()
+        sys.stdout.write('%-28s %14.2f\n' % (label, (time.time() - start) * 1e6 / args.operations))
+    sys.stdout.write('%-28s %14.2f\n' % ('(walk to the middle)', walk * 1e6))
+
+
+def catalogRecords(count):
+    """Return catalog records for a synthetic library of `count` release names, one file each."""
+    parser = TitleParser()
+    records = []
+    for release, (name, year) in zip(makeNames(count), parser.parseBatch(makeNames(count))):
+        if name == '': continue
+        path = '/library/%s.avi' % (release)
+        records.append((Title(name, year).getKey(), name, year, [path], '/library', path))
+    return records
+
+
+def catalogBenchmark(args):
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+        sys.stdout.write('tracemalloc is not available: memory is not reported\n')
+
+    def makeTitle(key, name, year, filePaths, collectionPath): return LibraryTitle(name, year or None, filePaths)
+
+    def openLibrary(records, path):
+        """Return (library in key order, search index), from the catalog at path if given."""
+        if path is not None:
+            # only the first key of every page is read
+            catalog = Catalog(path, makeTitle)
+            return catalog, catalog
+        # VideoCoverflow.populate without a catalog
+        trie = RadixTrie()
+        for key, name, year, filePaths, collectionPath, unit in records:
+            if key not in trie:
+                trie[key] = LibraryTitle(name, year, filePaths)
+        library = SortedCollection(trie.itervalues(), LibraryTitle.getKey)
+        return library, SearchIndex(library)
+
+    queries = ['star wars', 'the dark knight 2008', 'ghost', 'zz']
+    sys.stdout.write('%-24s %10s %10s %12s %12s %12s\n' % ('titles', 'build (s)', 'open (s)', 'memory (MB)', 'jump (ms)', 'search (ms)'))
+    for count in args.titles:
+        records = catalogRecords(count)
+        rng = random.Random(0)
+        directory = tempfile.mkdtemp(prefix='video-coverflow-')
+        try:
+            path = os.path.join(directory, 'catalog.sqlite')
+            start = time.time()
+            Catalog(path, makeTitle).scan(iter(records))
+            build = time.time() - start
+
+            for label, catalogPath in [('in memory', None), ('catalog', path)]:
+                memory = '%12s' % ('-')
+                if tracemalloc is not None:
+                    # traced separately, as tracing slows everything down
+                    # (SQLite's own page cache is not traced)
+                    tracemalloc.start()
+                    library, index = openLibrary(records, catalogPath)
+                    memory = '%12.1f' % (tracemalloc.get_traced_memory()[0] / float(1 << 20))
+                    tracemalloc.stop()
+                    del library, index
+
+                start = time.time()
+                library, index = openLibrary(records, catalogPath)
+                opened = time.time() - start
+
+                # jumps through the library, reading the visible titles around the centre
+                centres = [ rng.randrange(len(library)) for k in range(args.operations) ]
+                start = time.time()
+                for centre in centres:
+                    for position in range(max(0, centre - 10), min(len(library), centre + 11)):
+                        library[position]
+                jump = (time.time() - start) * 1000. / args.operations
+
+                start = time.time()
+                for query in queries:
+                    # as typed, reading the first results
+                    for k in range(1, len(query) + 1):
+                        results = index.search(query[:k])
+                        for position in range(min(len(results), 20)):
+                            results[position]
+                search = (time.time() - start) * 1000. / sum(len(query) for query in queries)
+                sys.stdout.write('%-24s %10s %10.3f %s %12.3f %12.2f\n' % ('%d (%s)' % (len(library), label), '%10.3f' % (build) if catalogPath is not None else '-', opened, memory, jump, search))
+                del library, index
+        finally:
+            shutil.rmtree(directory)
+
+
+def timeScan(paths, workers):
+    start = time.time()
+    files = 0
+    records = 0
+    for name, filePaths, collectionPath in Scanner(_extensions, workers).scan(paths):
+        files += len(filePaths)
+        records += 1
+    return time.time() - start, records, files
+
+
+def scan(args):
+    root = tempfile.mkdtemp(prefix='video-coverflow-')
+    try:
+        count = makeTree(root, args.titles, args.episodes)
+        sys.stdout.write('synthetic library: %d titles, %d video files\n' % (args.titles, count))
+
+        # warm the dentry cache so every worker count sees the same conditions
+        timeScan([root], 1)
+
+        sys.stdout.write('%8s %10s %12s\n' % ('workers', 'seconds', 'files/sec'))
+        for workers in args.workers:
+            elapsed, records, files = timeScan([root], workers)
+            assert files == count
+            sys.stdout.write('%8d %10.3f %12.0f\n' % (workers, elapsed, files / max(elapsed, 1e-9)))
+    finally:
+        shutil.rmtree(root)
+
+
+def timeIndexedScan(indexPath, root):
+    index = ScanIndex(indexPath, Scanner(_extensions), TitleParser().parse)
+    start = time.time()
+    files = 0
+    for name, year, filePaths, collectionPath in index.scan([root]):
+        files += len(filePaths)
+    index.save()
+    return time.time() - start, files, index.getStatistics()
+
+
+def index(args):
+    root = tempfile.mkdtemp(prefix='video-coverflow-')
+    indexPath = root + '.json'
+    try:
+        count = makeTree(root, args.titles, args.episodes)
+        sys.stdout.write('synthetic library: %d titles, %d video files\n' % (args.titles, count))
+
+        # warm the dentry cache so only the index makes a difference
+        timeScan([root], 1)
+
+        sys.stdout.write('%-24s %10s %8s %8s\n' % ('startup', 'seconds', 'reused', 'walked'))
+        for label in ['cold (no index)', 'warm']:
+            elapsed, files, statistics = timeIndexedScan(indexPath, root)
+            assert files == count
+            sys.stdout.write('%-24s %10.3f %8d %8d\n' % (label, elapsed, statistics['reused'], statistics['walked']))
+
+        # add an episode to a few shows, which changes their mtimes
+        shows = sorted(name for name in os.listdir(root) if name.startswith('Show'))[:args.touch]
+        for name in shows:
+            open(os.path.join(root, name, 'Season 1', 'Extra.avi'), 'w').close()
+        elapsed, files, statistics = timeIndexedScan(indexPath, root)
+        assert files == count + len(shows)
+        sys.stdout.write('%-24s %10.3f %8d %8d\n' % ('warm (%d changed)' % len(shows), elapsed, statistics['reused'], statistics['walked']))
+    finally:
+        shutil.rmtree(root)
+        if os.path.exists(indexPath):
+            os.remove(indexPath)
+
+
+def parse(args):
+    names = makeNames(args.names, args.seed)
+    sys.stdout.write('corpus: %d names, %d distinct\n' % (len(names), len(set(names))))
+
+    start = time.time()
+    expected = [parseReference(name) for name in names]
+    reference = time.time() - start
+
+    parser = TitleParser()
+    start = time.time()
+    cold = parser.parseBatch(names)
+    coldTime = time.time() - start
+    start = time.time()
+    warm = parser.parseBatch(names)
+    warmTime = time.time() - start
+
+    mismatches = [(name, a, b) for name, a, b in zip(names, expected, cold) if a != b]
+    for name, a, b in mismatches[:10]:
+        sys.stdout.write('mismatch: %r -> %r (reference %r)\n' % (name, b, a))
+    assert len(mismatches) == 0 and warm == cold
+
+    sys.stdout.write('%-24s %10s %12s\n' % ('parser', 'seconds', 'names/sec'))
+    for label, elapsed in [('reference (per rule)', reference), ('compiled', coldTime), ('compiled (memoized)', warmTime)]:
+        sys.stdout.write('%-24s %10.3f %12.0f\n' % (label, elapsed, len(names) / max(elapsed, 1e-9)))
+
+
+def legacySearch(titles, query):
+    # per-title, per-token regular expressions, as the search box used to do
+    tokens = [ token for token in query.split(' ') if token != '' ]
+    tmp = []
+    for title in titles:
+        matches = 0
+        for token in tokens:
+            if re.compile(token, re.I).search(title.getName()):
+                matches += 1
+        if matches > 0:
+            tmp.append((-matches, title.getKey(), title))
+    tmp.sort()
+    return [ title for matches, key, title in tmp ]
+
+
+def search(args):
+    titles = makeTitles(args.titles)
+    queries = ['star', 'the dark knight', 'red river 2001', 'ghost house', 'xyz', 'a', 'man of']
+
+    start = time.time()
+    index = SearchIndex(titles)
+    sys.stdout.write('%d titles indexed in %.3f seconds\n' % (len(index), time.time() - start))
+
+    sys.stdout.write('%-20s %8s %12s %12s\n' % ('query', 'results', 'index (ms)', 'legacy (ms)'))
+    for query in queries:
+        start = time.time()
+        results = index.search(query)
+        elapsed = time.time() - start
+
+        legacy = ''
+        if args.legacy > 0:
+            sample = titles[:args.legacy]
+            start = time.time()
+            legacySearch(sample, query)
+            # extrapolate to the whole library
+            legacy = '%12.1f' % ((time.time() - start) * 1000. * len(titles) / len(sample))
+        sys.stdout.write('%-20s %8d %12.2f %12s\n' % (repr(query), len(results), elapsed * 1000., legacy))
+
+    # search as you type: each keystroke either refines the previous results
+    # or, when it cannot, searches the whole index
+    sys.stdout.write('%-20s %8s %12s %12s\n' % ('typed', 'strokes', 'full (ms)', 'refine (ms)'))
+    for query in ['godfather', 'star wars', 'mission impossible']:
+        full = refine = 0.
+        previous = None
+        for k in range(1, len(query) + 1):
+            typed = query[:k]
+            start = time.time()
+            expected = index.search(typed)
+            full += time.time() - start
+
+            start = time.time()
+            tokens = SearchIndex.tokenize(typed)
+            within = previous[1] if previous and SearchIndex.narrows(previous[0], tokens) else None
+            results = index.search(typed, within)
+            refine += time.time() - start
+            assert results == expected
+            previous = (tokens, results)
+        sys.stdout.write('%-20s %8d %12.2f %12.2f\n' % (repr(query), len(query), full * 1000. / len(query), refine * 1000. / len(query)))
+
+
+class CoverHandler(BaseHTTPRequestHandler):
+    """Stand-in for the OMDb API, IMDb title pages and poster images."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # keep-alive responses otherwise stall on Nagle's algorithm
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    latency = 0.
+    image = b'\xff' * 50000
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        if self.path.startswith('/omdb'):
+            query = dict(part.split('=', 1) for part in self.path.split('?', 1)[1].split('&'))
+            body = json.dumps({ 'Search': [ { 'imdbID': 'tt' + query['s'] } ] }).encode('ascii')
+        elif self.path.startswith('/title/'):
+            body = ('<div class="image"><a href="#"><img alt="" src="/img/%s.jpg"></a></div>' % self.path[7:]).encode('ascii')
+        else:
+            body = self.image
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class CoverServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+_imagePattern = re.compile(b'<div\\s*class="image">\\s*<a[^>]*>\\s*<img[^>]*\\ssrc="([^"]+)"[^>]*>')
+
+
+def fetchCover(base, title, fetch):
+    # the same three requests VideoCoverflow.Metadata makes for a cover
+    meta = json.loads(fetch('%s/omdb?tomatoes=true&s=%s&y=' % (base, title)).decode('ascii'))['Search'][0]
+    page = fetch('%s/title/%s' % (base, meta['imdbID']))
+    return fetch(base + _imagePattern.search(page).group(1).decode('ascii'))
+
+
+def download(args):
+    CoverHandler.latency = args.latency / 1000.
+    server = CoverServer(('127.0.0.1', 0), CoverHandler)
+    t = Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    base = 'http://127.0.0.1:%d' % (server.server_address[1])
+
+    # the user jumps to a title near the end right after the library loads
+    window = list(range(int(args.covers * 0.8), min(args.covers, int(args.covers * 0.8) + 20)))
+
+    try:
+        sys.stdout.write('%-30s %10s %10s %12s %8s %8s %12s\n' % ('downloader', 'covers/s', 'mean (ms)', 'req mean (ms)', 'opened', 'reused', 'visible (ms)'))
+
+        # one cover at a time, a new connection per request
+        covers = min(args.covers, 20)
+        start = time.time()
+        for k in range(covers):
+            fetchCover(base, 'serial%d' % (k), lambda url: urlopen(url).read())
+        elapsed = time.time() - start
+        sys.stdout.write('%-30s %10.1f %10.1f %12s %8d %8d\n' % ('serial urlopen', covers / elapsed, elapsed * 1000. / covers, '', covers * 3, 0))
+
+        for workers in args.workers:
+            for staged in [False, True]:
+                for prioritize in [False, True]:
+                    done = {}
+                    if staged:
+                        # the stages VideoCoverflow.TileflowWidget runs covers through
+                        def lookup(k, title, fetch):
+                            return json.loads(fetch('%s/omdb?tomatoes=true&s=%s&y=' % (base, title)).decode('ascii'))['Search'][0]
+                        def page(k, meta, fetch):
+                            return _imagePattern.search(fetch('%s/title/%s' % (base, meta['imdbID']))).group(1).decode('ascii')
+                        def image(k, url, fetch):
+                            fetch(base + url)
+                            done[k] = time.time()
+                        pool = Pipeline([('lookup', lookup, workers, 0), ('page', page, workers, 0), ('image', image, workers, 0)], args.rate, burst=max(1, workers))
+                        jobs = [ 's%d_%d_%d' % (workers, prioritize, k) for k in range(args.covers) ]
+                    else:
+                        def job(k):
+                            def run(fetch):
+                                fetchCover(base, 'w%d_%d_%d' % (workers, prioritize, k), fetch)
+                                done[k] = time.time()
+                            return run
+                        pool = DownloadPool(workers, args.rate, burst=max(1, workers))
+                        jobs = [ job(k) for k in range(args.covers) ]
+                    start = time.time()
+                    for k, value in enumerate(jobs):
+                        pool.submit(k, value)
+                    if prioritize:
+                        pool.prioritize(window)
+                    pool.start()
+                    pool.join()
+                    statistics = pool.getStatistics()
+                    pool.stop()
+                    assert statistics['jobs'] == args.covers and statistics['failures'] == 0
+                    visible = max(done[k] for k in window) - start
+                    label = '%s (%d workers%s)' % ('stages' if staged else 'pool', workers, ', prioritized' if prioritize else '')
+                    sys.stdout.write('%-30s %10.1f %10.1f %12.1f %8d %8d %12.1f\n' % (label, statistics['jobs/sec'], statistics['jobs mean latency'] * 1000., statistics['requests mean latency'] * 1000., statistics['opened'], statistics['reused'], visible * 1000.))
+    finally:
+        server.shutdown()
+
+
+def layoutFrames(visibleTiles, frames, vectorized):
+    layout = Layout(visibleTiles=visibleTiles)
+    count = 4 * visibleTiles
+    texCoords = (0., 0., 1., 1.)
+    start = time.time()
+    for frame in range(frames):
+        offset = count * (frame + 0.5) / frames
+        positions = layout.positions(offset, count)
+        offset, mid = layout.centre(offset, count)
+        batch = Batch()
+        if vectorized:
+            batch.addStrip(layout.transforms([ i - offset for i in positions ]), [ i // 16 for i in positions ], [texCoords] * len(positions))
+        else:
+            for i in positions:
+                batch.add(tileTransform(i - offset, 0.14, 0.4, 1), i // 16, texCoords)
+        batch.getData()
+    return (time.time() - start) / frames
+
+
+def layoutBenchmark(args):
+    import layout as layoutModule
+    import renderer as rendererModule
+    if layoutModule.numpy is None:
+        sys.stdout.write('numpy is not installed: only the per-tile path is timed\n')
+    sys.stdout.write('%-12s %16s %16s %10s\n' % ('tiles', 'per tile (ms)', 'numpy (ms)', 'speedup'))
+    for visibleTiles in args.tiles:
+        serial = layoutFrames(visibleTiles, args.frames, False)
+        if layoutModule.numpy is None or rendererModule.numpy is None:
+            sys.stdout.write('%-12d %16.3f %16s %10s\n' % (2 * visibleTiles, serial * 1000., '-', '-'))
+            continue
+        vectorized = layoutFrames(visibleTiles, args.frames, True)
+        sys.stdout.write('%-12d %16.3f %16.3f %9.1fx\n' % (2 * visibleTiles, serial * 1000., vectorized * 1000., serial / max(vectorized, 1e-9)))
+
+
+class CoverTitle(Title):
+    """Stand-in for VideoCoverflow.Media, whose cover is in the cover store."""
+    __slots__ = []
+
+    def getYear(self): return ''
+    def getCoverPath(self): return ''
+    def getFilePaths(self): return []
+
+
+class CoverLibrary(object):
+    """Stand-in for VideoCoverflow as the browser of a TileflowWidget."""
+
+    def __init__(self, titles, settings, defaults, covers):
+        self._titles = titles
+        self._covers = covers
+        self._positions = dict((title.getKey(), k) for k, title in enumerate(titles))
+        self._settings = settings
+        self._defaults = defaults
+
+    def __len__(self): return len(self._titles)
+    def __iter__(self): return iter(self._titles)
+    def __getitem__(self, position): return self._titles[position]
+    def get(self, key): return self._settings.get(key, self._defaults[key])
+    def set(self, key, value): self._settings[key] = str(value)
+    def locate(self, key, insert=False): return self._positions.get(key)
+    def setMessage(self, message): pass
+    def getMetadataCache(self): return None
+    def getCoverStore(self): return self._covers
+    def recordCover(self, key, metadata=None): pass
+
+
+def coverBenchmark(args):
+    rng = random.Random(0)
+    # posters are shared by the titles of several collections
+    images = [ bytes(bytearray(rng.getrandbits(8) for k in range(args.size << 10))) for k in range(args.images) ]
+
+    sys.stdout.write('%-20s %10s %8s %10s %12s %12s %10s %12s\n' % ('titles', 'write (s)', 'files', 'disk (MB)', 'check (us)', 'read (us)', 'open (s)', 'compact (s)'))
+    for count in args.titles:
+        keys = [ 'title %d_%d' % (k, 1950 + k % 60) for k in range(count) ]
+        covers = [ images[rng.randrange(len(images))] for key in keys ]
+        directory = tempfile.mkdtemp(prefix='video-coverflow-')
+        try:
+            # one file per title, as Media.getCoverPath used to lay them out
+            loose = os.path.join(directory, 'loose')
+            start = time.time()
+            for key, cover in zip(keys, covers):
+                path = os.path.join(loose, 'collection %d' % (hash(key) % 8), key)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, 'wb') as f:
+                    f.write(cover)
+            write = time.time() - start
+            paths = [ os.path.join(loose, 'collection %d' % (hash(key) % 8), key) for key in keys ]
+            start = time.time()
+            assert all(os.path.isfile(path) for path in paths)
+            check = (time.time() - start) * 1e6 / count
+            start = time.time()
+            for path in paths:
+                with open(path, 'rb') as f:
+                    f.read()
+            read = (time.time() - start) * 1e6 / count
+            files = sum(len(names) for path, dirs, names in os.walk(loose))
+            disk = sum(os.path.getsize(os.path.join(path, name)) for path, dirs, names in os.walk(loose) for name in names)
+            sys.stdout.write('%-20s %10.3f %8d %10.1f %12.2f %12.2f %10s %12s\n' % ('%d (files)' % (count), write, files, disk / float(1 << 20), check, read, '-', '-'))
+
+            packed = os.path.join(directory, 'covers')
+            store = CoverStore(packed)
+            start = time.time()
+            for key, cover in zip(keys, covers):
+                store.put(key, cover)
+            write = time.time() - start
+            store.close()
+            start = time.time()
+            store = CoverStore(packed)
+            opened = time.time() - start
+            start = time.time()
+            assert all(key in store for key in keys)
+            check = (time.time() - start) * 1e6 / count
+            start = time.time()
+            for key in keys:
+                store.get(key)
+            read = (time.time() - start) * 1e6 / count
+            assert store.verify() == []
+            # a tenth of the covers are replaced
+            for key in rng.sample(keys, count // 10):
+                store.put(key, bytes(bytearray(rng.getrandbits(8) for k in range(args.size << 10))))
+            start = time.time()
+            store.compact()
+            compact = time.time() - start
+            store.close()
+            files = len(os.listdir(packed))
+            disk = sum(os.path.getsize(os.path.join(packed, name)) for name in os.listdir(packed))
+            sys.stdout.write('%-20s %10.3f %8d %10.1f %12.2f %12.2f %10.3f %12.3f\n' % ('%d (store)' % (count), write, files, disk / float(1 << 20), check, read, opened, compact))
+        finally:
+            shutil.rmtree(directory)
+
+
+def makeCovers(QtCore, QtGui, directory, count):
+    """Write `count` distinct synthetic cover images to directory and return their paths."""
+    paths = []
+    for k in range(count):
+        image = QtGui.QImage(400, 600, QtGui.QImage.Format_RGB32)
+        image.fill(QtGui.QColor.fromHsv(k * 360 // count, 160, 200).rgb())
+        painter = QtGui.QPainter(image)
+        painter.setPen(QtGui.QColor(QtCore.Qt.white))
+        for y in range(0, 600, 40):
+            painter.drawLine(0, y, 400, 600 - y)
+        painter.drawText(QtCore.QRect(0, 0, 400, 600), QtCore.Qt.AlignCenter, 'Cover %d' % (k))
+        painter.end()
+        path = os.path.join(directory, 'cover%04d.jpg' % (k))
+        image.save(path)
+        paths.append(path)
+    return paths
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if len(values) == 0: return float('nan')
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def render(args):
+    # software rendering, so that results are comparable across machines without a GPU
+    os.environ.setdefault('LIBGL_ALWAYS_SOFTWARE', '1')
+    # thumbnails are written beneath the (temporary) home directory
+    home = tempfile.mkdtemp()
+    os.environ['HOME'] = home
+    from PySide import QtCore, QtGui
+    from video_coverflow import VideoCoverflow
+
+    app = QtGui.QApplication.instance() or QtGui.QApplication(sys.argv[:1])
+
+    def waitFor(condition, timeout):
+        start = time.time()
+        while not condition() and time.time() - start < timeout:
+            app.processEvents()
+            time.sleep(0.001)
+        return time.time() - start
+
+    def settle(widget):
+        # until the animation has stopped
+        waitFor(lambda: not widget.isAnimating(), 10.)
+
+    try:
+        # every cover image is stored once, whatever the number of titles showing it
+        store = CoverStore(os.path.join(home, 'covers'))
+        images = []
+        for path in makeCovers(QtCore, QtGui, home, args.covers):
+            with open(path, 'rb') as f:
+                images.append(f.read())
+        for k in range(max(args.titles)):
+            store.put(CoverTitle('Title %06d' % (k), None).getKey(), images[k % len(images)])
+        sys.stdout.write('%-22s %10s %10s %10s %10s %10s %8s %10s\n' % ('titles', 'first (s)', 'ready (s)', 'p50 (ms)', 'p99 (ms)', 'frames', 'dropped', 'textures'))
+        for renderer in args.renderer:
+            for count in args.titles:
+                titles = [ CoverTitle('Title %06d' % (k), None) for k in range(count) ]
+                library = CoverLibrary(titles, { 'width': str(args.width), 'height': str(args.height), 'renderer': renderer }, VideoCoverflow._iniDefaults, store)
+
+                start = time.time()
+                widget = VideoCoverflow.TileflowWidget(None, library)
+                widget.resize(args.width, args.height)
+                widget.show()
+                profiler = widget.getProfiler()
+                waitFor(lambda: len(profiler) > 0, 30.)
+                first = time.time() - start
+                waitFor(lambda: widget.missingTiles() == 0, 60.)
+                ready = time.time() - start
+                settle(widget)
+
+                # scripted flings (horizontal wheel events) and jumps (the alphabetical index)
+                scripted = time.time()
+                rng = random.Random(0)
+                for k in range(args.flings):
+                    delta = rng.choice([-1, 1]) * rng.randint(120, 720)
+                    event = QtGui.QWheelEvent(QtCore.QPoint(args.width // 2, args.height // 2), delta, QtCore.Qt.NoButton, QtCore.Qt.NoModifier, QtCore.Qt.Horizontal)
+                    QtGui.QApplication.sendEvent(widget, event)
+                    settle(widget)
+                for k in range(args.jumps):
+                    widget.goTo(rng.randint(0, count - 1))
+                    settle(widget)
+                    waitFor(lambda: widget.missingTiles() == 0, 10.)
+
+                samples = [ sample for sample in profiler.getSamples() if sample['time'] >= scripted ]
+                paints = [ sample['paint'] for sample in samples ]
+                statistics = widget.getTextureStatistics()
+                sys.stdout.write('%-22s %10.3f %10.3f %10.2f %10.2f %10d %8d %8d MB\n' % ('%d (%s)' % (count, renderer), first, ready, percentile(paints, 0.5), percentile(paints, 0.99), len(samples), sum(sample['dropped'] for sample in samples), statistics['bytes'] >> 20))
+
+                widget.stopDownloads()
+                widget.close()
+                widget.deleteLater()
+                app.processEvents()
+    finally:
+        shutil.rmtree(home)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='video-coverflow benchmarks')
+    subparsers = parser.add_subparsers()
+
+    p = subparsers.add_parser('scan', help='directory scanning throughput versus worker count')
+    p.add_argument('--titles', type=int, default=20000)
+    p.add_argument('--episodes', type=int, default=8)
+    p.add_argument('--workers', type=lambda s: [int(w) for w in s.split(',')], default=[1, 2, 4, 8, 16])
+    p.set_defaults(run=scan)
+
+    p = subparsers.add_parser('index', help='cold versus warm startup with the persistent scan index')
+    p.add_argument('--titles', type=int, default=22000)
+    p.add_argument('--episodes', type=int, default=8)
+    p.add_argument('--touch', type=int, default=100)
+    p.set_defaults(run=index)
+
+    p = subparsers.add_parser('parse', help='title parsing throughput, checked against the reference parser')
+    p.add_argument('--names', type=int, default=200000)
+    p.add_argument('--seed', type=int, default=0)
+    p.set_defaults(run=parse)
+
+    p = subparsers.add_parser('search', help='search-box query latency with the inverted index')
+    p.add_argument('--titles', type=int, default=100000)
+    p.add_argument('--legacy', type=int, default=5000, help='titles to time the regex search over (0 to skip)')
+    p.set_defaults(run=search)
+
+    p = subparsers.add_parser('download', help='cover download throughput against a local stand-in server')
+    p.add_argument('--covers', type=int, default=200)
+    p.add_argument('--latency', type=float, default=20., help='simulated server latency per request (ms)')
+    p.add_argument('--workers', type=lambda s: [int(w) for w in s.split(',')], default=[1, 4, 8])
+    p.add_argument('--rate', type=float, default=1000., help='requests per second per host')
+    p.set_defaults(run=download)
+
+    p = subparsers.add_parser('library', help='populating and searching synthetic libraries of scene releases, per stage')
+    p.add_argument('--titles', type=lambda s: [int(t) for t in s.split(',')], default=[1000, 10000, 100000])
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--memory', action='store_true', help='also report the peak memory allocated by every stage (Python 3)')
+    p.set_defaults(run=library)
+
+    p = subparsers.add_parser('trie', help='memory and iteration of the radix trie versus trie.Trie')
+    p.add_argument('--titles', type=lambda s: [int(t) for t in s.split(',')], default=[1000, 10000, 100000])
+    p.set_defaults(run=trieBenchmark)
+
+    p = subparsers.add_parser('order', help='positional access to the library in key order')
+    p.add_argument('--titles', type=int, default=1000000)
+    p.add_argument('--operations', type=int, default=100000)
+    p.set_defaults(run=order)
+
+    p = subparsers.add_parser('catalog', help='memory and access times of the library kept in the SQLite catalog versus in memory')
+    p.add_argument('--titles', type=lambda s: [int(t) for t in s.split(',')], default=[10000, 100000])
+    p.add_argument('--operations', type=int, default=1000)
+    p.set_defaults(run=catalogBenchmark)
+
+    p = subparsers.add_parser('layout', help='per-frame layout and vertex batch building, per tile versus numpy')
+    p.add_argument('--tiles', type=lambda s: [int(t) for t in s.split(',')], default=[10, 100, 1000], help='visible tiles on either side of the centre')
+    p.add_argument('--frames', type=int, default=200)
+    p.set_defaults(run=layoutBenchmark)
+
+    p = subparsers.add_parser('covers', help='cover store (packs read through mmap) versus one file per cover')
+    p.add_argument('--titles', type=lambda s: [int(t) for t in s.split(',')], default=[1000, 10000])
+    p.add_argument('--images', type=int, default=500, help='distinct cover images')
+    p.add_argument('--size', type=int, default=32, help='size of a cover in KB')
+    p.set_defaults(run=coverBenchmark)
+
+    p = subparsers.add_parser('render', help='frame times of the tile flow with synthetic covers (needs a display, e.g. xvfb-run)')
+    p.add_argument('--titles', type=lambda s: [int(t) for t in s.split(',')], default=[100, 10000, 100000])
+    p.add_argument('--covers', type=int, default=64, help='distinct synthetic cover images')
+    p.add_argument('--renderer', type=lambda s: s.split(','), default=['lists', 'batch'])
+    p.add_argument('--flings', type=int, default=20)
+    p.add_argument('--jumps', type=int, default=20)
+    p.add_argument('--width', type=int, default=1024)
+    p.add_argument('--height', type=int, default=576)
+    p.set_defaults(run=render)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
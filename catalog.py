@@ -0,0 +1,492 @@
+import collections
+import itertools
+import sqlite3
+import sys
+from bisect import bisect_left, bisect_right
+
+from searchindex import SearchIndex, toText
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+
+def _successor(prefix):
+    """Return the least string greater than every string starting with prefix."""
+    c = ord(prefix[-1]) + 1
+    return prefix[:-1] + (unichr(c) if isinstance(prefix, type(u'')) else chr(c))
+
+
+class Catalog(object):
+    """The library, kept in an SQLite database instead of in memory.
+
+    Titles (name, year, collection root, whether a cover was stored and
+    the id of their metadata), their video files and the words of their
+    names are stored in tables indexed by key (so by name prefix), by year
+    and by word. The database can be read by other programs while the
+    application runs.
+
+    Like SortedCollection, the catalog gives positional access to the
+    titles in key order, but only the first key and the length of every
+    page of about `load` titles are kept in memory: pages are read when
+    a title on them is needed, and the last few are cached. Titles are
+    built by factory(key, name, year, filePaths, collectionPath).
+
+    >>> class Media(object):
+    ...     def __init__(self, key, name, year, filePaths, collectionPath):
+    ...         self._key, self._name, self._year, self._filePaths = key, name, year, filePaths
+    ...     def addFilePaths(self, filePaths): self._filePaths.extend(filePaths)
+    ...     def getKey(self): return self._key
+    ...     def getName(self): return self._name
+    ...     def getYear(self): return self._year
+    ...     def getFilePaths(self): return self._filePaths[:]
+    ...     def __repr__(self): return self._name
+    >>> catalog = Catalog(':memory:', Media, load=2)
+    >>> names = [('Star Wars', '1977'), ('Stardust', '2007'), ('Start', ''), ('Heat', '1995'), ('Alien', '1979')]
+    >>> catalog.scan(('%s_%s' % (name.lower(), year), name, year, ['/v/%s.avi' % (name)], '/v', '/v/%s.avi' % (name)) for name, year in names)
+    >>> len(catalog), list(catalog)
+    (5, [Alien, Heat, Star Wars, Stardust, Start])
+    >>> catalog[2], catalog.index('stardust_2007'), catalog.bisect('start'), catalog.get('heat_1995').getFilePaths()
+    (Star Wars, 3, 4, ['/v/Heat.avi'])
+    >>> list(catalog.search('sta')), list(catalog.search('star 1979'))
+    ([Star Wars, Stardust, Start], [Star Wars, Alien, Stardust, Start])
+
+    Changes are made file by file: new titles are only positioned (and
+    found by searches) once they are added.
+
+    >>> media = catalog.addFiles('brazil_1985', 'Brazil', '1985', ['/v/Brazil.avi'], '/v', '/v/Brazil.avi')
+    >>> catalog.add(media), len(catalog)
+    (1, 6)
+    >>> sorted(catalog.retract('/v/Heat.avi')), catalog.orphans(['heat_1995'])
+    (['heat_1995'], [Heat])
+    >>> catalog.remove('heat_1995'), list(catalog)
+    (Heat, [Alien, Brazil, Star Wars, Stardust, Start])
+
+    Words are matched as text, whether names are byte strings or not.
+
+    >>> amelie = b'Am\\xc3\\xa9lie' if str is bytes else b'Am\\xc3\\xa9lie'.decode('utf-8')
+    >>> catalog.add(catalog.addFiles('amelie_2001', amelie, '2001', ['/v/a.avi'], '/v', '/v/a.avi'))
+    1
+    >>> len(catalog.search(u'AM\\xc9')), catalog.rank(catalog[1], SearchIndex.tokenize(u'am\\xe9l'))
+    (1, (-1, 0, 'amelie_2001'))
+
+    Covers recorded during a scan (which yields to the application) are
+    written once it is done.
+
+    >>> def records():
+    ...     for name, year in names:
+    ...         catalog.setCover('alien_1979', '7')
+    ...         yield ('%s_%s' % (name.lower(), year), name, year, ['/v/%s.avi' % (name)], '/v', '/v/%s.avi' % (name))
+    >>> catalog.scan(records()); list(catalog)
+    [Alien, Heat, Star Wars, Stardust, Start]
+    >>> catalog._connection.execute("SELECT cover, metadata FROM media WHERE key = 'alien_1979'").fetchone()
+    (1, '7')
+    """
+
+    _version = 1
+    _cachedPages = 8
+    # records stored per statement by scan
+    _batch = 1024
+
+    _schema = [
+          'CREATE TABLE meta (name TEXT PRIMARY KEY, value)'
+        , 'CREATE TABLE roots (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL)'
+        , 'CREATE TABLE media (key TEXT PRIMARY KEY, name TEXT NOT NULL, year TEXT NOT NULL, root INTEGER NOT NULL, cover INTEGER NOT NULL DEFAULT 0, metadata TEXT)'
+        , 'CREATE INDEX media_year ON media (year)'
+        , 'CREATE TABLE files (path TEXT PRIMARY KEY, key TEXT NOT NULL, unit TEXT NOT NULL, generation INTEGER NOT NULL)'
+        , 'CREATE INDEX files_key ON files (key)'
+        , 'CREATE INDEX files_unit ON files (unit)'
+        , 'CREATE TABLE words (word TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (word, key))'
+        , 'CREATE INDEX words_key ON words (key)'
+    ]
+
+    def __init__(self, path, factory, load=256):
+        self._connection = sqlite3.connect(path)
+        if sys.version_info[0] < 3:
+            # file names are byte strings
+            self._connection.text_factory = str
+        # readers do not block the application (nor the other way round)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        # scans insert into the word and file indexes in no particular order
+        self._connection.execute('PRAGMA cache_size=-32768')
+        self._factory = factory
+        self._load = load
+
+        tables = [ name for (name,) in self._connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'") ]
+        if 'meta' not in tables or self.getMeta('version') != Catalog._version:
+            for name in tables:
+                self._connection.execute('DROP TABLE %s' % (name))
+            for statement in Catalog._schema:
+                self._connection.execute(statement)
+            self.setMeta('version', Catalog._version)
+            self.setMeta('generation', 0)
+            self._connection.commit()
+
+        self._rootIds = dict(self._connection.execute('SELECT path, id FROM roots'))
+        self._rootPaths = dict((i, path) for path, i in self._rootIds.items())
+        # titles recorded by addFiles but not added yet
+        self._pending = {}
+        # covers recorded while a scan is under way (None otherwise)
+        self._covers = None
+        self._pages = collections.OrderedDict()
+        self.rebuild()
+
+    def getMeta(self, name):
+        row = self._connection.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return row[0] if row is not None else None
+
+    def setMeta(self, name, value):
+        self._connection.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', (name, value))
+
+    def commit(self): self._connection.commit()
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+
+    @staticmethod
+    def words(name): return set(toText(name).lower().split())
+
+    def root(self, path):
+        """Return the id of a collection root, recording it if needed."""
+        i = self._rootIds.get(path)
+        if i is None:
+            i = self._connection.execute('INSERT INTO roots (path) VALUES (?)', (path,)).lastrowid
+            self._rootIds[path] = i
+            self._rootPaths[i] = path
+        return i
+
+    def insertTitle(self, key, name, year, root):
+        """Store a title (if it is not already) and index its name; return True if it was new."""
+        if self._connection.execute('INSERT OR IGNORE INTO media (key, name, year, root) VALUES (?, ?, ?, ?)', (key, name, year, root)).rowcount == 0:
+            return False
+        self._connection.executemany('INSERT OR IGNORE INTO words (word, key) VALUES (?, ?)', [ (word, key) for word in Catalog.words(name) ])
+        return True
+
+    def scan(self, records):
+        """Replace the files of the library by records, keeping what is known about the titles that remain.
+
+        Records are (key, name, year, filePaths, collectionPath, unit)
+        tuples, unit being the library entry that contributed the files.
+        The scan is one transaction: covers recorded while records are
+        consumed are only written once it is complete.
+        """
+        generation = self.getMeta('generation') + 1
+        records = iter(records)
+        self._covers = []
+        try:
+            while True:
+                batch = list(itertools.islice(records, Catalog._batch))
+                if not batch: break
+                # titles already stored (and their words) are left as they are
+                self._connection.executemany('INSERT OR IGNORE INTO media (key, name, year, root) VALUES (?, ?, ?, ?)', [ (key, name, year if year is not None else '', self.root(collectionPath)) for key, name, year, filePaths, collectionPath, unit in batch ])
+                self._connection.executemany('INSERT OR IGNORE INTO words (word, key) VALUES (?, ?)', [ (word, key) for key, name, year, filePaths, collectionPath, unit in batch for word in Catalog.words(name) ])
+                self._connection.executemany('INSERT OR REPLACE INTO files (path, key, unit, generation) VALUES (?, ?, ?, ?)', [ (path, key, unit, generation) for key, name, year, filePaths, collectionPath, unit in batch for path in filePaths ])
+        finally:
+            covers, self._covers = self._covers, None
+        # drop the files no longer found, then the titles left without any
+        self._connection.execute('DELETE FROM files WHERE generation != ?', (generation,))
+        self._connection.execute('DELETE FROM words WHERE key NOT IN (SELECT key FROM files)')
+        self._connection.execute('DELETE FROM media WHERE key NOT IN (SELECT key FROM files)')
+        self.setMeta('generation', generation)
+        self._connection.executemany('UPDATE media SET cover = 1, metadata = coalesce(?, metadata) WHERE key = ?', [ (metadata, key) for key, metadata in covers ])
+        self._connection.commit()
+        self._pending = {}
+        self.rebuild()
+
+    def rebuild(self):
+        """Split the titles into pages (walking the key index once)."""
+        load = self._load
+        firsts = ['']
+        counts = [0]
+        for k, (key,) in enumerate(self._connection.execute('SELECT key FROM media ORDER BY key')):
+            if k > 0 and k % load == 0:
+                firsts.append(key)
+                counts.append(0)
+            counts[-1] += 1
+        # page i holds the keys from firsts[i] up to (excluding) firsts[i + 1]
+        self._firsts = firsts
+        self._counts = counts
+        self._len = sum(counts)
+        self._pages.clear()
+        self._rebuildTree()
+
+    def _rebuildTree(self):
+        # tree[i] holds the number of titles on pages i - (i & -i) to i - 1
+        tree = [0] + self._counts
+        for i in range(1, len(tree)):
+            j = i + (i & -i)
+            if j < len(tree):
+                tree[j] += tree[i]
+        self._tree = tree
+
+    def _grow(self, page, delta):
+        self._counts[page] += delta
+        tree = self._tree
+        i = page + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def _before(self, page):
+        """Return the number of titles on the pages before page."""
+        tree = self._tree
+        count = 0
+        i = page
+        while i > 0:
+            count += tree[i]
+            i -= i & -i
+        return count
+
+    def _select(self, position):
+        """Return (page, offset) of the title at position."""
+        tree = self._tree
+        page = 0
+        step = 1
+        while step * 2 < len(tree):
+            step *= 2
+        while step > 0:
+            if page + step < len(tree) and tree[page + step] <= position:
+                page += step
+                position -= tree[page]
+            step //= 2
+        return page, position
+
+    def _range(self, page):
+        """Return the condition selecting the keys of a page, and its arguments."""
+        if page + 1 < len(self._firsts):
+            return 'key >= ? AND key < ?', (self._firsts[page], self._firsts[page + 1])
+        return 'key >= ?', (self._firsts[page],)
+
+    def _page(self, page):
+        """Return (keys, titles) of a page."""
+        entry = self._pages.pop(page, None)
+        if entry is None:
+            where, args = self._range(page)
+            entry = self.read('SELECT key, name, year, root FROM media WHERE %s ORDER BY key' % (where), 'SELECT key, path FROM files WHERE %s' % (where), args)
+        self._pages[page] = entry
+        if len(self._pages) > Catalog._cachedPages:
+            self._pages.popitem(last=False)
+        return entry
+
+    def read(self, titles, files, args):
+        """Return (keys, titles) of the rows selected by two queries with the same arguments."""
+        filePaths = {}
+        for key, path in self._connection.execute(files, args):
+            filePaths.setdefault(key, []).append(path)
+        keys = []
+        medias = []
+        for key, name, year, root in self._connection.execute(titles, args):
+            keys.append(key)
+            medias.append(self._factory(key, name, year, sorted(filePaths.get(key, [])), self._rootPaths[root]))
+        return keys, medias
+
+    def readKeys(self, keys):
+        """Return the titles with the given keys, in the same order."""
+        marks = ', '.join('?' * len(keys))
+        found = dict(zip(*self.read('SELECT key, name, year, root FROM media WHERE key IN (%s)' % (marks), 'SELECT key, path FROM files WHERE key IN (%s)' % (marks), tuple(keys))))
+        return [ found[key] for key in keys ]
+
+    def __len__(self): return self._len
+
+    def __iter__(self):
+        for page in range(len(self._firsts)):
+            for media in self._page(page)[1]:
+                yield media
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += self._len
+        if not 0 <= position < self._len:
+            raise IndexError(position)
+        page, offset = self._select(position)
+        return self._page(page)[1][offset]
+
+    def _find(self, key):
+        """Return (page, offset) of key, or raise KeyError."""
+        page = bisect_right(self._firsts, key) - 1
+        keys = self._page(page)[0]
+        offset = bisect_left(keys, key)
+        if offset < len(keys) and keys[offset] == key:
+            return page, offset
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self._find(key)
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            page, offset = self._find(key)
+        except KeyError:
+            return default
+        return self._page(page)[1][offset]
+
+    def index(self, key):
+        """Return the position of the title with key, or raise KeyError."""
+        page, offset = self._find(key)
+        return self._before(page) + offset
+
+    def bisect(self, key):
+        """Return the position of the first title whose key is not less than key."""
+        page = bisect_right(self._firsts, key) - 1
+        return self._before(page) + bisect_left(self._page(page)[0], key)
+
+    def addFiles(self, key, name, year, filePaths, collectionPath, unit):
+        """Record the video files of a library entry.
+
+        If they belong to a title not in the catalog yet, the title is
+        returned (once); it is stored when it is added.
+        """
+        self._connection.executemany('INSERT OR REPLACE INTO files (path, key, unit, generation) VALUES (?, ?, ?, ?)', [ (path, key, unit, self.getMeta('generation')) for path in filePaths ])
+        # cached titles may have gained files
+        self._pages.clear()
+        if key in self._pending:
+            self._pending[key][0].addFilePaths(filePaths)
+            return None
+        if self._connection.execute('SELECT 1 FROM media WHERE key = ?', (key,)).fetchone() is not None:
+            return None
+        media = self._factory(key, name, year if year is not None else '', filePaths[:], collectionPath)
+        self._pending[key] = (media, collectionPath)
+        return media
+
+    def retract(self, unit):
+        """Forget the files a library entry contributed, returning the keys of their titles."""
+        keys = set(key for (key,) in self._connection.execute('SELECT key FROM files WHERE unit = ?', (unit,)))
+        self._connection.execute('DELETE FROM files WHERE unit = ?', (unit,))
+        self._pages.clear()
+        return keys
+
+    def orphans(self, keys):
+        """Return the titles among keys that have no files left."""
+        return [ self.get(key) for key in keys if key in self and self._connection.execute('SELECT 1 FROM files WHERE key = ? LIMIT 1', (key,)).fetchone() is None ]
+
+    def add(self, media):
+        """Store a title returned by addFiles and return its position."""
+        key = media.getKey()
+        media, collectionPath = self._pending.pop(key)
+        self.insertTitle(key, media.getName(), media.getYear(), self.root(collectionPath))
+        page = bisect_right(self._firsts, key) - 1
+        self._grow(page, 1)
+        self._len += 1
+        if self._counts[page] > 2 * self._load:
+            # split the page in halves
+            where, args = self._range(page)
+            half = self._counts[page] // 2
+            (first,) = self._connection.execute('SELECT key FROM media WHERE %s ORDER BY key LIMIT 1 OFFSET ?' % (where), args + (half,)).fetchone()
+            self._firsts.insert(page + 1, first)
+            self._counts[page:page + 1] = [half, self._counts[page] - half]
+            self._rebuildTree()
+        self._pages.clear()
+        return self.index(key)
+
+    def remove(self, key):
+        """Delete the title with key (and any files left), returning it; raise KeyError if there is none."""
+        page, offset = self._find(key)
+        media = self._page(page)[1][offset]
+        for table in ['words', 'files', 'media']:
+            self._connection.execute('DELETE FROM %s WHERE key = ?' % (table), (key,))
+        self._grow(page, -1)
+        self._len -= 1
+        if self._counts[page] == 0 and page > 0:
+            # the previous page takes over its keys
+            del self._firsts[page]
+            del self._counts[page]
+            self._rebuildTree()
+        self._pages.clear()
+        return media
+
+    def setCover(self, key, metadata=None):
+        """Record that a title has a cover, and the id of the metadata it was found with."""
+        if self._covers is not None:
+            # committing now would write half a scan
+            self._covers.append((key, metadata))
+            return
+        self._connection.execute('UPDATE media SET cover = 1, metadata = coalesce(?, metadata) WHERE key = ?', (metadata, key))
+        self._connection.commit()
+
+    def rank(self, media, tokens):
+        """Return what orders a title among the results for the (tokenized) query tokens, or None if it is not one."""
+        words = Catalog.words(media.getName())
+        count = sum(1 for token in tokens if token == media.getYear() or any(word.startswith(token) for word in words))
+        if count == 0:
+            return None
+        return (-count, -sum(1 for token in tokens if token in words), media.getKey())
+
+    def search(self, query, within=None):
+        """Return the titles with a word starting with (or the year of) at least one token of query, best first.
+
+        Titles are ranked by the number of tokens found, then by the number
+        of whole words matched, as by SearchIndex. The indexes answer every
+        query, so within is not needed.
+        """
+        tokens = SearchIndex.tokenize(query)
+        matches = {}
+        words = {}
+        for token in set(tokens):
+            weight = tokens.count(token)
+            keys = set(key for (key,) in self._connection.execute('SELECT key FROM words WHERE word >= ? AND word < ?', (token, _successor(token))))
+            keys.update(key for (key,) in self._connection.execute('SELECT key FROM media WHERE year = ?', (token,)))
+            for key in keys:
+                matches[key] = matches.get(key, 0) + weight
+            for (key,) in self._connection.execute('SELECT key FROM words WHERE word = ?', (token,)):
+                words[key] = words.get(key, 0) + weight
+
+        buckets = {}
+        for key, count in matches.items():
+            buckets.setdefault((count, words.get(key, 0)), []).append(key)
+        results = []
+        for score in sorted(buckets, reverse=True):
+            results.extend(sorted(buckets[score]))
+        return CatalogResults(self, results, self._load)
+
+
+class CatalogResults(object):
+    """Titles of the catalog in a given order (e.g. search results), kept as keys and read a page at a time."""
+
+    def __init__(self, catalog, keys, load=256):
+        self._catalog = catalog
+        self._keys = keys
+        self._load = load
+        self._pages = collections.OrderedDict()
+
+    def __len__(self): return len(self._keys)
+
+    def __iter__(self):
+        for start in range(0, len(self._keys), self._load):
+            for media in self._page(start // self._load):
+                yield media
+
+    def _page(self, page):
+        medias = self._pages.pop(page, None)
+        if medias is None:
+            medias = self._catalog.readKeys(self._keys[page * self._load:(page + 1) * self._load])
+        self._pages[page] = medias
+        if len(self._pages) > Catalog._cachedPages:
+            self._pages.popitem(last=False)
+        return medias
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self._keys)
+        if not 0 <= position < len(self._keys):
+            raise IndexError(position)
+        return self._page(position // self._load)[position % self._load]
+
+    def __delitem__(self, position):
+        del self._keys[position]
+        self._pages.clear()
+
+    def insert(self, position, media):
+        self._keys.insert(position, media.getKey())
+        self._pages.clear()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,510 @@
+import heapq
+import socket
+import sys
+import time
+from threading import Condition, Lock, Thread
+
+if sys.version_info[0] >= 3:
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+    from urllib.parse import urljoin, urlsplit
+else:
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+    from urlparse import urljoin, urlsplit
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket: `rate` tokens per second, at most `burst` saved up.
+
+    >>> bucket = TokenBucket(rate=1000., burst=2)
+    >>> start = time.time()
+    >>> for k in range(12): bucket.acquire()
+    >>> 0.005 < time.time() - start < 1.
+    True
+    """
+
+    def __init__(self, rate, burst=1):
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._tokens = float(burst)
+        self._last = time.time()
+        self._lock = Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+                self._last = now
+                if self._tokens >= 1.:
+                    self._tokens -= 1.
+                    return
+                wait = (1. - self._tokens) / self._rate
+            time.sleep(wait)
+
+
+class HTTPError(IOError):
+    """A request was answered with an unexpected status."""
+
+    def __init__(self, status, url):
+        IOError.__init__(self, 'HTTP %d for %s' % (status, url))
+        self.status = status
+
+
+class ConnectionPool(object):
+    """Keeps idle HTTP/1.1 connections per host so that requests reuse them."""
+
+    _maxRedirects = 5
+    _userAgent = 'video-coverflow'
+
+    def __init__(self, timeout=30):
+        self._timeout = timeout
+        self._idle = {}
+        self._lock = Lock()
+        self._opened = 0
+        self._reused = 0
+
+    def getStatistics(self):
+        with self._lock:
+            return { 'opened': self._opened, 'reused': self._reused }
+
+    def acquire(self, scheme, netloc):
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                self._reused += 1
+                return idle.pop(), True
+            self._opened += 1
+        cls = HTTPSConnection if scheme == 'https' else HTTPConnection
+        return cls(netloc, timeout=self._timeout), False
+
+    def release(self, scheme, netloc, connection):
+        with self._lock:
+            self._idle.setdefault((scheme, netloc), []).append(connection)
+
+    def close(self):
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle.clear()
+
+    def send(self, scheme, netloc, path):
+        """Send a GET request, returning (response, body)."""
+        connection, reused = self.acquire(scheme, netloc)
+        try:
+            connection.request('GET', path, headers={ 'User-Agent': ConnectionPool._userAgent })
+            response = connection.getresponse()
+            body = response.read()
+        except (HTTPException, socket.error):
+            connection.close()
+            if not reused:
+                raise
+            # the server closed an idle connection; retry on another one
+            return self.send(scheme, netloc, path)
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.release(scheme, netloc, connection)
+        return response, body
+
+    def get(self, url):
+        """GET a url and return its body, following redirects."""
+        for k in range(ConnectionPool._maxRedirects + 1):
+            parts = urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path = '%s?%s' % (path, parts.query)
+            response, body = self.send(parts.scheme, parts.netloc, path)
+
+            if response.status in (301, 302, 303, 307, 308):
+                url = urljoin(url, response.getheader('Location'))
+                continue
+            if response.status != 200:
+                raise HTTPError(response.status, url)
+            return body
+        raise IOError('too many redirects for %s' % (url))
+
+
+class Statistics(object):
+    """Thread-safe throughput and latency counters."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._start = time.time()
+        self._counts = { 'jobs': 0, 'failures': 0, 'retries': 0, 'cancelled': 0, 'requests': 0, 'bytes': 0 }
+        self._latency = { 'jobs': [0., 0.], 'requests': [0., 0.] } # [total, max]
+
+    def add(self, name, count=1):
+        with self._lock:
+            self._counts[name] += count
+
+    def time(self, name, seconds):
+        with self._lock:
+            latency = self._latency[name]
+            latency[0] += seconds
+            latency[1] = max(latency[1], seconds)
+
+    def get(self):
+        with self._lock:
+            elapsed = max(time.time() - self._start, 1e-9)
+            statistics = dict(self._counts)
+            statistics['jobs/sec'] = self._counts['jobs'] / elapsed
+            statistics['bytes/sec'] = self._counts['bytes'] / elapsed
+            for name, (total, worst) in self._latency.items():
+                count = self._counts[name] + (self._counts['failures'] if name == 'jobs' else 0)
+                statistics['%s mean latency' % name] = total / count if count else 0.
+                statistics['%s max latency' % name] = worst
+            return statistics
+
+
+def isTransient(exc):
+    """Return True if a failed request may succeed when retried later.
+
+    >>> isTransient(HTTPError(503, 'http://example.com/')), isTransient(HTTPError(404, 'http://example.com/'))
+    (True, False)
+    >>> isTransient(socket.timeout()), isTransient(IOError('no match'))
+    (True, False)
+    """
+    if isinstance(exc, HTTPError):
+        return exc.status == 429 or exc.status >= 500
+    # errors raised by the socket layer carry an errno
+    return isinstance(exc, (socket.timeout, HTTPException)) or (isinstance(exc, socket.error) and exc.errno is not None)
+
+
+class JobQueue(object):
+    """Thread-safe priority queue of keyed items.
+
+    Items are handed out in the order they were put, except that prioritize
+    moves queued items to the front. An item may be put with a delay, in
+    which case it only becomes available once the delay has passed. Putting
+    a key that is already queued replaces its item, which goes to the back.
+
+    >>> queue = JobQueue()
+    >>> for key in ['a', 'b', 'c', 'd']: queue.put(key, key.upper())
+    >>> queue.prioritize(['c', 'x'])
+    >>> queue.prioritize(['d', 'b'])
+    >>> [queue.get() for k in range(4)]
+    [('d', 'D'), ('b', 'B'), ('c', 'C'), ('a', 'A')]
+    >>> queue.put('e', 'E', delay=0.05); queue.put('f', 'F')
+    >>> queue.get(), queue.get()
+    (('f', 'F'), ('e', 'E'))
+    >>> queue.put('k', 1); queue.put('l', 2); queue.put('k', 3); len(queue)
+    2
+    >>> queue.get(), queue.get()
+    (('l', 2), ('k', 3))
+    >>> queue.close(); queue.get() is None
+    True
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._ready = Condition(self._lock)
+        # heap of [rank, sequence, key] entries; a key of None marks an entry
+        # superseded by a later push of the same key
+        self._heap = []
+        self._queued = {}
+        # heap of (time, sequence, key, value) not to be handed out before time
+        self._delayed = []
+        self._sequence = 0
+        self._front = 0
+        self._closed = False
+
+    def __len__(self):
+        with self._lock:
+            return len(self._queued) + len(self._delayed)
+
+    def push(self, rank, key, value):
+        queued = self._queued.get(key)
+        if queued is not None:
+            queued[0][2] = None
+            # superseded entries are dropped once they outnumber live ones
+            if len(self._heap) > 2 * len(self._queued) + 64:
+                self._heap = [ entry for entry in self._heap if entry[2] is not None ]
+                heapq.heapify(self._heap)
+        entry = [rank, self._sequence, key]
+        self._sequence += 1
+        self._queued[key] = (entry, value)
+        heapq.heappush(self._heap, entry)
+
+    def put(self, key, value, delay=0.):
+        with self._lock:
+            if delay > 0.:
+                heapq.heappush(self._delayed, (time.time() + delay, self._sequence, key, value))
+                self._sequence += 1
+            else:
+                self.push(0, key, value)
+            self._ready.notify()
+
+    def prioritize(self, keys):
+        """Move the queued items for keys (most urgent first) to the front of the queue.
+
+        Keys that are not queued (unknown, delayed or taken) are ignored.
+        """
+        with self._lock:
+            self._front -= 1
+            for key in keys:
+                queued = self._queued.get(key)
+                if queued is None: continue
+                self.push(self._front, key, queued[1])
+
+    def clear(self):
+        """Drop every queued and delayed item."""
+        with self._lock:
+            self._heap = []
+            self._queued = {}
+            self._delayed = []
+
+    def open(self):
+        with self._lock:
+            self._closed = False
+
+    def close(self):
+        """Wake every blocked get, which then returns None."""
+        with self._lock:
+            self._closed = True
+            self._ready.notify_all()
+
+    def get(self):
+        """Block until an item is available and return (key, value), or None once closed."""
+        with self._ready:
+            while True:
+                if self._closed:
+                    return None
+                now = time.time()
+                while self._delayed and self._delayed[0][0] <= now:
+                    ready, sequence, key, value = heapq.heappop(self._delayed)
+                    self.push(0, key, value)
+                while self._heap:
+                    key = heapq.heappop(self._heap)[2]
+                    if key is not None:
+                        return key, self._queued.pop(key)[1]
+                self._ready.wait(self._delayed[0][0] - now if self._delayed else None)
+
+
+class Pipeline(object):
+    """Runs keyed items through a sequence of stages, each on its own threads.
+
+    stages is a list of (name, function, workers, retries). A stage function
+    is called as function(key, value, fetch) and returns the value handed to
+    the next stage, or None to stop the item there. At most `workers` items
+    are in a stage at a time, so a slow stage does not hold up the others.
+    A stage that fails with a transient error (see isTransient) is retried
+    up to `retries` times, after delays that double from `backoff` seconds;
+    other exceptions are counted as failures and reported through
+    onError(key, exception), if given.
+
+    Requests made through fetch (url -> body) are limited to `rate` per
+    second per host (with bursts of up to `burst`) and reuse keep-alive
+    connections. A key that is already in the pipeline is not submitted
+    again. cancel drops every item; items that are inside a stage when it is
+    called are dropped as soon as the stage returns.
+
+    >>> calls = []
+    >>> def lookup(key, value, fetch):
+    ...     calls.append(key)
+    ...     if calls.count(key) == 1 and key == 'b': raise socket.timeout()
+    ...     return None if key == 'c' else value * 2
+    >>> done = []
+    >>> pipeline = Pipeline([('lookup', lookup, 2, 1), ('write', lambda key, value, fetch: done.append((key, value)), 1, 0)], backoff=0.01)
+    >>> pipeline.start()
+    >>> for key, value in [('a', 1), ('b', 2), ('c', 3)]: ok = pipeline.submit(key, value)
+    >>> pipeline.join()
+    >>> sorted(done), sorted(calls)
+    ([('a', 2), ('b', 4)], ['a', 'b', 'b', 'c'])
+    >>> statistics = pipeline.getStatistics()
+    >>> lookups = statistics['stages']['lookup']
+    >>> statistics['jobs'], statistics['retries'], lookups['done'], lookups['failed']
+    (3, 1, 3, 1)
+    >>> pipeline.stop()
+
+    >>> pipeline = Pipeline([('slow', lambda key, value, fetch: time.sleep(0.05), 1, 0)])
+    >>> pipeline.start()
+    >>> for key in range(10): ok = pipeline.submit(key, key)
+    >>> len(pipeline)
+    10
+    >>> pipeline.cancel(); pipeline.join()
+    >>> pipeline.getStatistics()['cancelled']
+    10
+    >>> pipeline.stop()
+    """
+
+    _backoff = 1.
+
+    def __init__(self, stages, rate=2., burst=2, timeout=30, onError=None, backoff=None):
+        self._names = [ name for name, function, workers, retries in stages ]
+        self._functions = [ function for name, function, workers, retries in stages ]
+        self._workers = [ max(1, int(workers)) for name, function, workers, retries in stages ]
+        self._retries = [ retries for name, function, workers, retries in stages ]
+        self._queues = [ JobQueue() for stage in stages ]
+        self._counts = [ { 'running': 0, 'done': 0, 'failed': 0 } for stage in stages ]
+        self._rate = float(rate)
+        self._burst = burst
+        self._backoff = backoff if backoff is not None else Pipeline._backoff
+        self._onError = onError
+        self._connections = ConnectionPool(timeout)
+        self._statistics = Statistics()
+        self._buckets = {}
+        self._lock = Lock()
+        # key -> (generation, submission time) of every item in the pipeline
+        self._pending = {}
+        self._generation = 0
+        self._idle = Condition(self._lock)
+        self._threads = []
+
+    def start(self):
+        for stage, queue in enumerate(self._queues):
+            queue.open()
+            for k in range(self._workers[stage]):
+                t = Thread(target=self.run, args=(stage,))
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+
+    def stop(self):
+        for queue in self._queues:
+            queue.close()
+        self._threads = []
+        self._connections.close()
+
+    def __len__(self):
+        """Return the number of items in the pipeline."""
+        with self._lock:
+            return len(self._pending)
+
+    def submit(self, key, value):
+        """Queue an item; returns False if an item with this key is already in the pipeline."""
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending[key] = (self._generation, time.time())
+            generation = self._generation
+        self._queues[0].put(key, (generation, 0, value))
+        return True
+
+    def prioritize(self, keys):
+        """Move the items for keys (most urgent first) to the front of every stage."""
+        keys = list(keys)
+        for queue in self._queues:
+            queue.prioritize(keys)
+
+    def cancel(self):
+        """Drop every item in the pipeline."""
+        with self._idle:
+            self._generation += 1
+            for queue in self._queues:
+                queue.clear()
+            self._statistics.add('cancelled', len(self._pending))
+            self._pending.clear()
+            self._idle.notify_all()
+
+    def join(self):
+        """Block until the pipeline is empty."""
+        with self._idle:
+            while self._pending:
+                self._idle.wait()
+
+    def getStatistics(self):
+        statistics = self._statistics.get()
+        statistics.update(self._connections.getStatistics())
+        with self._lock:
+            statistics['pending'] = len(self._pending)
+            statistics['stages'] = dict((name, dict(counts, queued=len(queue))) for name, counts, queue in zip(self._names, self._counts, self._queues))
+        return statistics
+
+    def bucket(self, host):
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self._rate, self._burst)
+            return bucket
+
+    def fetch(self, url):
+        self.bucket(urlsplit(url).netloc).acquire()
+        start = time.time()
+        body = self._connections.get(url)
+        self._statistics.time('requests', time.time() - start)
+        self._statistics.add('requests')
+        self._statistics.add('bytes', len(body))
+        return body
+
+    def isCurrent(self, generation):
+        with self._lock:
+            return generation == self._generation
+
+    def finish(self, key, generation, failed=False):
+        with self._idle:
+            pending = self._pending.get(key)
+            if pending is None or pending[0] != generation:
+                return
+            del self._pending[key]
+            self._statistics.add('failures' if failed else 'jobs')
+            self._statistics.time('jobs', time.time() - pending[1])
+            if not self._pending:
+                self._idle.notify_all()
+
+    def run(self, stage):
+        queue = self._queues[stage]
+        counts = self._counts[stage]
+        function = self._functions[stage]
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            key, (generation, attempt, value) = item
+            if not self.isCurrent(generation):
+                continue
+
+            with self._lock:
+                counts['running'] += 1
+            try:
+                result = function(key, value, self.fetch)
+                exc = None
+            except Exception as e:
+                result, exc = None, e
+            with self._lock:
+                counts['running'] -= 1
+                counts['failed' if exc is not None else 'done'] += 1
+
+            if not self.isCurrent(generation):
+                continue
+            if exc is not None:
+                if attempt < self._retries[stage] and isTransient(exc):
+                    self._statistics.add('retries')
+                    queue.put(key, (generation, attempt + 1, value), self._backoff * 2 ** attempt)
+                    continue
+                self.finish(key, generation, True)
+                if self._onError is not None:
+                    self._onError(key, exc)
+            elif result is None or stage + 1 == len(self._queues):
+                self.finish(key, generation)
+            else:
+                self._queues[stage + 1].put(key, (generation, 0, result))
+
+
+class DownloadPool(Pipeline):
+    """A bounded pool of threads running download jobs.
+
+    A job is a callable taking a `fetch` function (url -> body); see
+    Pipeline, of which this is the single-stage case.
+
+    >>> pool = DownloadPool(workers=1)
+    >>> done = []
+    >>> for key in ['a', 'b', 'c', 'd']:
+    ...     ok = pool.submit(key, lambda fetch, key=key: done.append(key))
+    >>> pool.prioritize(['c', 'x'])
+    >>> pool.prioritize(['d', 'b'])
+    >>> pool.start()
+    >>> pool.join()
+    >>> done
+    ['d', 'b', 'c', 'a']
+    >>> pool.stop()
+    """
+
+    def __init__(self, workers=4, rate=2., burst=2, timeout=30, onError=None, retries=0):
+        Pipeline.__init__(self, [('download', lambda key, job, fetch: job(fetch), workers, retries)], rate, burst, timeout, onError)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,305 @@
+import binascii
+import hashlib
+import mmap
+import os
+import re
+import struct
+import sys
+from threading import Lock
+
+
+def _encode(key): return key if isinstance(key, bytes) else key.encode('utf-8')
+
+def _decode(data): return data if str is bytes else data.decode('utf-8')
+
+def _hex(digest): return binascii.hexlify(digest).decode('ascii')
+
+
+class CoverStore(object):
+    """Covers kept in a few append-only pack files, addressed by content.
+
+    Every image is stored once, however many titles show it: it is
+    appended to the current pack as a header (its SHA-1 digest and length)
+    followed by the image, and read back through mmap. The index maps the
+    key of every title to the digest of its cover; it is an append-only
+    log of (key, digest) records, the last record of a key winning. Where
+    every image lies is found by walking the pack headers when the store is
+    opened.
+
+    Replaced covers (and covers no title uses any more) stay in the packs
+    until compact() rewrites them; verify() checks every image against its
+    digest. The store may be used from several threads at once.
+
+    >>> import shutil, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> store = CoverStore(directory)
+    >>> digest = store.put('alien_1979', b'poster')
+    >>> store.put('aliens_1986', b'poster') == digest
+    True
+    >>> store.put('heat_1995', b'first') != store.put('heat_1995', b'second')
+    True
+    >>> store.get('heat_1995') == b'second', 'brazil_1985' in store, len(store)
+    (True, False, 3)
+    >>> statistics = store.getStatistics()
+    >>> statistics['images'], statistics['bytes'], statistics['garbage']
+    (2, 12, 5)
+    >>> store.close()
+    >>> store = CoverStore(directory)
+    >>> store.read(store.getDigest('aliens_1986')) == b'poster', store.compact()
+    (True, 29)
+    >>> store.getStatistics()['packs'], store.verify()
+    (1, [])
+    >>> store.close(); shutil.rmtree(directory)
+    """
+
+    _indexFilename = 'index'
+    _packPattern = re.compile(r'^pack-(\d+)\.pack$')
+    # a new pack is started once the current one is this large
+    _packSize = 64 << 20
+
+    _header = struct.Struct('>20sI')
+    _recordHeader = struct.Struct('>H')
+    _removed = b'\0' * 20
+
+    def __init__(self, directory):
+        self._directory = directory
+        self._lock = Lock()
+        # key -> digest
+        self._keys = {}
+        # digest -> (pack, offset, length)
+        self._images = {}
+        # pack -> mmap (or None while it is empty)
+        self._maps = {}
+        self._sizes = {}
+        self._index = None
+        self._pack = None
+
+        if os.path.isdir(directory):
+            for name in sorted(os.listdir(directory)):
+                m = CoverStore._packPattern.match(name)
+                if m is not None:
+                    self.scanPack(int(m.group(1)))
+            self.loadIndex()
+
+    def getPackPath(self, pack): return os.path.join(self._directory, 'pack-%06d.pack' % (pack))
+
+    def mapPack(self, pack):
+        """Return a read-only map of a pack, or None while it is empty."""
+        path = self.getPackPath(pack)
+        if os.path.getsize(path) == 0:
+            return None
+        with open(path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def scanPack(self, pack):
+        """Record where the images of a pack lie, truncating an image cut short (by a crash)."""
+        header = CoverStore._header
+        data = self.mapPack(pack)
+        size = len(data) if data is not None else 0
+        offset = 0
+        while offset + header.size <= size:
+            digest, length = header.unpack_from(data, offset)
+            if offset + header.size + length > size:
+                break
+            self._images[digest] = (pack, offset + header.size, length)
+            offset += header.size + length
+        if offset < size:
+            path = self.getPackPath(pack)
+            sys.stderr.write('warning: dropping %d bytes at the end of `%s`\r\n' % (size - offset, path))
+            data.close()
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+            data = self.mapPack(pack)
+        self._maps[pack] = data
+        self._sizes[pack] = offset
+
+    def loadIndex(self):
+        path = os.path.join(self._directory, CoverStore._indexFilename)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return
+        recordHeader = CoverStore._recordHeader
+        offset = 0
+        while offset + recordHeader.size <= len(data):
+            (length,) = recordHeader.unpack_from(data, offset)
+            end = offset + recordHeader.size + length + 20
+            if end > len(data):
+                break
+            key = _decode(data[offset + recordHeader.size:end - 20])
+            digest = data[end - 20:end]
+            if digest == CoverStore._removed:
+                self._keys.pop(key, None)
+            else:
+                self._keys[key] = digest
+            offset = end
+        if offset < len(data):
+            sys.stderr.write('warning: dropping %d bytes at the end of `%s`\r\n' % (len(data) - offset, path))
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+
+    def __len__(self): return len(self._keys)
+
+    def __contains__(self, key): return key in self._keys
+
+    def getDigest(self, key):
+        """Return the (hexadecimal) digest of the cover of a title, or None if it has none."""
+        digest = self._keys.get(key)
+        return _hex(digest) if digest is not None else None
+
+    def get(self, key):
+        """Return the cover of a title, or None if it has none."""
+        with self._lock:
+            digest = self._keys.get(key)
+            return self.readImage(digest) if digest is not None else None
+
+    def read(self, digest):
+        """Return the image with a (hexadecimal) digest, or None if it is not stored."""
+        with self._lock:
+            return self.readImage(binascii.unhexlify(digest))
+
+    def readImage(self, digest):
+        location = self._images.get(digest)
+        return self.readAt(*location) if location is not None else None
+
+    def readAt(self, pack, offset, length):
+        data = self._maps[pack]
+        if data is None or offset + length > len(data):
+            # the pack grew since it was mapped
+            if data is not None:
+                data.close()
+            data = self._maps[pack] = self.mapPack(pack)
+        return data[offset:offset + length]
+
+    def openForAppend(self):
+        if not os.path.isdir(self._directory):
+            os.makedirs(self._directory)
+        if self._index is None:
+            self._index = open(os.path.join(self._directory, CoverStore._indexFilename), 'ab')
+        if self._pack is None:
+            # keep filling the last pack
+            self._pack = max(self._sizes) if self._sizes else 0
+        if self._sizes.get(self._pack, 0) >= CoverStore._packSize:
+            self._pack += 1
+        self._sizes.setdefault(self._pack, 0)
+        self._maps.setdefault(self._pack, None)
+
+    def appendImage(self, digest, image):
+        """Append an image to the current pack, unless it is stored already."""
+        if digest in self._images:
+            return
+        self.openForAppend()
+        pack = self._pack
+        with open(self.getPackPath(pack), 'ab') as f:
+            f.write(CoverStore._header.pack(digest, len(image)))
+            f.write(image)
+        offset = self._sizes[pack] + CoverStore._header.size
+        self._images[digest] = (pack, offset, len(image))
+        self._sizes[pack] = offset + len(image)
+
+    def appendRecord(self, key, digest):
+        self.openForAppend()
+        key = _encode(key)
+        self._index.write(CoverStore._recordHeader.pack(len(key)) + key + digest)
+        self._index.flush()
+
+    def put(self, key, image):
+        """Store the cover of a title (replacing any previous one) and return its digest."""
+        digest = hashlib.sha1(image).digest()
+        with self._lock:
+            # the image is written before the record pointing at it
+            self.appendImage(digest, image)
+            if self._keys.get(key) != digest:
+                self.appendRecord(key, digest)
+                self._keys[key] = digest
+        return _hex(digest)
+
+    def importFile(self, key, path):
+        """Store the cover of a title from a file; return False if there is no such file."""
+        try:
+            with open(path, 'rb') as f:
+                image = f.read()
+        except (IOError, OSError):
+            return False
+        self.put(key, image)
+        return True
+
+    def remove(self, key):
+        with self._lock:
+            if self._keys.pop(key, None) is not None:
+                self.appendRecord(key, CoverStore._removed)
+
+    def getStatistics(self):
+        """Return the number of covers, of (distinct) images, of packs, and the bytes of the images in use and of those that are not."""
+        with self._lock:
+            used = set(self._keys.values())
+            stored = sum(length for pack, offset, length in self._images.values())
+            inUse = sum(self._images[digest][2] for digest in used if digest in self._images)
+            return { 'covers': len(self._keys), 'images': len(used), 'packs': len(self._sizes), 'bytes': inUse, 'garbage': stored - inUse }
+
+    def verify(self):
+        """Check every image against its digest; return the keys of the titles whose covers are missing or damaged."""
+        with self._lock:
+            damaged = set(digest for digest in self._images if hashlib.sha1(self.readImage(digest)).digest() != digest)
+            return sorted(key for key, digest in self._keys.items() if digest in damaged or digest not in self._images)
+
+    def compact(self):
+        """Rewrite the packs and the index without the images no title uses (nor damaged ones); return the bytes reclaimed."""
+        with self._lock:
+            before = sum(self._sizes.values())
+            used = set(self._keys.values())
+            old = sorted(self._sizes)
+            images = self._images
+            self._images = {}
+            self._sizes = {}
+            # the live images are copied to a new pack
+            self._pack = max(old) + 1 if old else 0
+            # in pack order, so that the old packs are read sequentially
+            for digest, location in sorted(images.items(), key=lambda item: item[1]):
+                if digest not in used:
+                    continue
+                image = self.readAt(*location)
+                if hashlib.sha1(image).digest() != digest:
+                    sys.stderr.write('warning: dropping a damaged cover image\r\n')
+                    continue
+                self.appendImage(digest, image)
+            for key in [ key for key, digest in self._keys.items() if digest not in self._images ]:
+                del self._keys[key]
+
+            # the new index replaces the old one at once; the old packs are
+            # only deleted afterwards
+            if self._index is not None:
+                self._index.close()
+            self._index = None
+            if not os.path.isdir(self._directory):
+                os.makedirs(self._directory)
+            path = os.path.join(self._directory, CoverStore._indexFilename)
+            with open(path + '.tmp', 'wb') as f:
+                for key, digest in self._keys.items():
+                    key = _encode(key)
+                    f.write(CoverStore._recordHeader.pack(len(key)) + key + digest)
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path)
+            os.rename(path + '.tmp', path)
+            for pack in old:
+                if self._maps.get(pack) is not None:
+                    self._maps[pack].close()
+                self._maps.pop(pack, None)
+                os.remove(self.getPackPath(pack))
+            return before - sum(self._sizes.values())
+
+    def close(self):
+        with self._lock:
+            if self._index is not None:
+                self._index.close()
+                self._index = None
+            for data in self._maps.values():
+                if data is not None:
+                    data.close()
+            self._maps = dict((pack, None) for pack in self._maps)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
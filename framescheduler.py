@@ -0,0 +1,99 @@
+import time
+
+
+class FrameScheduler(object):
+    """Runs animation ticks only while there is something to animate.
+
+    A single timer, controlled through start(interval) and stop(), calls
+    run() every `interval` ms; run() calls tick(), which returns True while
+    it wants another frame (the strip is still moving, snapping or has
+    covers to swap in). Once a tick returns False the timer is stopped, and
+    nothing runs until wake() is called again (on input, or when a cover is
+    ready). Frames whose tick takes longer than the budget (by default the
+    interval) are counted as late.
+
+    >>> class Timer(object):
+    ...     interval = None
+    ...     def start(self, interval): self.interval = interval
+    ...     def stop(self): self.interval = None
+    >>> timer = Timer()
+    >>> frames = [True, True, False]
+    >>> scheduler = FrameScheduler(lambda: frames.pop(0), timer.start, timer.stop)
+    >>> scheduler.wake(); scheduler.wake()
+    >>> timer.interval, scheduler.isRunning()
+    (20, True)
+    >>> scheduler.run(); scheduler.run(); scheduler.run()
+    >>> timer.interval, scheduler.isRunning()
+    (None, False)
+    >>> statistics = scheduler.getStatistics()
+    >>> statistics['ticks'], statistics['wakes'], statistics['late']
+    (3, 1, 0)
+
+    Driven by a real timer, an idle scheduler costs no CPU at all:
+
+    >>> import os, threading
+    >>> class ThreadTimer(object):
+    ...     def __init__(self): self.running = threading.Event()
+    ...     def start(self, interval):
+    ...         self.running.set()
+    ...         def loop():
+    ...             while self.running.is_set():
+    ...                 time.sleep(interval / 1000.)
+    ...                 if self.running.is_set(): scheduler.run()
+    ...         threading.Thread(target=loop).start()
+    ...     def stop(self): self.running.clear()
+    >>> timer = ThreadTimer()
+    >>> frames = [True] * 4 + [False]
+    >>> scheduler = FrameScheduler(lambda: frames.pop(0), timer.start, timer.stop, interval=5)
+    >>> scheduler.wake(); time.sleep(0.2)
+    >>> def cpu(): return sum(os.times()[:2])
+    >>> before = cpu(); time.sleep(0.5); idle = cpu() - before
+    >>> scheduler.getStatistics()['ticks'], idle < 0.05
+    (5, True)
+    """
+
+    def __init__(self, tick, start, stop, interval=20, budget=None, clock=time.time):
+        self._tick = tick
+        self._start = start
+        self._stop = stop
+        self._interval = interval
+        self._budget = (budget if budget is not None else interval) / 1000.
+        self._clock = clock
+        self._running = False
+        self._ticks = 0
+        self._wakes = 0
+        self._late = 0
+        self._total = 0.
+        self._longest = 0.
+
+    def isRunning(self): return self._running
+
+    def getStatistics(self):
+        return { 'ticks': self._ticks, 'wakes': self._wakes, 'late': self._late, 'mean': self._total / max(1, self._ticks), 'longest': self._longest }
+
+    def wake(self):
+        """Make sure ticks run (it is cheap to call this when they already do)."""
+        if not self._running:
+            self._running = True
+            self._wakes += 1
+            self._start(self._interval)
+
+    def run(self):
+        """Run one tick, stopping the timer if it asks for no more frames."""
+        if not self._running: return
+        start = self._clock()
+        busy = self._tick()
+        elapsed = self._clock() - start
+        self._ticks += 1
+        self._total += elapsed
+        self._longest = max(self._longest, elapsed)
+        if elapsed > self._budget:
+            self._late += 1
+        if not busy:
+            self._running = False
+            self._stop()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,81 @@
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from renderer import tileTransform
+
+
+class Layout(object):
+    """Where the tiles of the coverflow go for a given scroll offset.
+
+    The whole visible strip is laid out at once: tile offsets from the
+    centre, their clamped flank and a stack of 4x4 (row-major) model
+    transforms, one per tile. With NumPy this is a single vectorized pass
+    returning an (n, 4, 4) array; without it, a list of the matrices
+    renderer.tileTransform computes. Nothing here touches GL, so layouts can
+    be checked and timed headless.
+
+    >>> layout = Layout()
+    >>> layout.centre(2.6, 100), layout.centre(-3, 100)
+    ((2.6, 3), (0, 0))
+    >>> layout.positions(2.6, 100)
+    [0, 1, 2, 12, 11, 10, 9, 8, 7, 6, 5, 4, 3]
+    >>> transforms = layout.transforms([-0.5, 0., 3.])
+    >>> len(transforms)
+    3
+    >>> all(abs(transforms[k][i][j] - tileTransform(offset, 0.14, 0.4, 1)[i][j]) < 1e-9
+    ...     for k, offset in enumerate([-0.5, 0., 3.]) for i in range(4) for j in range(4))
+    True
+    """
+
+    def __init__(self, spread=0.14, flankSpread=0.4, direction=1, visibleTiles=10):
+        self._spread = spread
+        self._flankSpread = flankSpread
+        self._direction = direction
+        self._visibleTiles = visibleTiles
+
+    def centre(self, offset, count):
+        """Return (offset, index of the centre tile), the offset clamped to the strip."""
+        offset = max(0, min(offset, count - 1))
+        return (offset, int(math.floor(offset + 0.5)))
+
+    def positions(self, offset, count):
+        """Return the visible positions in drawing order: the flanks first, the centre tile last."""
+        offset, mid = self.centre(offset, count)
+        start = max(0, mid - self._visibleTiles)
+        end = min(count, mid + self._visibleTiles)
+        return list(range(start, mid))[::self._direction] + list(range(mid, end))[::-self._direction]
+
+    def transforms(self, offsets):
+        """Return the model transform of a tile at each offset (in tiles) from the centre."""
+        if numpy is None:
+            return [ tileTransform(offset, self._spread, self._flankSpread, self._direction) for offset in offsets ]
+
+        offsets = numpy.asarray(offsets, dtype=numpy.float64)
+        f = numpy.clip(offsets * self._flankSpread, -self._flankSpread, self._flankSpread)
+        scale = 0.45 * (1. - numpy.abs(f))
+        # translate(offset * spread + f) . scale(scale, scale, 1) . skew, where the
+        # skew shrinks x by 1 - |f| and tilts the tile through w = 1 - direction * f * x
+        transforms = numpy.zeros((len(offsets), 4, 4))
+        transforms[:, 0, 0] = scale * (1. - numpy.abs(f)) - (offsets * self._spread + f) * self._direction * f
+        transforms[:, 0, 3] = offsets * self._spread + f
+        transforms[:, 1, 1] = scale
+        transforms[:, 2, 2] = 1.
+        transforms[:, 3, 0] = -self._direction * f
+        transforms[:, 3, 3] = 1.
+        return transforms
+
+
+def glMatrix(transform):
+    """Return a row-major 4x4 transform in the column-major order glMultMatrixf expects."""
+    if numpy is not None and isinstance(transform, numpy.ndarray):
+        return numpy.ascontiguousarray(transform.T, dtype=numpy.float32)
+    return [ transform[i][j] for j in range(4) for i in range(4) ]
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
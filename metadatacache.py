@@ -0,0 +1,140 @@
+import json
+import os
+import sys
+import time
+from threading import Lock
+
+
+class MetadataCache(object):
+    """Persistent cache of metadata lookups, keyed by (normalized title, year).
+
+    A successful lookup is kept for `ttl` seconds. A lookup that found
+    nothing is kept as a negative entry: the title is not looked up again
+    for `backoff` seconds, a period that doubles (up to `maxBackoff`) every
+    time the lookup comes back empty again. Errors raised by the lookup
+    itself (e.g. the network being down) are not cached.
+
+    Lookups may be made from several threads at once.
+
+    >>> import tempfile
+    >>> path = tempfile.mktemp()
+    >>> cache = MetadataCache(path)
+    >>> calls = []
+    >>> def search(result):
+    ...     def fetch():
+    ...         calls.append(result)
+    ...         return result
+    ...     return fetch
+    >>> cache.lookup('The  Thing', '1982', search({ 'imdbID': 'tt0084787' }))
+    {'imdbID': 'tt0084787'}
+    >>> cache.lookup('the thing', '1982', search(None))
+    {'imdbID': 'tt0084787'}
+    >>> cache.lookup('Holiday 2009', '', search(None)) is None
+    True
+    >>> cache.lookup('Holiday 2009', '', search({ 'imdbID': 'tt0000000' })) is None
+    True
+    >>> len(calls), sorted(cache.getStatistics().items())
+    (2, [('hits', 1), ('misses', 2), ('negative hits', 1)])
+    >>> cache.save()
+    >>> MetadataCache(path).lookup('THE THING', 1982, search(None)) == { 'imdbID': 'tt0084787' }
+    True
+    >>> os.remove(path)
+    """
+
+    _version = 1
+
+    _ttl = 30 * 86400
+    _backoff = 86400
+    _maxBackoff = 64 * 86400
+
+    # unsaved changes written by lookup itself
+    _saveEvery = 64
+
+    def __init__(self, path, ttl=None, backoff=None, maxBackoff=None):
+        self._path = path
+        self._ttl = ttl if ttl is not None else MetadataCache._ttl
+        self._backoff = backoff if backoff is not None else MetadataCache._backoff
+        self._maxBackoff = maxBackoff if maxBackoff is not None else MetadataCache._maxBackoff
+        self._entries = {}
+        self._lock = Lock()
+        self._dirty = 0
+        self._hits = 0
+        self._misses = 0
+        self._negativeHits = 0
+
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == MetadataCache._version:
+                self._entries = data['entries']
+        except (IOError, OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    @staticmethod
+    def key(title, year):
+        """Return the cache key of a title.
+
+        >>> MetadataCache.key(' Blade  Runner', None) == MetadataCache.key('blade runner', '')
+        True
+        """
+        return '%s\t%s' % (' '.join(title.lower().split()), year if year is not None else '')
+
+    def getStatistics(self):
+        """Return how many lookups were answered from the cache and how many went out."""
+        with self._lock:
+            return { 'hits': self._hits, 'misses': self._misses, 'negative hits': self._negativeHits }
+
+    def lookup(self, title, year, fetch):
+        """Return the metadata of a title, or None if there is none.
+
+        fetch is called (without arguments) only when the cache cannot answer;
+        it returns the metadata, or None if the title has no match.
+        """
+        key = MetadataCache.key(title, year)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry['expires']:
+                if entry.get('result') is None:
+                    self._negativeHits += 1
+                else:
+                    self._hits += 1
+                return entry.get('result')
+            self._misses += 1
+
+        result = fetch()
+
+        with self._lock:
+            if result is not None:
+                self._entries[key] = { 'result': result, 'expires': now + self._ttl }
+            else:
+                failures = entry.get('failures', 0) + 1 if entry is not None else 1
+                backoff = min(self._maxBackoff, self._backoff * 2 ** (failures - 1))
+                self._entries[key] = { 'failures': failures, 'expires': now + backoff }
+            self._dirty += 1
+            save = self._dirty >= MetadataCache._saveEvery
+        if save:
+            self.save()
+        return result
+
+    def save(self):
+        """Write the cache atomically, dropping expired successful lookups."""
+        now = time.time()
+        with self._lock:
+            # negative entries are kept so that their backoff keeps growing
+            self._entries = dict((key, entry) for key, entry in self._entries.items() if entry.get('result') is None or now < entry['expires'])
+            self._dirty = 0
+            tmpPath = self._path + '.tmp'
+            try:
+                with open(tmpPath, 'w') as f:
+                    json.dump({ 'version': MetadataCache._version, 'entries': self._entries }, f)
+                if os.name == 'nt' and os.path.exists(self._path):
+                    os.remove(self._path)
+                os.rename(tmpPath, self._path)
+            except (IOError, OSError) as exc:
+                sys.stderr.write('warning: could not write metadata cache `%s`: %s\r\n' % (self._path, exc))
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,48 @@
+from bisect import bisect_left
+
+
+class PrefixIndex(object):
+    """Maps typed prefixes to positions in a view of titles.
+
+    The names of the titles in a view (in the order they are shown, e.g.
+    search results by relevance) are sorted once; a prefix is then found
+    by bisection. Matching ignores case; of several matching titles the
+    alphabetically first is returned.
+
+    >>> index = PrefixIndex(['Star Wars', 'Alien', 'Star Trek', 'Aliens'])
+    >>> index.locate('star'), index.locate('STAR W'), index.locate('b')
+    (2, 0, None)
+    >>> index.locate('b', True), index.locate('z', True)
+    (2, None)
+
+    Typed (unicode) prefixes are converted to the type of names first.
+
+    >>> from searchindex import toName
+    >>> index = PrefixIndex([toName(u'Am\\xe9lie'), 'Amadeus'])
+    >>> index.locate(toName(u'Am\\xe9')), index.locate(toName(u'Am\\xe8'))
+    (0, None)
+    """
+
+    def __init__(self, names):
+        entries = sorted((name.lower(), position) for position, name in enumerate(names))
+        self._names = [ name for name, position in entries ]
+        self._positions = [ position for name, position in entries ]
+
+    def __len__(self): return len(self._names)
+
+    def locate(self, prefix, following=False):
+        """Return the position of the first title (by name) starting with prefix, or None.
+
+        If following is True, the first title sorting at or after prefix is
+        returned instead.
+        """
+        prefix = prefix.lower()
+        i = bisect_left(self._names, prefix)
+        if i < len(self._names) and (following or self._names[i].startswith(prefix)):
+            return self._positions[i]
+        return None
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,105 @@
+import collections
+import time
+
+
+class FrameProfiler(object):
+    """Per-frame timings of the render loop, kept in a ring buffer.
+
+    Work is attributed to the frame being built: time(stage) times a block
+    (paint, upload, drain, ...), upload(size) counts a texture upload, and
+    frame() closes the frame when it has been painted. Frames painted back
+    to back while animating (`continuous`) that are further apart than the
+    interval count the frames dropped in between. Only the last `capacity`
+    frames are kept.
+
+    >>> import functools
+    >>> clock = functools.partial(next, iter([0., 0.004, 0.010, 0.011, 0.020, 0.030, 0.031, 0.060, 0.061, 0.070, 0.080]))
+    >>> profiler = FrameProfiler(capacity=2, interval=20, clock=clock)
+    >>> with profiler.time('paint'):
+    ...     with profiler.time('upload'): profiler.upload(4096)
+    >>> profiler.frame(False)
+    >>> with profiler.time('drain'): pass
+    >>> profiler.frame(True)
+    >>> with profiler.time('paint'): pass
+    >>> profiler.frame(True)
+    >>> [ (round(sample['paint'], 3), round(sample['drain'], 3), sample['dropped']) for sample in profiler.getSamples() ]
+    [(0.0, 1.0, 1), (9.0, 0.0, 0)]
+    >>> summary = profiler.getSummary()
+    >>> summary['frames'], summary['dropped'], round(summary['paint max'], 3)
+    (2, 1, 9.0)
+    """
+
+    fields = ('time', 'paint', 'upload', 'drain', 'uploads', 'bytes', 'dropped')
+
+    def __init__(self, capacity=600, interval=20, clock=time.time):
+        self._samples = collections.deque(maxlen=capacity)
+        self._interval = interval / 1000.
+        self._clock = clock
+        self._last = None
+        self._current = self._newFrame()
+
+    def _newFrame(self): return { 'paint': 0., 'upload': 0., 'drain': 0., 'uploads': 0, 'bytes': 0 }
+
+    def __len__(self): return len(self._samples)
+
+    def time(self, stage):
+        """Return a context manager adding the time spent in it to `stage` (in ms)."""
+        return _Timer(self, stage)
+
+    def add(self, stage, elapsed):
+        self._current[stage] += elapsed * 1000.
+
+    def upload(self, size):
+        self._current['uploads'] += 1
+        self._current['bytes'] += size
+
+    def frame(self, continuous):
+        """Close the current frame; continuous if the previous frame was painted by the same animation."""
+        now = self._clock()
+        sample = self._current
+        sample['time'] = now
+        sample['dropped'] = 0
+        if continuous and self._last is not None:
+            sample['dropped'] = max(0, int((now - self._last) / self._interval + 0.5) - 1)
+        self._samples.append(sample)
+        self._last = now
+        self._current = self._newFrame()
+
+    def getSamples(self): return list(self._samples)
+
+    def getSummary(self):
+        """Return the number of frames, dropped frames, uploads and bytes, and the mean and max of every timing."""
+        samples = self._samples
+        summary = { 'frames': len(samples) }
+        for field in ['dropped', 'uploads', 'bytes']:
+            summary[field] = sum(sample[field] for sample in samples)
+        for field in ['paint', 'upload', 'drain']:
+            values = [ sample[field] for sample in samples ] or [0.]
+            summary['%s mean' % (field)] = sum(values) / len(values)
+            summary['%s max' % (field)] = max(values)
+        return summary
+
+    def dump(self, path):
+        """Write the samples to a tab-separated file, one frame per line."""
+        with open(path, 'w') as f:
+            f.write('\t'.join(FrameProfiler.fields) + '\n')
+            for sample in self._samples:
+                f.write('\t'.join(repr(sample[field]) for field in FrameProfiler.fields) + '\n')
+
+
+class _Timer(object):
+
+    def __init__(self, profiler, stage):
+        self._profiler = profiler
+        self._stage = stage
+
+    def __enter__(self):
+        self._start = self._profiler._clock()
+
+    def __exit__(self, *exc):
+        self._profiler.add(self._stage, self._profiler._clock() - self._start)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,242 @@
+from bisect import bisect_left
+
+from trie import NeedMore
+
+_missing = object()
+
+
+class _Node(object):
+    """A node and the edge leading to it; children are sorted by the first character of their edges."""
+    __slots__ = ['edge', 'value', 'firsts', 'children']
+
+    def __init__(self, edge, value=_missing, firsts='', children=None):
+        self.edge = edge
+        self.value = value
+        # the first characters of the children's edges, as one string
+        self.firsts = firsts
+        self.children = children
+
+    def child(self, c):
+        """Return (index, child) of the child whose edge starts with c, or (insertion index, None)."""
+        i = bisect_left(self.firsts, c)
+        if i < len(self.firsts) and self.firsts[i] == c:
+            return i, self.children[i]
+        return i, None
+
+    def insert(self, i, child):
+        self.firsts = self.firsts[:i] + child.edge[0] + self.firsts[i:]
+        if self.children is None:
+            self.children = [child]
+        else:
+            self.children.insert(i, child)
+
+    def remove(self, i):
+        self.firsts = self.firsts[:i] + self.firsts[i + 1:]
+        del self.children[i]
+        if not self.children:
+            self.children = None
+
+    def absorb(self):
+        """Merge the only child into this (valueless) node."""
+        child = self.children[0]
+        self.edge += child.edge
+        self.value = child.value
+        self.firsts = child.firsts
+        self.children = child.children
+
+
+class RadixTrie(object):
+    """A compressed prefix tree with the interface of trie.Trie.
+
+    Chains of nodes with a single child are merged into one edge labelled
+    with a whole substring, and children are kept sorted (the first
+    character of every child's edge is stored in one string and searched
+    by bisection), so iterating in key order sorts nothing. Keys are
+    yielded as strings rather than lists of characters.
+
+    >>> t = RadixTrie()
+    >>> t['foobaz'] = 'Here is a foobaz.'
+    >>> t['foobar'] = 'This is a foobar.'
+    >>> t['fooqat'] = "What's a fooqat?"
+    >>> list(t)
+    ['foobar', 'foobaz', 'fooqat']
+    >>> t['foo'] # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+        ...
+    NeedMore
+    >>> t['fooqux']
+    Traceback (most recent call last):
+        ...
+    KeyError: 'fooqux'
+    >>> sorted(t.children('fooba').items())
+    [('r', 'This is a foobar.'), ('z', 'Here is a foobaz.')]
+    >>> del t['foobaz']
+    >>> list(t.iteritems()) == [('foobar', 'This is a foobar.'), ('fooqat', "What's a fooqat?")]
+    True
+    >>> t['fo'] = 'A fo.'
+    >>> len(t), list(t.itervalues())
+    (3, ['A fo.', 'This is a foobar.', "What's a fooqat?"])
+    >>> del t['foobar']; del t['fooqat']
+    >>> t.getNodeCount(), list(t)
+    (2, ['fo'])
+    """
+
+    def __init__(self, mapping=()):
+        self._root = _Node('')
+        self._len = 0
+        self.extend(mapping)
+
+    def __len__(self): return self._len
+
+    def __contains__(self, key):
+        try:
+            node, tail, path = self._find(key)
+        except KeyError:
+            return False
+        return tail == '' and node.value is not _missing
+
+    def extend(self, mapping):
+        """Update the trie with a sequence of (key, value) pairs."""
+        for k, v in mapping:
+            self[k] = v
+
+    def _find(self, key):
+        """Return (node, tail, path) for key, or raise KeyError if no key starts with it.
+
+        The key either ends at node (tail is empty) or within its edge, tail
+        being the rest of the edge. path lists the (parent, index) pairs
+        leading to node.
+        """
+        node = self._root
+        rest = key
+        path = []
+        while rest:
+            i, child = node.child(rest[0])
+            if child is None:
+                raise KeyError(key)
+            edge = child.edge
+            if rest.startswith(edge):
+                path.append((node, i))
+                node = child
+                rest = rest[len(edge):]
+            elif edge.startswith(rest):
+                path.append((node, i))
+                return child, edge[len(rest):], path
+            else:
+                raise KeyError(key)
+        return node, '', path
+
+    def __setitem__(self, key, value):
+        node = self._root
+        rest = key
+        while rest:
+            i, child = node.child(rest[0])
+            if child is None:
+                node.insert(i, _Node(rest, value))
+                self._len += 1
+                return
+            edge = child.edge
+            n = 1
+            limit = min(len(edge), len(rest))
+            while n < limit and edge[n] == rest[n]:
+                n += 1
+            if n < len(edge):
+                # split the edge where the key leaves it
+                child.edge = edge[n:]
+                child = _Node(edge[:n], firsts=edge[n], children=[child])
+                node.children[i] = child
+            node = child
+            rest = rest[n:]
+        if node.value is _missing:
+            self._len += 1
+        node.value = value
+
+    def __getitem__(self, key):
+        # _find, without keeping the path
+        node = self._root
+        position = 0
+        while position < len(key):
+            firsts = node.firsts
+            c = key[position]
+            i = bisect_left(firsts, c)
+            if i == len(firsts) or firsts[i] != c:
+                raise KeyError(key)
+            node = node.children[i]
+            edge = node.edge
+            if key.startswith(edge, position):
+                position += len(edge)
+            elif edge.startswith(key[position:]):
+                # every node below the root holds a value or has children
+                raise NeedMore()
+            else:
+                raise KeyError(key)
+        if node.value is not _missing:
+            return node.value
+        if node.children:
+            raise NeedMore()
+        raise KeyError(key)
+
+    def __delitem__(self, key):
+        node, tail, path = self._find(key)
+        if tail != '' or node.value is _missing:
+            raise KeyError(key)
+        node.value = _missing
+        self._len -= 1
+        if not path:
+            return
+        parent, i = path[-1]
+        if node.children is None:
+            parent.remove(i)
+            if parent is not self._root and parent.value is _missing and len(parent.children) == 1:
+                parent.absorb()
+        elif len(node.children) == 1:
+            node.absorb()
+
+    def children(self, key):
+        """Return a dict of the values of the keys one character longer than key, by that character."""
+        node, tail, path = self._find(key)
+        if tail != '':
+            return { tail: node.value } if len(tail) == 1 and node.value is not _missing else {}
+        return dict((child.edge, child.value) for child in node.children or () if len(child.edge) == 1 and child.value is not _missing)
+
+    def __iter__(self):
+        """Yield the keys in order."""
+        for key, value in self.iteritems():
+            yield key
+
+    def iteritems(self):
+        """Yield (key, value) pairs in order."""
+        stack = [('', self._root)]
+        while stack:
+            prefix, node = stack.pop()
+            key = prefix + node.edge
+            if node.value is not _missing:
+                yield key, node.value
+            if node.children is not None:
+                stack.extend((key, child) for child in reversed(node.children))
+
+    def itervalues(self):
+        """Yield values in order."""
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node.value is not _missing:
+                yield node.value
+            if node.children is not None:
+                stack.extend(reversed(node.children))
+
+    def getNodeCount(self):
+        """Return the number of nodes (including the root)."""
+        count = 0
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            count += 1
+            if node.children is not None:
+                stack.extend(node.children)
+        return count
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
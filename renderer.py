@@ -0,0 +1,151 @@
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def multiply(a, b):
+    """Return the product of two 4x4 row-major matrices (lists of rows)."""
+    return [ [ sum(a[i][k] * b[k][j] for k in range(4)) for j in range(4) ] for i in range(4) ]
+
+
+def translation(x, y, z):
+    return [ [1., 0., 0., x], [0., 1., 0., y], [0., 0., 1., z], [0., 0., 0., 1.] ]
+
+
+def scaling(x, y, z):
+    return [ [x, 0., 0., 0.], [0., y, 0., 0.], [0., 0., z, 0.], [0., 0., 0., 1.] ]
+
+
+def tileTransform(offset, spread, flankSpread, direction):
+    """Return the (row-major) model transform of a tile `offset` tiles from the centre.
+
+    This is the transform TileflowWidget.drawTile builds with glTranslatef,
+    glScalef and glMultMatrixf: tiles move sideways with their offset and
+    tilt away from the viewer (through the projective w term) up to
+    flankSpread.
+
+    >>> [ [ round(x, 3) for x in row ] for row in tileTransform(2, 0.14, 0.4, 1) ]
+    [[-0.11, 0.0, 0.0, 0.68], [0.0, 0.27, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0], [-0.4, 0.0, 0.0, 1.0]]
+    """
+    trans = offset * spread
+    f = max(-flankSpread, min(flankSpread, offset * flankSpread))
+    skew = [ [1. - abs(f), 0., 0., 0.], [0., 1., 0., 0.], [0., 0., 1., 0.], [-direction * f, 0., 0., 1.] ]
+    scale = 0.45 * (1. - abs(f))
+    return multiply(multiply(translation(trans + f, 0., 0.), scaling(scale, scale, 1.)), skew)
+
+
+# the reflection is the cover mirrored below it (see TileflowWidget.generateTile)
+_reflection = multiply(translation(0., -2., 0.), scaling(1., -1., 1.))
+
+# corners of the unit quad as (x, y, s, t), s and t selecting the texture coordinates
+_quad = [ (1., -1., 1, 0), (-1., -1., 0, 0), (-1., 1., 0, 1), (1., 1., 1, 1) ]
+
+
+class Batch(object):
+    """Interleaved vertex data for a strip of tiles and their reflections.
+
+    Every vertex is (x, y, z, w, u, v, r, g, b, a). Consecutive tiles that
+    use the same texture form one run, drawn with a single glDrawArrays of
+    GL_QUADS, so a strip whose covers share an atlas page costs one bind
+    and one draw call.
+
+    >>> batch = Batch()
+    >>> identity = translation(0., 0., 0.)
+    >>> batch.add(identity, 7, (0., 0., 0.5, 0.5))
+    >>> batch.add(tileTransform(1, 0.14, 0.4, 1), 7, (0.5, 0., 1., 0.5))
+    >>> batch.add(identity, 8, (0., 0., 1., 1.))
+    >>> len(batch), batch.getRuns()
+    (24, [(7, 0, 16), (8, 16, 8)])
+    >>> batch.getVertex(0)
+    (1.0, -1.0, 0.0, 1.0, 0.5, 0.0, 1.0, 1.0, 1.0, 1.0)
+    >>> batch.getVertex(6)[:6], batch.getVertex(6)[-1]
+    ((-1.0, -3.0, 0.0, 1.0, 0.0, 0.5), 0.5)
+    """
+
+    _floats = 10
+    stride = 4 * _floats
+
+    def __init__(self):
+        self._data = array('f')
+        self._runs = []
+
+    def __len__(self): return len(self._data) // Batch._floats
+
+    def add(self, transform, texture, texCoords, alpha=0.5):
+        """Append a tile (and its reflection, drawn with the given alpha) to the batch."""
+        first = len(self)
+        u0, v0, u1, v1 = texCoords
+        us = (u0, u1)
+        vs = (v0, v1)
+        data = self._data
+        for matrix, opacity in [(transform, 1.), (multiply(transform, _reflection), alpha)]:
+            m0, m1, m2, m3 = matrix
+            for x, y, s, t in _quad:
+                data.extend((m0[0] * x + m0[1] * y + m0[3], m1[0] * x + m1[1] * y + m1[3], m2[0] * x + m2[1] * y + m2[3], m3[0] * x + m3[1] * y + m3[3], us[s], vs[t], 1., 1., 1., opacity))
+        if self._runs and self._runs[-1][0] == texture:
+            self._runs[-1][2] += len(self) - first
+        else:
+            self._runs.append([texture, first, len(self) - first])
+
+    def addStrip(self, transforms, textures, texCoords, alpha=0.5):
+        """Append many tiles at once (see add); transforms may be an (n, 4, 4) array.
+
+        >>> from layout import Layout
+        >>> transforms = Layout().transforms([-1., 0.])
+        >>> strip, single = Batch(), Batch()
+        >>> strip.addStrip(transforms, [3, 3], [(0., 0., 1., 1.)] * 2)
+        >>> for transform in transforms: single.add(transform, 3, (0., 0., 1., 1.))
+        >>> strip.getRuns() == single.getRuns() == [(3, 0, 16)]
+        True
+        >>> all(abs(a - b) < 1e-6 for i in range(16) for a, b in zip(strip.getVertex(i), single.getVertex(i)))
+        True
+        """
+        if numpy is None or len(textures) == 0:
+            for transform, texture, coords in zip(transforms, textures, texCoords):
+                self.add(transform, texture, coords, alpha)
+            return
+
+        first = len(self)
+        n = len(textures)
+        transforms = numpy.asarray(transforms, dtype=numpy.float64)
+        # (n, 2, 4, 4): the cover and its reflection
+        matrices = numpy.stack([transforms, numpy.matmul(transforms, numpy.asarray(_reflection))], axis=1)
+        corners = numpy.array([ (x, y, 0., 1.) for x, y, s, t in _quad ])
+        vertices = numpy.empty((n, 2, 4, Batch._floats), dtype=numpy.float32)
+        vertices[..., 0:4] = numpy.matmul(matrices, corners.T).swapaxes(-1, -2)
+        coords = numpy.asarray(texCoords, dtype=numpy.float64)
+        vertices[..., 4] = coords[:, [ 2 if s else 0 for x, y, s, t in _quad ]][:, None, :]
+        vertices[..., 5] = coords[:, [ 3 if t else 1 for x, y, s, t in _quad ]][:, None, :]
+        vertices[..., 6:9] = 1.
+        vertices[:, 0, :, 9] = 1.
+        vertices[:, 1, :, 9] = alpha
+        data = vertices.tobytes()
+        if hasattr(self._data, 'frombytes'):
+            self._data.frombytes(data)
+        else:
+            self._data.fromstring(data)
+
+        for k, texture in enumerate(textures):
+            if self._runs and self._runs[-1][0] == texture:
+                self._runs[-1][2] += 8
+            else:
+                self._runs.append([texture, first + 8 * k, 8])
+
+    def getRuns(self):
+        """Return (texture, first vertex, vertex count) for every run, in drawing order."""
+        return [ tuple(run) for run in self._runs ]
+
+    def getVertex(self, i):
+        return tuple(self._data[i * Batch._floats:(i + 1) * Batch._floats])
+
+    def getData(self):
+        """Return the vertex data as bytes, ready for glBufferData."""
+        return self._data.tobytes() if hasattr(self._data, 'tobytes') else self._data.tostring()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
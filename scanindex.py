@@ -0,0 +1,211 @@
+import json
+import os
+import sys
+from multiprocessing.pool import ThreadPool
+
+# on Python 2 file names (and the names parsed from them) are byte strings,
+# which json turns into unicode; they are stored as latin-1, which maps
+# every byte to a character and back, whatever the file-system encoding
+_options = { 'encoding': 'latin-1' } if str is bytes else {}
+
+
+def _native(value):
+    """Return a value loaded by json with its strings of the type file names have."""
+    if str is not bytes:
+        return value
+    if isinstance(value, type(u'')):
+        return value.encode('latin-1')
+    if isinstance(value, dict):
+        return dict((_native(k), _native(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [ _native(v) for v in value ]
+    return value
+
+
+class ScanIndex(object):
+    """Persistent, mtime-validated index of a library scan.
+
+    The index remembers, for every root, the modification time of the root
+    and of every directory beneath its top-level subdirectories, together
+    with the video files found there and the (name, year) parsed from each
+    record. A later scan only lists roots and re-walks subdirectories whose
+    modification times changed; everything else is served from the index.
+
+    Records are yielded as (name, year, filePaths, collectionPath) tuples in
+    the same order as Scanner.scan. Records whose name parses to nothing are
+    skipped. parse is a callable mapping a raw record name to (name, year).
+
+    >>> import shutil, tempfile
+    >>> from scanner import Scanner
+    >>> root = tempfile.mkdtemp()
+    >>> os.makedirs(os.path.join(root, 'Show', 'Season 1'))
+    >>> for p in ['Movie.avi', 'Show/Season 1/e1.avi']:
+    ...     open(os.path.join(root, p), 'w').close()
+    >>> indexPath = root + '.json'
+    >>> parse = lambda name: (name.split('.')[0], None)
+    >>> index = ScanIndex(indexPath, Scanner(['.avi']), parse)
+    >>> sorted((str(name), len(filePaths)) for name, year, filePaths, c in index.scan([root]))
+    [('Movie', 1), ('Show', 1)]
+    >>> index.save()
+    >>> index = ScanIndex(indexPath, Scanner(['.avi']), parse)
+    >>> sorted((str(name), len(filePaths)) for name, year, filePaths, c in index.scan([root]))
+    [('Movie', 1), ('Show', 1)]
+    >>> index.getStatistics()
+    {'reused': 1, 'walked': 0}
+    >>> open(os.path.join(root, 'Show', 'Season 1', 'e2.avi'), 'w').close()
+    >>> sorted((str(name), len(filePaths)) for name, year, filePaths, c in index.scan([root]))
+    [('Movie', 1), ('Show', 2)]
+    >>> index.getStatistics()
+    {'reused': 0, 'walked': 1}
+
+    Names read from the index have the type of freshly walked ones, so the
+    two can be sorted together.
+
+    >>> index.save(); index = ScanIndex(indexPath, Scanner(['.avi']), parse)
+    >>> cafe = u'Caf\\xe9.1999.avi'
+    >>> open(os.path.join(root, cafe.encode('utf-8') if str is bytes else cafe), 'w').close()
+    >>> names = sorted(name for name, year, filePaths, c in index.scan([root]))
+    >>> len(names), all(isinstance(name, str) for name in names), index.getStatistics()
+    (3, True, {'reused': 1, 'walked': 0})
+    >>> shutil.rmtree(root); os.remove(indexPath)
+    """
+
+    _version = 2
+
+    def __init__(self, path, scanner, parse):
+        self._path = path
+        self._scanner = scanner
+        self._parse = parse
+        self._roots = {}
+        self._reused = 0
+        self._walked = 0
+
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            # a change of extensions invalidates every recorded file list
+            if data.get('version') == ScanIndex._version and data.get('extensions') == scanner.getExtensions():
+                self._roots = _native(data['roots'])
+        except (IOError, OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    def getStatistics(self):
+        """Return how many subdirectories the last scan reused and re-walked."""
+        return { 'reused': self._reused, 'walked': self._walked }
+
+    def save(self):
+        """Write the index atomically."""
+        tmpPath = self._path + '.tmp'
+        try:
+            with open(tmpPath, 'w') as f:
+                json.dump({ 'version': ScanIndex._version, 'extensions': self._scanner.getExtensions(), 'roots': self._roots }, f, **_options)
+            if os.name == 'nt' and os.path.exists(self._path):
+                os.remove(self._path)
+            os.rename(tmpPath, self._path)
+        except (IOError, OSError) as exc:
+            sys.stderr.write('warning: could not write scan index `%s`: %s\r\n' % (self._path, exc))
+
+    def isCurrent(self, unit):
+        """Return True if no directory recorded in a unit has changed."""
+        for directory, mtime in unit['mtimes'].items():
+            try:
+                if os.stat(directory).st_mtime != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def unit(self, entryName, name, filePaths, mtimes):
+        """Return an index unit; mtimes is None for loose files."""
+        media = self._parse(name)
+        return { 'name': entryName, 'filePaths': filePaths, 'mtimes': mtimes, 'media': list(media) if media[0] else None }
+
+    def refresh(self, task):
+        """Validate a cached subdirectory unit, re-walking it if stale."""
+        path, name, cached = task
+        if cached is not None and self.isCurrent(cached):
+            return cached, True
+        mtimes = {}
+        filePaths = self._scanner.walk(path, mtimes)
+        return self.unit(name, name, filePaths, mtimes), False
+
+    def listRoot(self, path):
+        """Return (mtime, plan) for a root whose listing changed, or None."""
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+        cached = self._roots.get(path)
+        if cached is not None and mtime is not None and cached['mtime'] == mtime:
+            return mtime, None
+        entries = self._scanner.listRoot(path)
+        if entries is None:
+            return None
+        return mtime, self._scanner.classify(entries)
+
+    def scan(self, paths):
+        self._reused = 0
+        self._walked = 0
+
+        pool = ThreadPool(self._scanner.getWorkers())
+        try:
+            listings = pool.map(self.listRoot, paths)
+
+            # lay out every root as a sequence of units, some of which still
+            # need to be validated (or walked) on the pool
+            roots = {}
+            layouts = []
+            tasks = []
+            for path, listing in zip(paths, listings):
+                if listing is None or path in roots:
+                    continue
+                mtime, plan = listing
+                cachedUnits = {}
+                if path in self._roots:
+                    cachedUnits = dict((unit['name'], unit) for unit in self._roots[path]['units'])
+                layout = []
+                if plan is None:
+                    # the root listing is unchanged
+                    for unit in self._roots[path]['units']:
+                        if unit['mtimes'] is None:
+                            layout.append(unit)
+                        else:
+                            layout.append(None)
+                            tasks.append((os.path.join(path, unit['name']), unit['name'], unit))
+                else:
+                    for entry, isFile in plan:
+                        if isFile:
+                            unit = cachedUnits.get(entry.name)
+                            if unit is None or unit['mtimes'] is not None:
+                                unit = self.unit(entry.name, os.path.splitext(entry.name)[0], [entry.path], None)
+                            layout.append(unit)
+                        else:
+                            unit = cachedUnits.get(entry.name)
+                            if unit is not None and unit['mtimes'] is None:
+                                unit = None
+                            layout.append(None)
+                            tasks.append((entry.path, entry.name, unit))
+                roots[path] = { 'mtime': mtime, 'units': layout }
+                layouts.append((path, layout))
+
+            refreshed = pool.imap(self.refresh, tasks, chunksize=16)
+            for path, layout in layouts:
+                for k, unit in enumerate(layout):
+                    if unit is None:
+                        unit, reused = next(refreshed)
+                        layout[k] = unit
+                        if reused: self._reused += 1
+                        else: self._walked += 1
+                    if unit['media'] is None or len(unit['filePaths']) == 0:
+                        continue
+                    name, year = unit['media']
+                    yield (name, year, unit['filePaths'][:], path)
+
+            self._roots = roots
+        finally:
+            pool.terminate()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,181 @@
+import os
+import sys
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# warned about once, on the first directory listed without scandir
+_warned = False
+
+
+class _Entry(object):
+    """Minimal stand-in for scandir entries when scandir is unavailable."""
+    __slots__ = 'name path'.split()
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+    def is_dir(self, follow_symlinks=True):
+        if follow_symlinks:
+            return os.path.isdir(self.path)
+        return not os.path.islink(self.path) and os.path.isdir(self.path)
+
+    def is_file(self, follow_symlinks=True):
+        if follow_symlinks:
+            return os.path.isfile(self.path)
+        return not os.path.islink(self.path) and os.path.isfile(self.path)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+
+def listEntries(directory):
+    """Return the entries of a directory, using scandir when available."""
+    global _warned
+    if scandir is not None:
+        return list(scandir(directory))
+    if not _warned:
+        _warned = True
+        sys.stderr.write('warning: scandir is not installed (`pip install scandir`); every file is stat-ed while scanning\r\n')
+    return [_Entry(directory, name) for name in os.listdir(directory)]
+
+
+class Scanner(object):
+    """Scans library roots for video files on a pool of worker threads.
+
+    Each root is listed on the pool, and every top-level subdirectory of every
+    root is then walked as a separate task. Records are yielded in the same
+    order as a serial scan, as (name, filePaths, collectionPath) tuples that
+    can be handed to VideoCoverflow.addMedia:
+
+    * a video file directly inside a root is a record of its own, named after
+      the file (without extension);
+    * a subdirectory of a root is a single record, named after the
+      subdirectory, holding every video file found beneath it.
+
+    >>> import shutil, tempfile
+    >>> root = tempfile.mkdtemp()
+    >>> for p in ['a.avi', 'b.txt', 'c/c1.mkv', 'c/sub/c2.mkv', 'd/d.txt']:
+    ...     p = os.path.join(root, p)
+    ...     if not os.path.isdir(os.path.dirname(p)):
+    ...         os.makedirs(os.path.dirname(p))
+    ...     open(p, 'w').close()
+    >>> records = Scanner(['.avi', '.mkv'], workers=2).scan([root])
+    >>> [(n, sorted(os.path.relpath(f, root) for f in fs)) for n, fs, c in sorted(records)]
+    [('a', ['a.avi']), ('c', ['c/c1.mkv', 'c/sub/c2.mkv'])]
+    >>> shutil.rmtree(root)
+    """
+
+    _workers = 8
+
+    def __init__(self, extensions, workers=None):
+        self._extensions = frozenset(extension.lower() for extension in extensions)
+        self._workers = max(1, int(workers or Scanner._workers))
+
+    def isVideo(self, filename):
+        return os.path.splitext(filename)[1].lower() in self._extensions
+
+    def getWorkers(self): return self._workers
+    def getExtensions(self): return sorted(self._extensions)
+
+    def listRoot(self, path):
+        """List a root, returning None if it cannot be scanned."""
+        if not os.path.isdir(path):
+            sys.stderr.write('warning: media directory `%s` was not found or is not a directory; skipping\r\n' % (path))
+            return None
+        try:
+            return listEntries(path)
+        except OSError:
+            sys.stderr.write('warning: media directory `%s` could not be read; skipping\r\n' % (path))
+            return None
+
+    def classify(self, entries):
+        """Return (entry, isFile) pairs for the top-level entries of a root.
+
+        Files that are not videos are dropped; anything that is not a file
+        is treated as a directory to be walked.
+        """
+        plan = []
+        for entry in entries:
+            try:
+                isFile = entry.is_file()
+            except OSError:
+                isFile = False
+            if isFile and not self.isVideo(entry.name):
+                continue
+            plan.append((entry, isFile))
+        return plan
+
+    def walk(self, path, mtimes=None):
+        """Return every video file beneath a directory.
+
+        Like os.walk, symbolic links to directories are not descended into
+        and unreadable directories are silently skipped. If a dict is passed
+        as mtimes, it is filled with the modification time of every directory
+        visited (taken before the directory is listed).
+        """
+        filePaths = []
+        directories = [path]
+        while directories:
+            directory = directories.pop()
+            try:
+                if mtimes is not None:
+                    mtimes[directory] = os.stat(directory).st_mtime
+                entries = listEntries(directory)
+            except OSError:
+                continue
+            subdirectories = []
+            for entry in entries:
+                try:
+                    isDir = entry.is_dir()
+                except OSError:
+                    isDir = False
+                if isDir:
+                    if not entry.is_symlink():
+                        subdirectories.append(entry.path)
+                elif self.isVideo(entry.name):
+                    filePaths.append(entry.path)
+            # visit subdirectories in listing order (the stack is LIFO)
+            subdirectories.reverse()
+            directories.extend(subdirectories)
+        return filePaths
+
+    def scan(self, paths):
+        """Yield (name, filePaths, collectionPath) records for each root."""
+        pool = ThreadPool(self._workers)
+        try:
+            listings = pool.map(self.listRoot, paths)
+
+            # directories are walked on the pool
+            plans = []
+            tasks = []
+            for path, entries in zip(paths, listings):
+                if entries is None:
+                    continue
+                plan = self.classify(entries)
+                tasks.extend(entry.path for entry, isFile in plan if not isFile)
+                plans.append((path, plan))
+
+            walks = pool.imap(self.walk, tasks, chunksize=1)
+            for path, plan in plans:
+                for entry, isFile in plan:
+                    if isFile:
+                        yield (os.path.splitext(entry.name)[0], [entry.path], path)
+                    else:
+                        filePaths = next(walks)
+                        if len(filePaths) == 0: continue
+                        yield (entry.name, filePaths, path)
+        finally:
+            pool.terminate()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,235 @@
+import sys
+
+# file names (and the names parsed from them) are byte strings on Python 2,
+# whereas what is typed is unicode
+_encoding = sys.getfilesystemencoding() or 'utf-8'
+
+
+def toText(s):
+    """Return a name or a query as unicode text, decoding byte strings in the file-system encoding (or else UTF-8)."""
+    if not isinstance(s, bytes):
+        return s
+    try:
+        return s.decode(_encoding)
+    except UnicodeDecodeError:
+        return s.decode('utf-8', 'replace')
+
+
+def toName(s):
+    """Return text (e.g. what is typed) as the type of names and keys: a byte string on Python 2, encoded as toText decodes."""
+    if str is not bytes or isinstance(s, bytes):
+        return s
+    try:
+        return s.encode(_encoding)
+    except UnicodeEncodeError:
+        return s.encode('utf-8')
+
+
+class SearchIndex(object):
+    """Inverted index over media titles for the search box.
+
+    Every title is lower-cased (as text, see toText) and indexed twice: by
+    its words and by its character n-grams. Each key maps to a posting list of media ids (in
+    insertion order). Query tokens are matched literally and
+    case-insensitively anywhere in a title, as substrings:
+
+    * a token at least n characters long is looked up through the posting
+      list of its rarest n-gram, and only those candidates are verified;
+    * shorter tokens are checked against every title.
+
+    Results are ranked by the number of query tokens they contain, then by
+    the number of query tokens that are whole words of the title, then by
+    key, so that ties are in library order (also for titles added later).
+
+    Removal is lazy: ids of removed media stay in posting lists until enough
+    of them accumulate, at which point the index is rebuilt.
+
+    >>> class Media(object):
+    ...     def __init__(self, name): self._name = name
+    ...     def getKey(self): return self._name.lower()
+    ...     def getName(self): return self._name
+    ...     def __repr__(self): return self._name
+    >>> index = SearchIndex([Media(n) for n in ['Star Wars', 'Stargate', 'Wars of the Worlds', 'Heat']])
+    >>> index.search('star wars')
+    [Star Wars, Wars of the Worlds, Stargate]
+    >>> index.search('war')
+    [Star Wars, Wars of the Worlds]
+    >>> index.search('(a+)+$')
+    []
+    >>> index.remove(index.search('stargate')[0])
+    >>> index.search('STAR')
+    [Star Wars]
+    >>> index.add(Media('A Star Is Born'))
+    >>> results = index.search('star')
+    >>> results, sorted(results, key=lambda media: index.rank(media, ['star'])) == results
+    ([A Star Is Born, Star Wars], True)
+
+    Names and queries may be byte strings or unicode (as typed) alike.
+
+    >>> amelie = b'Am\\xc3\\xa9lie' if str is bytes else b'Am\\xc3\\xa9lie'.decode('utf-8')
+    >>> index = SearchIndex([Media(amelie), Media('Amadeus')])
+    >>> len(index.search(u'am')), index.search(u'AM\\xc9') == [index.search(u'lie')[0]]
+    (2, True)
+    """
+
+    _n = 3
+
+    # examining a previous result costs about this many index entries
+    _refineCost = 4
+
+    def __init__(self, medias=()):
+        # indexed by id; None marks removed titles
+        self._medias = []
+        self._names = []
+        self._keys = []
+        self._ids = {}
+        self._words = {}
+        self._grams = {}
+        self._dead = 0
+        for media in medias:
+            self.add(media)
+
+    def __len__(self): return len(self._ids)
+
+    @staticmethod
+    def tokenize(query):
+        return [ token.lower() for token in toText(query).split(' ') if token != '' ]
+
+    @staticmethod
+    def narrows(previous, tokens):
+        """Return True if every title matching tokens also matched previous.
+
+        This holds when both queries have the same number of tokens and each
+        token contains the corresponding previous one (e.g. typing more
+        letters of the last word).
+
+        >>> SearchIndex.narrows(['sta'], ['star'])
+        True
+        >>> SearchIndex.narrows(['star'], ['star', 'w'])
+        False
+        """
+        return len(previous) > 0 and len(previous) == len(tokens) and all(old in new for old, new in zip(previous, tokens))
+
+    @staticmethod
+    def grams(text):
+        n = SearchIndex._n
+        return set(text[i:i + n] for i in range(len(text) - n + 1))
+
+    def add(self, media):
+        key = media.getKey()
+        if key in self._ids:
+            self.remove(self._medias[self._ids[key]])
+
+        i = len(self._medias)
+        name = toText(media.getName()).lower()
+        self._ids[key] = i
+        self._medias.append(media)
+        self._names.append(name)
+        self._keys.append(key)
+        for word in set(name.split()):
+            self._words.setdefault(word, []).append(i)
+        for gram in SearchIndex.grams(name):
+            self._grams.setdefault(gram, []).append(i)
+
+    def remove(self, media):
+        i = self._ids.pop(media.getKey(), None)
+        if i is None: return
+        self._medias[i] = None
+        self._names[i] = None
+        self._keys[i] = None
+        self._dead += 1
+        if self._dead > max(1024, len(self._ids)):
+            self.rebuild()
+
+    def rebuild(self):
+        self.__init__([ media for media in self._medias if media is not None ])
+
+    def cost(self, token):
+        """Return how many titles looking token up in the index would examine."""
+        if len(token) < SearchIndex._n:
+            return len(self._names)
+        return min(len(self._grams.get(gram, ())) for gram in SearchIndex.grams(token))
+
+    def candidates(self, token):
+        """Return the ids of live titles containing token."""
+        names = self._names
+        if len(token) < SearchIndex._n:
+            return [ i for i, name in enumerate(names) if name is not None and token in name ]
+        postings = None
+        for gram in SearchIndex.grams(token):
+            p = self._grams.get(gram)
+            if p is None:
+                return []
+            if postings is None or len(p) < len(postings):
+                postings = p
+        return [ i for i in postings if names[i] is not None and token in names[i] ]
+
+    def rank(self, media, tokens):
+        """Return what orders a title among the results for the (tokenized) query tokens, or None if it is not one."""
+        name = toText(media.getName()).lower()
+        count = sum(1 for token in tokens if token in name)
+        if count == 0:
+            return None
+        words = name.split()
+        return (-count, -sum(1 for token in tokens if token in words), media.getKey())
+
+    def search(self, query, within=None):
+        """Return the media matching at least one token of query, best first.
+
+        If within is given (a previous result list that is known to contain
+        every match, see narrows), only those titles are examined, unless the
+        index can answer the query by looking at fewer titles.
+
+        >>> class Media(object):
+        ...     def __init__(self, name): self._name = name
+        ...     def getKey(self): return self._name.lower()
+        ...     def getName(self): return self._name
+        ...     def __repr__(self): return self._name
+        >>> index = SearchIndex([Media(n) for n in ['Star Wars', 'Stardust', 'Start', 'Heat']])
+        >>> results = index.search('sta')
+        >>> results
+        [Star Wars, Stardust, Start]
+        >>> index.search('star', results) == index.search('star')
+        True
+        """
+        tokens = SearchIndex.tokenize(query)
+        matches = {}
+        words = {}
+        names = self._names
+        ids = None
+        if within is not None and SearchIndex._refineCost * len(within) < sum(self.cost(token) for token in set(tokens)):
+            ids = [ self._ids[media.getKey()] for media in within if media.getKey() in self._ids ]
+        for token in set(tokens):
+            weight = tokens.count(token)
+            if ids is None:
+                candidates = self.candidates(token)
+            else:
+                candidates = [ i for i in ids if token in names[i] ]
+            for i in candidates:
+                matches[i] = matches.get(i, 0) + weight
+
+            # whole-word matches, walking whichever list is shorter
+            postings = self._words.get(token, ())
+            if len(postings) <= len(candidates):
+                candidates = set(candidates)
+                wordMatches = [ i for i in postings if i in candidates ]
+            else:
+                wordMatches = [ i for i in candidates if token in names[i].split() ]
+            for i in wordMatches:
+                words[i] = words.get(i, 0) + weight
+
+        # bucket by score so that only keys (not titles) are ever compared
+        buckets = {}
+        for i, count in matches.items():
+            buckets.setdefault((count, words.get(i, 0)), []).append(i)
+        medias = self._medias
+        keys = self._keys
+        results = []
+        for score in sorted(buckets, reverse=True):
+            results.extend(medias[i] for i in sorted(buckets[score], key=keys.__getitem__))
+        return results
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
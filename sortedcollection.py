@@ -0,0 +1,184 @@
+from bisect import bisect_left
+import itertools
+
+
+class SortedCollection(object):
+    """Values kept sorted by a unique key, with positional access.
+
+    Values are stored in sorted blocks of at most 2 * `load` values. A
+    Fenwick tree over the block lengths turns a position into a block and
+    an offset (select) and a block into the number of values before it
+    (rank), both in O(log n), so `collection[position]`, index(key) and
+    bisect(key) never walk the collection. add and remove shift at most
+    one block.
+
+    >>> collection = SortedCollection(['delta', 'alpha', 'echo'], key=str.lower, load=2)
+    >>> collection.add('Charlie'), collection.add('bravo')
+    (1, 1)
+    >>> list(collection), len(collection)
+    (['alpha', 'bravo', 'Charlie', 'delta', 'echo'], 5)
+    >>> collection[3], collection[-1], collection.index('charlie'), collection.bisect('c'), collection.bisect('zulu')
+    ('delta', 'echo', 2, 2, 5)
+    >>> collection.remove('alpha'), collection.get('alpha'), 'bravo' in collection
+    ('alpha', None, True)
+    >>> [ collection[k] for k in range(len(collection)) ]
+    ['bravo', 'Charlie', 'delta', 'echo']
+    >>> collection.index('alpha')
+    Traceback (most recent call last):
+        ...
+    KeyError: 'alpha'
+    """
+
+    def __init__(self, values=(), key=None, load=256):
+        self._key = key if key is not None else lambda value: value
+        self._load = load
+        values = sorted(values, key=self._key)
+        keys = [ self._key(value) for value in values ]
+        self._values = [ values[i:i + load] for i in range(0, len(values), load) ]
+        self._keys = [ keys[i:i + load] for i in range(0, len(keys), load) ]
+        self._maxes = [ block[-1] for block in self._keys ]
+        self._len = len(values)
+        self._rebuild()
+
+    def _rebuild(self):
+        # tree[i] holds the number of values in blocks i - (i & -i) to i - 1
+        tree = [0] + [ len(block) for block in self._values ]
+        for i in range(1, len(tree)):
+            j = i + (i & -i)
+            if j < len(tree):
+                tree[j] += tree[i]
+        self._tree = tree
+
+    def _grow(self, block, delta):
+        tree = self._tree
+        i = block + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def _before(self, block):
+        """Return the number of values in the blocks before block."""
+        tree = self._tree
+        count = 0
+        i = block
+        while i > 0:
+            count += tree[i]
+            i -= i & -i
+        return count
+
+    def _select(self, position):
+        """Return (block, offset) of the value at position."""
+        tree = self._tree
+        block = 0
+        step = 1
+        while step * 2 < len(tree):
+            step *= 2
+        while step > 0:
+            if block + step < len(tree) and tree[block + step] <= position:
+                block += step
+                position -= tree[block]
+            step //= 2
+        return block, position
+
+    def _find(self, key):
+        """Return (block, offset) of key, or raise KeyError."""
+        block = bisect_left(self._maxes, key)
+        if block < len(self._maxes):
+            keys = self._keys[block]
+            offset = bisect_left(keys, key)
+            if offset < len(keys) and keys[offset] == key:
+                return block, offset
+        raise KeyError(key)
+
+    def __len__(self): return self._len
+
+    def __iter__(self): return itertools.chain.from_iterable(self._values)
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += self._len
+        if not 0 <= position < self._len:
+            raise IndexError(position)
+        block, offset = self._select(position)
+        return self._values[block][offset]
+
+    def __contains__(self, key):
+        try:
+            self._find(key)
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            block, offset = self._find(key)
+        except KeyError:
+            return default
+        return self._values[block][offset]
+
+    def index(self, key):
+        """Return the position of the value with key, or raise KeyError."""
+        block, offset = self._find(key)
+        return self._before(block) + offset
+
+    def bisect(self, key):
+        """Return the position of the first value whose key is not less than key."""
+        block = bisect_left(self._maxes, key)
+        if block == len(self._maxes):
+            return self._len
+        return self._before(block) + bisect_left(self._keys[block], key)
+
+    def add(self, value):
+        """Insert value (replacing the one with the same key) and return its position."""
+        key = self._key(value)
+        if not self._values:
+            self._values.append([value])
+            self._keys.append([key])
+            self._maxes.append(key)
+            self._len = 1
+            self._rebuild()
+            return 0
+        block = min(bisect_left(self._maxes, key), len(self._maxes) - 1)
+        keys = self._keys[block]
+        offset = bisect_left(keys, key)
+        position = self._before(block) + offset
+        if offset < len(keys) and keys[offset] == key:
+            self._values[block][offset] = value
+            return position
+        keys.insert(offset, key)
+        self._values[block].insert(offset, value)
+        self._maxes[block] = keys[-1]
+        self._len += 1
+        if len(keys) > 2 * self._load:
+            # split the block in halves
+            half = len(keys) // 2
+            self._keys[block:block + 1] = [keys[:half], keys[half:]]
+            values = self._values[block]
+            self._values[block:block + 1] = [values[:half], values[half:]]
+            self._maxes[block:block + 1] = [keys[half - 1], keys[-1]]
+            self._rebuild()
+        else:
+            self._grow(block, 1)
+        return position
+
+    def remove(self, key):
+        """Remove and return the value with key, or raise KeyError."""
+        block, offset = self._find(key)
+        keys = self._keys[block]
+        del keys[offset]
+        value = self._values[block].pop(offset)
+        self._len -= 1
+        if keys:
+            self._maxes[block] = keys[-1]
+            self._grow(block, -1)
+        else:
+            del self._keys[block]
+            del self._values[block]
+            del self._maxes[block]
+            self._rebuild()
+        return value
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,102 @@
+from collections import OrderedDict
+
+
+class TextureCache(object):
+    """Keeps the most recently used textures resident within a memory budget.
+
+    Textures are created on demand: get(key, source) returns the resident
+    value for key, calling load(source) -> (value, size) if there is none.
+    Once the total size exceeds `budget`, the least recently used values
+    are passed to unload(value) and dropped, except that the `minimum` most
+    recently used ones are always kept (so that everything drawn in one
+    frame stays resident even under a tiny budget). Memory the values share
+    (e.g. the atlas pages holding them) is counted with charge.
+
+    >>> sizes = { 'a': 40, 'b': 40, 'c': 40 }
+    >>> unloaded = []
+    >>> cache = TextureCache(lambda key: (key.upper(), sizes[key]), unloaded.append, budget=100)
+    >>> cache.get('a', 'a'), cache.get('b', 'b'), cache.get('a', 'a')
+    ('A', 'B', 'A')
+    >>> cache.get('c', 'c')
+    'C'
+    >>> unloaded, 'b' in cache, len(cache)
+    (['B'], False, 2)
+    >>> cache.peek('c'), cache.peek('b')
+    ('C', None)
+    >>> cache.discard('a')
+    >>> sorted(cache.getStatistics().items())
+    [('bytes', 40), ('evicted', 1), ('loaded', 3), ('resident', 1)]
+    >>> cache.clear(); unloaded
+    ['B', 'A', 'C']
+    >>> cache.get('a', 'a'), cache.get('b', 'b'); cache.charge(60)
+    ('A', 'B')
+    >>> cache.get('c', 'c'), unloaded[3:], cache.getStatistics()['bytes']
+    ('C', ['A', 'B'], 100)
+    """
+
+    def __init__(self, load, unload, budget, minimum=0):
+        self._load = load
+        self._unload = unload
+        self._budget = budget
+        self._minimum = minimum
+        # key -> (value, size), least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._loaded = 0
+        self._evicted = 0
+
+    def __len__(self): return len(self._entries)
+
+    def __contains__(self, key): return key in self._entries
+
+    def getStatistics(self):
+        return { 'resident': len(self._entries), 'bytes': self._bytes, 'loaded': self._loaded, 'evicted': self._evicted }
+
+    def get(self, key, source):
+        """Return the value for key, loading it from source if it is not resident."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            entry = self._load(source)
+            self._bytes += entry[1]
+            self._loaded += 1
+        self._entries[key] = entry
+        self.evict()
+        return entry[0]
+
+    def peek(self, key):
+        """Return the resident value for key (or None), without loading it or marking it used."""
+        entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def discard(self, key):
+        """Unload the value for key (e.g. because its source changed)."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+            self._unload(entry[0])
+
+    def charge(self, size):
+        """Count size bytes held outside the values against the budget (a negative size releases them).
+
+        The budget is enforced by the next get.
+        """
+        self._bytes += size
+
+    def evict(self):
+        while self._bytes > self._budget and len(self._entries) > self._minimum:
+            key, (value, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self._evicted += 1
+            self._unload(value)
+
+    def clear(self):
+        """Unload every value."""
+        for value, size in self._entries.values():
+            self._unload(value)
+        self._entries.clear()
+        self._bytes = 0
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,91 @@
+import os
+import sys
+from threading import Lock
+
+
+class ThumbnailCache(object):
+    """On-disk cache of covers downscaled to the resolution tiles are drawn at.
+
+    Thumbnails are stored under `directory`, one subdirectory per size, and
+    named after the (hexadecimal) digest of the original in the cover
+    store, so a cover that is replaced (e.g. through "Change cover") gets a
+    new one, and titles sharing a cover share its thumbnail.
+
+    >>> import hashlib, shutil, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> digest = hashlib.sha1(b'cover').hexdigest()
+    >>> cache = ThumbnailCache(os.path.join(directory, 'thumbnails'), 512)
+    >>> cache.lookup(digest) is None
+    True
+    >>> def write(path):
+    ...     with open(path, 'w') as f: f.write('scaled')
+    >>> cache.store(digest, write)
+    >>> open(cache.lookup(digest)).read()
+    'scaled'
+    >>> sorted(cache.getStatistics().items())
+    [('hits', 1), ('misses', 1)]
+    >>> shutil.rmtree(directory)
+    """
+
+    def __init__(self, directory, size):
+        self._directory = os.path.join(directory, str(size))
+        self._size = size
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def resolution(pixels):
+        """Return the thumbnail size for tiles drawn `pixels` high.
+
+        Sizes are powers of two, so that small changes of the window size
+        reuse the same thumbnails.
+
+        >>> ThumbnailCache.resolution(518), ThumbnailCache.resolution(20), ThumbnailCache.resolution(10000)
+        (1024, 128, 2048)
+        """
+        size = 128
+        while size < pixels and size < 2048:
+            size *= 2
+        return size
+
+    def getSize(self): return self._size
+
+    def getStatistics(self):
+        with self._lock:
+            return { 'hits': self._hits, 'misses': self._misses }
+
+    def getPath(self, digest):
+        """Return where the thumbnail of the cover with a digest is stored."""
+        return os.path.join(self._directory, digest + '.jpg')
+
+    def lookup(self, digest):
+        """Return the path of the thumbnail of a cover, or None if there is none yet."""
+        path = self.getPath(digest)
+        found = os.path.isfile(path)
+        with self._lock:
+            if found: self._hits += 1
+            else: self._misses += 1
+        return path if found else None
+
+    def store(self, digest, write):
+        """Store the thumbnail of a cover; write(path) writes it to a file."""
+        path = self.getPath(digest)
+        tmpPath = '%s.%d.tmp' % (path, id(write))
+        try:
+            if not os.path.isdir(self._directory):
+                os.makedirs(self._directory)
+        except OSError:
+            pass
+        try:
+            write(tmpPath)
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path)
+            os.rename(tmpPath, path)
+        except (IOError, OSError) as exc:
+            sys.stderr.write('warning: could not write thumbnail `%s`: %s\r\n' % (path, exc))
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,171 @@
+import re
+
+
+def _caseless(pattern):
+    """Rewrite a regular expression so that it matches letters in either case.
+
+    This lets case-insensitive rules share a single compiled expression with
+    case-sensitive ones (Python 2 has no scoped (?i:...) groups).
+
+    >>> _caseless('^B[DR]$')
+    '^[Bb][DRdr]$'
+    >>> _caseless('^\\\\[[^]].*\\\\]$')
+    '^\\\\[[^]].*\\\\]$'
+    """
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            out.append(pattern[i:i + 2])
+            i += 2
+        elif c == '[':
+            # copy the class, adding the other case of every letter in it
+            j = i + 1
+            if j < len(pattern) and pattern[j] == '^': j += 1
+            if j < len(pattern) and pattern[j] == ']': j += 1
+            while pattern[j] != ']':
+                j += 2 if pattern[j] == '\\' else 1
+            body = pattern[i + 1:j]
+            extra = ''.join(sorted(set(c.swapcase() for c in body if c.isalpha() and c.swapcase() not in body)))
+            out.append('[' + body + extra + ']')
+            i = j + 1
+        elif c.isalpha():
+            out.append('[' + c.upper() + c.lower() + ']')
+            i += 1
+        else:
+            out.append(c)
+            i += 1
+    return ''.join(out)
+
+
+class TitleParser(object):
+    """Extracts (title, year) from the name of a video file or directory.
+
+    Delimiters are turned into spaces and leading [tags] are dropped. The
+    title is then every token before the first one that holds a year (which
+    is returned as the year) or that matches one of the halt rules (release
+    tags such as `720p`, `DVDRip` or `S01E02`).
+
+    All halt rules are compiled into a single expression and results are
+    memoized by raw name, so parsing a library with many duplicate names
+    (episodes, multi-part releases) is cheap.
+
+    >>> parser = TitleParser()
+    >>> parser.parse('The.Big.Lebowski.1998.720p.BluRay.x264')
+    ('The Big Lebowski', '1998')
+    >>> parser.parse('[HorribleSubs] Some_Show - S01E02 - HDRip')
+    ('Some Show', None)
+    >>> parser.parseBatch(['Alien (1979)', 'Heat.DVDRip.XviD', 'season 1'])
+    [('Alien', '1979'), ('Heat', None), ('', None)]
+    """
+
+    _delimiters = re.compile('[.\\-_:,;]')
+    _pattern = re.compile('(\\s*\\[[^]]*\\])*\\s*(.*)')
+    _halts = [ \
+          ('^season[0-9]?$', re.I) \
+        , ('^S[0-9]{1,2}E[0-9]{1,2}$', re.I) \
+        , ('DVD', re.I) \
+        , ('DVDR', re.I) \
+        , ('DVDRip', re.I) \
+        , ('DVDSCR', re.I) \
+        , ('XviD', re.I) \
+        , ('B[DR]Rip', re.I) \
+        , ('^B[DR]$', re.I) \
+        , ('WEBRip', re.I) \
+        , ('HDCAM', re.I) \
+        , ('HDRip', re.I) \
+        , ('^DD([0-9]\\.[0-9])?$', 0) \
+        , ('^[0-9]{3,4}p$', 0) \
+        , ('^TS$', 0) \
+        , ('^US$', 0) \
+        , ('^HC$', 0) \
+        , ('^NL$', 0) \
+        , ('^Subs$', re.I) \
+        , ('^\\[[^]].*\\]$', 0) \
+    ]
+    _halt = re.compile('|'.join('(?:%s)' % (_caseless(p) if flags & re.I else p) for p, flags in _halts))
+    _year = re.compile('\\(?([0-9]{4})\\)?')
+
+    _maxCache = 1 << 20
+
+    def __init__(self):
+        self._cache = {}
+
+    def parse(self, name):
+        """Return (title, year) for a raw name; title is '' if nothing is left."""
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+
+        tokens = TitleParser._pattern.match(TitleParser._delimiters.sub(' ', name)).group(2).split(' ')
+        year = None
+        end = len(tokens)
+        yearSearch = TitleParser._year.search
+        haltSearch = TitleParser._halt.search
+        for k, token in enumerate(tokens):
+            m = yearSearch(token)
+            if m:
+                year = m.group(1)
+                end = k
+                break
+            if haltSearch(token):
+                end = k
+                break
+        result = (' '.join(tokens[:end]).strip(), year)
+
+        if len(self._cache) >= TitleParser._maxCache:
+            self._cache.clear()
+        self._cache[name] = result
+        return result
+
+    def parseBatch(self, names):
+        """Parse many names at once, returning a list of (title, year)."""
+        parse = self.parse
+        return [parse(name) for name in names]
+
+    def clear(self):
+        self._cache.clear()
+
+
+_referenceHalts = [re.compile(p, flags) for p, flags in TitleParser._halts]
+
+
+def parseReference(name):
+    """Rule-by-rule parse, exactly as VideoCoverflow.addMedia originally did it.
+
+    Kept as the reference that TitleParser is checked against.
+
+    >>> names = ['A.Movie.2010.1080p', 'Show S02E03 720p', 'Film.DD5.1', 'x [tag] y', 'Subs']
+    >>> [parseReference(name) for name in names] == TitleParser().parseBatch(names)
+    True
+    """
+    l = []
+    for c in name:
+        if c in ['.', '-', '_', ':', ',', ';']:
+            l.append(' ')
+        else:
+            l.append(c)
+    tokens = TitleParser._pattern.match( ''.join(l) ).group(2).split(' ')
+    l = []
+    stop = False
+    year = None
+    for token in tokens:
+        m = TitleParser._year.search(token)
+        if m:
+            stop = True
+            year = m.group(1)
+            break
+        for halt in _referenceHalts:
+            if halt.search(token):
+                stop = True
+                break
+        if stop: break
+        l.append(token)
+    return (' '.join(l).strip(), year)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
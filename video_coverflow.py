@@ -1,3 +1,4 @@
+import collections
 import ctypes
 import errno
 import fnmatch
@@ -5,20 +6,35 @@ import imghdr
 import json
 import math
 import re
-import multiprocessing
 import os
-import shutil
 import subprocess
 import sys
 import time
-from threading import Thread
 
 from xml.etree import ElementTree
 
 from PySide import QtCore, QtGui, QtOpenGL # TODO: Why not imported?
 from OpenGL import GLU, GL
 
-from trie import Node, Trie
+from atlas import Atlas
+from catalog import Catalog
+from coverdownload import Pipeline
+from coverstore import CoverStore
+from framescheduler import FrameScheduler
+from profiler import FrameProfiler
+from metadatacache import MetadataCache
+from layout import Layout, glMatrix
+from prefixindex import PrefixIndex
+from radix import RadixTrie
+from renderer import Batch
+from scanindex import ScanIndex
+from scanner import Scanner
+from searchindex import SearchIndex, toName
+from sortedcollection import SortedCollection
+from texturecache import TextureCache
+from thumbnails import ThumbnailCache
+from titleparser import TitleParser
+from watcher import createWatcher
 
 if sys.version_info[0] >= 3:
     #from configparser import SafeConfigParser
@@ -73,35 +89,22 @@ class VideoCoverflow(QtGui.QMainWindow):
     _iniFilename = 'config.ini'
     _iniPath = os.path.join(_configPath, _iniFilename)
     _iniSection = 'CUSTOM'
-    _iniDefaults = { 'width': '1024', 'height': '576', 'fullscreen': '0', 'scale': '0.5', 'extensions': '.3gp,.asf,.avi,.flv,.m4v,.mkv,.mov,.mpeg,.mpg,.mpe,.mp4,.ogg,.ogv,.ogm,.rmi,.wmv', 'css': 'QToolBar QLabel, QToolBar QLineEdit { font-size: 28px; } QToolBar { padding: 15px; background-color: black; border: 1px solid black; } QToolBar QLabel { color: white; } QToolBar QLineEdit { padding: 5px; background-color: white; color: black; border-radius: 5px; }' }
-
-    _delimiters = ['.', '-', '_', ':', ',', ';']
-    _pattern = re.compile('(\s*\[[^]]*\])*\s*(.*)')
-    _halts = [ \
-          re.compile('^season[0-9]?$(?i)') \
-        , re.compile('^S[0-9]{1,2}E[0-9]{1,2}$(?i)') \
-        , re.compile('DVD(?i)') \
-        , re.compile('DVDR(?i)') \
-        , re.compile('DVDRip(?i)') \
-        , re.compile('DVDSCR(?i)') \
-        , re.compile('XviD(?i)') \
-        , re.compile('B[DR]Rip(?i)') \
-        , re.compile('^B[DR]$(?i)') \
-        , re.compile('WEBRip(?i)') \
-        , re.compile('HDCAM(?i)') \
-        , re.compile('HDRip(?i)') \
-        , re.compile('^DD([0-9]\.[0-9])?$') \
-        , re.compile('^[0-9]{3,4}p$') \
-        , re.compile('^TS$') \
-        , re.compile('^US$') \
-        , re.compile('^HC$') \
-        , re.compile('^NL$') \
-        , re.compile('^Subs$(?i)') \
-        , re.compile('^\[[^]].*\]$') \
-    ]
-    _year = re.compile('\(?([0-9]{4})\)?')
-
-    _sleep = 1
+    _indexFilename = 'index.json'
+    _indexPath = os.path.join(_configPath, _indexFilename)
+    _thumbnailDirectory = 'thumbnails'
+    _thumbnailPath = os.path.join(_configPath, _thumbnailDirectory)
+    _metadataFilename = 'metadata.json'
+    _metadataPath = os.path.join(_configPath, _metadataFilename)
+    _coverDirectory = 'covers'
+    _coverPath = os.path.join(_configPath, _coverDirectory)
+    _catalogFilename = 'catalog.sqlite'
+    _catalogPath = os.path.join(_configPath, _catalogFilename)
+    _iniDefaults = { 'width': '1024', 'height': '576', 'fullscreen': '0', 'scale': '0.5', 'workers': '8', 'index': '1', 'catalog': '0', 'watch': '1', 'downloads': '4', 'rate': '2', 'textures': '256', 'atlas': '1', 'renderer': 'lists', 'extensions': '.3gp,.asf,.avi,.flv,.m4v,.mkv,.mov,.mpeg,.mpg,.mpe,.mp4,.ogg,.ogv,.ogm,.rmi,.wmv', 'css': 'QToolBar QLabel, QToolBar QLineEdit { font-size: 28px; } QToolBar { padding: 15px; background-color: black; border: 1px solid black; } QToolBar QLabel { color: white; } QToolBar QLineEdit { padding: 5px; background-color: white; color: black; border-radius: 5px; }' }
+
+    _parser = TitleParser()
+
+    _populateBatch = 256
+    _watchInterval = 500
 
     _defaultCoverPath = os.path.join( os.path.abspath(os.path.dirname(__file__)), 'img/film.png' )
     _openIcon = os.path.join( os.path.abspath(os.path.dirname(__file__)), 'img/open.png' )
@@ -113,12 +116,38 @@ class VideoCoverflow(QtGui.QMainWindow):
 
     class TileflowWidget(QtOpenGL.QGLWidget):
 
+        # emitted (from worker threads) when a downloaded or decoded cover is ready
+        coversReady = QtCore.Signal()
+
         _spreadImage = 0.14
         _flankSpread = 0.4
         _visibleTiles = 10
         _direction = 1
+
+        # covers within this many tiles of the centre are downloaded first
+        _prefetchTiles = 32
+        # titles are queued for download outwards from the centre, at most
+        # _downloadWindow at a time; every _sweepInterval ms the window is
+        # refilled, looking at up to _sweepStep titles
+        _downloadWindow = 64
+        _sweepInterval = 250
+        _sweepStep = 1024
+        # attempts after a transient network error, backing off exponentially
+        _retries = 3
+        _decoders = 2
+
+        # atlas pages are at least _atlasSize texels wide, enough for 4 rows of covers
+        _atlasSize = 2048
+        _maxAtlasSize = 4096
         _dscale = 0.1
 
+        # animation frames are _frameInterval ms apart
+        _frameInterval = 20
+
+        # typing jumps to the first title starting with what was typed; a
+        # pause of _typeAheadTimeout seconds starts over
+        _typeAheadTimeout = 1.
+
         _minWidth = 640
         _minHeight = 320
 
@@ -129,26 +158,90 @@ class VideoCoverflow(QtGui.QMainWindow):
 
             self._xvel = 0
 
-            self._queue = multiprocessing.Queue()
-            self._lists = set()
+            self._typed = ''
+            self._typedAt = 0.
+
+            self._layout = Layout(VideoCoverflow.TileflowWidget._spreadImage, VideoCoverflow.TileflowWidget._flankSpread, VideoCoverflow.TileflowWidget._direction, VideoCoverflow.TileflowWidget._visibleTiles)
+
+            # keys of the covers written by the download workers
+            self._downloaded = collections.deque()
+            # lookups, page and image requests overlap; each network stage
+            # runs at most `downloads` requests at a time
+            downloads = int(browser.get('downloads'))
+            retries = VideoCoverflow.TileflowWidget._retries
+            self._downloads = Pipeline([ \
+                  ('lookup', self.lookupStage, downloads, retries) \
+                , ('page', self.pageStage, downloads, retries) \
+                , ('image', self.imageStage, downloads, retries) \
+                , ('write', self.writeStage, 1, 0) \
+            ], float(browser.get('rate')), onError=self.downloadFailed)
+            self._downloads.start()
+            self._covers = browser.getCoverStore()
+            # keys of the titles whose covers could not be found
+            self._failed = set()
+            self._sweepTimer = QtCore.QTimer(self)
+            self._sweepTimer.setInterval(VideoCoverflow.TileflowWidget._sweepInterval)
+            self._sweepTimer.timeout.connect(self.sweep)
+
+            # only the tiles drawn recently keep a texture
+            budget = int(browser.get('textures')) << 20
+            self._textures = TextureCache(self.loadTile, self.unloadTile, budget, 2 * VideoCoverflow.TileflowWidget._visibleTiles)
+            self._missing_tile = None
+
+            # covers are decoded and downscaled off the GUI thread; only the
+            # upload happens in loadTile
+            self._thumbnails = ThumbnailCache(VideoCoverflow._thumbnailPath, ThumbnailCache.resolution(self.tilePixels()))
+            self._decoder = Pipeline([('decode', self.decodeStage, VideoCoverflow.TileflowWidget._decoders, 0)], onError=self.decodeFailed)
+            self._decoder.start()
+            self._decoded = collections.deque()
+            self._images = {}
+
+            # decoded covers share a few large textures
+            # bytes of every atlas page, by texture
+            self._atlasPages = {}
+            self._atlas = self.createAtlas()
+            self._boundTexture = None
+            self._frameBinds = 0
+            self._vertexBuffer = None
+
+            # one timer, running only while the strip moves or covers arrive
+            self._timer = QtCore.QTimer(self)
+            self._frames = FrameScheduler(self.focusTile, self._timer.start, self._timer.stop, VideoCoverflow.TileflowWidget._frameInterval)
+            self._timer.timeout.connect(self._frames.run)
+            # workers wake the scheduler through a queued signal, on the GUI thread
+            self.coversReady.connect(self._frames.wake, QtCore.Qt.QueuedConnection)
+            # timings of the last frames, optionally shown over the tiles
+            self._profiler = FrameProfiler(interval=VideoCoverflow.TileflowWidget._frameInterval)
+            self._overlay = False
+
             self._hasCleared = False
             self.clear()
 
         def clear(self):
-            for ind in self._lists:
-                GL.glDeleteLists(ind, 1)
-            self._lists.clear()
-
-            self._indexMapping = []
+            # downloads and decodes queued for the previous library are dropped
+            self._downloads.cancel()
+            self._decoder.cancel()
+            self._images = {}
+            # (centre, radius) of the titles queued for download so far
+            self._sweep = None
+            self._sweepTimer.stop()
+            self._failed.clear()
+
+            if self._missing_tile is not None:
+                self.makeCurrent()
+                self._textures.clear()
+                self.freeTile(self._missing_tile)
+                self._missing_tile = None
+
+            self._prioritizedMid = None
+            # the title the status bar shows
+            self._shownMedia = None
 
             self._clearColor = QtCore.Qt.black
             self._lastPos = QtCore.QPoint()
             self._offset = 0
             self._mouseDown = False
-
-            timer = QtCore.QTimer(self)
-            timer.timeout.connect(self.focusTile)
-            timer.start(20)
+            self._downloaded.clear()
 
             if self._hasCleared:
                 self.initializeGL()
@@ -161,18 +254,19 @@ class VideoCoverflow(QtGui.QMainWindow):
         def sizeHint(self):
             return QtCore.QSize( int(self._browser.get('width')), int(self._browser.get('height')) )
 
-        def generateTile(self, ind, texture):
+        def generateTile(self, ind, texCoords=(0., 0., 1., 1.)):
+            # the texture is bound by drawTile, so that tiles sharing an atlas page share the bind
+            u0, v0, u1, v1 = texCoords
             GL.glNewList(ind, GL.GL_COMPILE)
-            GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
 
             GL.glBegin(GL.GL_QUADS)
-            GL.glTexCoord2d(1, 0)
+            GL.glTexCoord2d(u1, v0)
             GL.glVertex3d(1, -1, 0)
-            GL.glTexCoord2d(0, 0)
+            GL.glTexCoord2d(u0, v0)
             GL.glVertex3d(-1, -1, 0)
-            GL.glTexCoord2d(0, 1)
+            GL.glTexCoord2d(u0, v1)
             GL.glVertex3d(-1, 1, 0)
-            GL.glTexCoord2d(1, 1)
+            GL.glTexCoord2d(u1, v1)
             GL.glVertex3d(1, 1, 0)
             GL.glEnd()
 
@@ -181,13 +275,13 @@ class VideoCoverflow(QtGui.QMainWindow):
             GL.glColor4f(1, 1, 1, 0.5)
 
             GL.glBegin(GL.GL_QUADS)
-            GL.glTexCoord2d(1, 0)
+            GL.glTexCoord2d(u1, v0)
             GL.glVertex3d(1, -1, 0)
-            GL.glTexCoord2d(0, 0)
+            GL.glTexCoord2d(u0, v0)
             GL.glVertex3d(-1, -1, 0)
-            GL.glTexCoord2d(0, 1)
+            GL.glTexCoord2d(u0, v1)
             GL.glVertex3d(-1, 1, 0)
-            GL.glTexCoord2d(1, 1)
+            GL.glTexCoord2d(u1, v1)
             GL.glVertex3d(1, 1, 0)
             GL.glEnd()
 
@@ -195,53 +289,267 @@ class VideoCoverflow(QtGui.QMainWindow):
 
             GL.glEndList()
 
+        def loadTile(self, media):
+            """Upload the cover of a title, returning ((display list, texture, atlas key, texture coordinates), bytes).
+
+            Covers that have not been decoded yet are queued for decoding and
+            shown as the missing tile until the decoded image arrives.
+            """
+            image = self._images.pop(media.getKey(), None)
+            if image is None:
+                digest = self._covers.getDigest(media.getKey())
+                if digest is None and self._covers.importFile(media.getKey(), media.getCoverPath()):
+                    # saved as a loose file by an earlier version
+                    self._browser.recordCover(media.getKey())
+                    digest = self._covers.getDigest(media.getKey())
+                if digest is not None:
+                    # by cover as well as by title, so that a changed cover is not
+                    # taken for the old one still being decoded
+                    self._decoder.submit((media.getKey(), digest), None)
+                return (self._missing_tile, 0)
+            with self._profiler.time('upload'):
+                tile, size = self.uploadTile(media.getKey(), image)
+            self._profiler.upload(size)
+            # the pages of the atlas are charged to the budget as a whole
+            return (tile, size if tile[2] is None else 0)
+
+        def uploadTile(self, key, image):
+            ind = GL.glGenLists(1)
+            self._boundTexture = None
+            if self._atlas is not None:
+                texture, x, y, width, height = self._atlas.allocate(key)
+                GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+                GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, x, y, width, height, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, image.constBits())
+                texCoords = self._atlas.getTexCoords(key, 0.5)
+                self.generateTile(ind, texCoords)
+                return ((ind, texture, key, texCoords), width * height * 4)
+            texture = self.bindTexture(image)
+            self.generateTile(ind)
+            # mipmaps add a third
+            return ((ind, texture, None, (0., 0., 1., 1.)), image.width() * image.height() * 4 * 4 // 3)
+
+        def tilePixels(self):
+            """Return how many pixels high the centre tile is drawn."""
+            return 0.45 * float(self._browser.get('height')) / float(self._browser.get('scale'))
+
+        def updateResolution(self):
+            # thumbnails are only ever enlarged, so shrinking the window keeps the textures
+            size = ThumbnailCache.resolution(self.tilePixels())
+            if size > self._thumbnails.getSize():
+                self._thumbnails = ThumbnailCache(VideoCoverflow._thumbnailPath, size)
+                self._decoder.cancel()
+                self._images = {}
+                self.makeCurrent()
+                self._textures.clear()
+                self._atlas = self.createAtlas()
+
+        def decodeStage(self, job, value, fetch):
+            key, digest = job
+            thumbnails = self._thumbnails
+            atlas = self._atlas
+            image = None
+            thumbnailPath = thumbnails.lookup(digest)
+            if thumbnailPath is not None:
+                image = QtGui.QImage(thumbnailPath)
+            if image is None or image.isNull():
+                data = self._covers.read(digest)
+                image = QtGui.QImage.fromData(data) if data is not None else None
+                if image is None or image.isNull():
+                    raise IOError('could not decode the cover of `%s`' % (key))
+                size = thumbnails.getSize()
+                if image.width() > size or image.height() > size:
+                    image = image.scaled(size, size, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+                def write(path):
+                    if not image.save(path, 'JPG', 90):
+                        raise IOError('could not encode thumbnail')
+                thumbnails.store(digest, write)
+            if atlas is not None:
+                # stretched to its cell, ready for glTexSubImage2D
+                width, height = atlas.getCellSize()
+                image = QtOpenGL.QGLWidget.convertToGLFormat(image.scaled(width, height, QtCore.Qt.IgnoreAspectRatio, QtCore.Qt.SmoothTransformation))
+            self._decoded.append((key, digest, image, thumbnails.getSize()))
+            self.coversReady.emit()
+
+        def decodeFailed(self, job, exc):
+            sys.stderr.write( 'warning: %s\r\n' % (exc) )
+
+        def unloadTile(self, tile):
+            # titles without a cover share the missing tile
+            if tile is not self._missing_tile:
+                self.freeTile(tile)
+
+        def freeTile(self, tile):
+            ind, texture, key, texCoords = tile
+            GL.glDeleteLists(ind, 1)
+            if key is not None:
+                self._atlas.free(key)
+            else:
+                self.deleteTexture(texture)
+
+        def createAtlas(self):
+            """Return an atlas with one cell (of poster proportions) per cover, or None if disabled."""
+            if not int(self._browser.get('atlas')):
+                return None
+            size = self._thumbnails.getSize()
+            self._atlasSize = min(VideoCoverflow.TileflowWidget._maxAtlasSize, max(VideoCoverflow.TileflowWidget._atlasSize, 4 * size))
+            return Atlas(self._atlasSize, size * 2 // 3, size, self.createAtlasPage, self.deleteAtlasPage)
+
+        def createAtlasPage(self):
+            texture = GL.glGenTextures(1)
+            GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+            GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, self._atlasSize, self._atlasSize, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, None)
+            self._boundTexture = None
+            # a page takes its full size however few covers it holds
+            self._atlasPages[texture] = self._atlasSize * self._atlasSize * 4
+            self._textures.charge(self._atlasPages[texture])
+            return texture
+
+        def deleteAtlasPage(self, texture):
+            GL.glDeleteTextures([texture])
+            self._textures.charge(-self._atlasPages.pop(texture))
+
+        def deleteTile(self, media):
+            self._images.pop(media.getKey(), None)
+            self._textures.discard(media.getKey())
+
+        def tileFor(self, media):
+            return self._textures.get(media.getKey(), media)
+
+        def getTextureStatistics(self):
+            statistics = self._textures.getStatistics()
+            statistics['binds'] = self._frameBinds
+            if self._atlas is not None:
+                statistics.update(('atlas %s' % (name), value) for name, value in self._atlas.getStatistics().items())
+            return statistics
+
+        def getFrameStatistics(self): return self._frames.getStatistics()
+
+        def missingTiles(self):
+            """Return how many of the visible tiles do not show their cover yet."""
+            offset, mid = self.offsetMid()
+            return sum(1 for i in self._layout.positions(offset, len(self._browser)) if self._textures.peek(self._browser[i].getKey()) in [None, self._missing_tile])
+
         def initializeGL(self):
             # generate lists
-            self._missing_tile = GL.glGenLists(1)
-            self._lists.add(self._missing_tile)
+            ind = GL.glGenLists(1)
             defaultTexture = self.bindTexture(QtGui.QPixmap( VideoCoverflow._defaultCoverPath ))
-            self.generateTile(self._missing_tile, defaultTexture)
-
-            for media in self._browser:
-                coverPath = media.getCover()
-                if coverPath is not None:
-                    texture = self.bindTexture(QtGui.QPixmap(coverPath))
-                    ind = GL.glGenLists(1)
-                    self.generateTile(ind, texture)
-                    self._lists.add(ind)
-                    self._indexMapping.append((media, ind))
-                else:
-                    self._indexMapping.append((media, self._missing_tile))
-
-        def spawnDownloadCoverDaemon(self):
-            timer = QtCore.QTimer(self)
-            timer.setSingleShot(True)
-            timer.timeout.connect(self.spawn)
-            timer.start(250)
-
-        def spawn(self):
-            # spawn thread
-            l = self._indexMapping[:]
-            t = Thread( target=self.downloadCoverDaemon, args=(l,) )
-            t.daemon = True
-            t.start()
-
-        def offsetMid(self):
-            offset = self._offset
-            if offset <= 0:
-                offset = 0
-            if offset > len(self._browser) - 1:
-                offset = len(self._browser) - 1
-            mid = int(math.floor(offset + 0.5))
-            return (offset, mid)
+            self.generateTile(ind)
+            self._missing_tile = (ind, defaultTexture, None, (0., 0., 1., 1.))
+
+        def refresh(self):
+            """Switch to the browser's current view, reusing the tiles still resident."""
+            self._offset = 0
+            self._shownMedia = None
+            # positions now refer to the new view
+            self.spawn()
+            self.updateGL()
+
+        # the titles are not copied: the browser is the model, giving the
+        # length of its current view (the library or search results) and
+        # the title at a position; it calls insertTile and removeTile once
+        # it has added or removed a title
+
+        def getMedia(self, position): return self._browser[position]
+
+        def insertTile(self, position, media):
+            # keep the centered title in place
+            if position <= self._offset and len(self._browser) > 1:
+                self._offset += 1
+
+        def removeTile(self, position, media):
+            if position < self._offset:
+                self._offset -= 1
+
+            self.makeCurrent()
+            self.deleteTile(media)
+
+        def spawn(self, medias=None):
+            """Queue the cover downloads of medias, or start sweeping the current view from its centre."""
+            if medias is not None:
+                # titles already queued are skipped
+                for media in medias:
+                    self._downloads.submit(media.getKey(), media)
+            else:
+                offset, mid = self.offsetMid()
+                self._sweep = (mid, -1)
+                self._sweepTimer.start()
+            self.prioritizeDownloads()
+
+        def sweep(self):
+            """Queue the covers of the next titles out from the centre of the sweep, until the window is full.
+
+            Only the titles of the window are held by the queue, however
+            large the library.
+            """
+            if self._sweep is None:
+                self._sweepTimer.stop()
+                return
+            centre, radius = self._sweep
+            n = len(self._browser)
+            last = max(centre, n - 1 - centre)
+            examined = 0
+            while radius < last and len(self._downloads) < VideoCoverflow.TileflowWidget._downloadWindow and examined < VideoCoverflow.TileflowWidget._sweepStep:
+                radius += 1
+                for position in [centre - radius, centre + radius] if radius > 0 else [centre]:
+                    if not 0 <= position < n: continue
+                    examined += 1
+                    media = self._browser[position]
+                    key = media.getKey()
+                    # titles with a cover (or without any to be found) cost no job
+                    if key not in self._covers and key not in self._failed:
+                        self._downloads.submit(key, media)
+            self._sweep = (centre, radius)
+            if radius >= last:
+                # every title of the view has been queued
+                self._sweep = None
+                self._sweepTimer.stop()
+
+        def nearestMedias(self, count=None):
+            """Yield up to count titles of the current view, ordered by distance from the centre."""
+            n = len(self._browser)
+            if n == 0 or count == 0: return
+            offset, mid = self.offsetMid()
+            yielded = 1
+            yield self._browser[mid]
+            for d in range(1, n):
+                if mid + d >= n and mid - d < 0: break
+                for position in [mid + d, mid - d]:
+                    if count is not None and yielded >= count: return
+                    if 0 <= position < n:
+                        yielded += 1
+                        yield self._browser[position]
+
+        def prioritizeDownloads(self):
+            """Fetch the covers around the centre of the current view before any other."""
+            offset, mid = self.offsetMid()
+            self._prioritizedMid = mid
+            if self._sweep is not None:
+                centre, radius = self._sweep
+                if abs(mid - centre) > radius:
+                    # jumped past the titles queued so far
+                    self._sweep = (mid, -1)
+                self.sweep()
+            keys = [ media.getKey() for media in self.nearestMedias(VideoCoverflow.TileflowWidget._prefetchTiles) ]
+            self._downloads.prioritize(keys)
+            self._decoder.prioritize([ (key, self._covers.getDigest(key)) for key in keys ])
+
+        def offsetMid(self): return self._layout.centre(self._offset, len(self._browser))
 
         def paintGL(self):
+            start = time.time()
+            continuous = self._frames.isRunning()
             scale = float(self._browser.get('scale'))
             ratio = float(self._browser.get('width')) / float(self._browser.get('height'))
 
             self.qglClearColor(self._clearColor)
             GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
 
+            # whatever redraws the strip may have moved it: the scheduler
+            # settles it (snapping, the status message) and goes back to sleep
+            self._frames.wake()
+
             GL.glDisable(GL.GL_DEPTH_TEST)
 
             GL.glMatrixMode(GL.GL_PROJECTION)
@@ -260,58 +568,118 @@ class VideoCoverflow(QtGui.QMainWindow):
                 GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
 
                 offset, mid = self.offsetMid()
-                start_pos = mid - VideoCoverflow.TileflowWidget._visibleTiles
-                if start_pos < 0:
-                    start_pos = 0
-                end_pos = mid + VideoCoverflow.TileflowWidget._visibleTiles
-                if end_pos > len(self._browser):
-                    end_pos = len(self._browser)
-                for i in range(start_pos, mid)[::VideoCoverflow.TileflowWidget._direction]:
-                    self.drawTile(i, i - offset)
-                for i in range(mid, end_pos)[::-VideoCoverflow.TileflowWidget._direction]:
-                    self.drawTile(i, i - offset)
+                self._boundTexture = None
+                self._binds = 0
+                # back to front: the flanks first, the centre tile last
+                positions = self._layout.positions(offset, len(self._browser))
+                transforms = self._layout.transforms([ i - offset for i in positions ])
+                if self._browser.get('renderer') == 'batch':
+                    self.drawBatch(positions, transforms)
+                else:
+                    for i, transform in zip(positions, transforms):
+                        self.drawTile(i, transform)
+                self._frameBinds = self._binds
 
                 GL.glPopMatrix()
 
+            self._profiler.add('paint', time.time() - start)
+            self._profiler.frame(continuous)
+            if self._overlay:
+                self.drawOverlay()
+
+        def drawOverlay(self):
+            summary = self._profiler.getSummary()
+            samples = self._profiler.getSamples()
+            last = samples[-1]
+            textures = self.getTextureStatistics()
+            lines = [ \
+                  'paint %.1f ms (mean %.1f, max %.1f)' % (last['paint'], summary['paint mean'], summary['paint max']) \
+                , 'upload %.1f ms, %d textures (%d KB)' % (last['upload'], last['uploads'], last['bytes'] >> 10) \
+                , 'drain %.1f ms (max %.1f)' % (last['drain'], summary['drain max']) \
+                , '%d dropped of the last %d frames' % (summary['dropped'], summary['frames']) \
+                , '%d textures resident (%d MB), %d binds' % (textures['resident'], textures['bytes'] >> 20, textures['binds']) \
+            ]
+            GL.glDisable(GL.GL_TEXTURE_2D)
+            GL.glColor4f(1, 1, 0, 1)
+            for k, line in enumerate(lines):
+                self.renderText(10, 20 + 16 * k, line)
+            GL.glColor4f(1, 1, 1, 1)
+
+        def toggleOverlay(self):
+            self._overlay = not self._overlay
+            self.updateGL()
+
+        def getProfiler(self): return self._profiler
+
+        def dumpProfile(self):
+            """Write the timings of the last frames to a file in the configuration directory."""
+            path = os.path.join(VideoCoverflow._configPath, time.strftime('frames-%Y%m%d-%H%M%S.tsv'))
+            mkdir_p(VideoCoverflow._configPath)
+            self._profiler.dump(path)
+            sys.stderr.write('info: wrote %d frame timings to `%s`\r\n' % (len(self._profiler), path))
+            return path
+
         def moving(self): return self._mouseDown
 
-        def focusTile(self):
-            while not self._queue.empty():
-                position = self._queue.get()
-                try:
-                    media, ind = self._indexMapping[position]
-                    if media.getCover() is not None and ind == self._missing_tile:
-                        newInd = GL.glGenLists(1)
-                        self._lists.add(newInd)
-                        texture = self.bindTexture(QtGui.QPixmap( media.getCover() ))
-                        self.generateTile(newInd, texture)
-                        self._indexMapping[position] = (media, newInd)
-                        self.updateGL()
-                except:
-                    pass
+        def isAnimating(self): return self._frames.isRunning()
 
+        def focusTile(self):
+            """Advance the animation by one frame; return True while there is more to do."""
+            redraw = False
+            with self._profiler.time('drain'):
+                while self._downloaded:
+                    key, metadata = self._downloaded.popleft()
+                    self._browser.recordCover(key, metadata)
+                    # the missing tile is replaced the next time it is drawn
+                    # (titles not drawn since have no tile)
+                    if key in self._textures:
+                        self.makeCurrent()
+                        self._textures.discard(key)
+                        redraw = True
+
+                while self._decoded:
+                    key, digest, image, size = self._decoded.popleft()
+                    # a title scrolled out of sight decodes again (from its thumbnail)
+                    # when it is back; a replaced cover is dropped
+                    if key in self._textures and size == self._thumbnails.getSize() and digest == self._covers.getDigest(key):
+                        self._images[key] = image
+                        self.makeCurrent()
+                        self._textures.discard(key)
+                        redraw = True
+
+            busy = False
             if abs(self._xvel) > 1e-2:
                 self._xvel *= 0.75
                 self._offset += self._xvel
-                self.updateGL()
+                redraw = busy = True
             elif not self.moving():
+                self._xvel = 0
                 target = math.floor(self._offset + 0.5)
                 if not abs(target - self._offset) <= 0.01:
                     self._offset += (target - self._offset) / 3
-                    self.updateGL()
+                    redraw = busy = True
+            if redraw:
+                self.updateGL()
 
             if len(self._browser) > 0:
                 offset, mid = self.offsetMid()
-                media = self._indexMapping[mid][0]
-                name = media.getName()
-                year = media.getYear()
-                display = ''.join([media.getName(), ' (', media.getYear(), ')']) if year != '' else name
-                self._browser.setMessage(display)
+                if mid != self._prioritizedMid:
+                    self.prioritizeDownloads()
+                media = self._browser[mid]
+                if media is not self._shownMedia:
+                    self._shownMedia = media
+                    name = media.getName()
+                    year = media.getYear()
+                    display = ''.join([media.getName(), ' (', media.getYear(), ')']) if year != '' else name
+                    self._browser.setMessage(display)
+
+            return busy
 
         def resizeGL(self, width, height):
             self._browser.set('width', width)
             self._browser.set('height', height)
             GL.glViewport(0, 0, width, height)
+            self.updateResolution()
 
         def mousePressEvent(self, event):
             self.setFocus()
@@ -331,13 +699,16 @@ class VideoCoverflow(QtGui.QMainWindow):
 
             self._lastPos = QtCore.QPoint(event.pos())
 
-        def mouseReleaseEvent(self, event): self._mouseDown = False
+        def mouseReleaseEvent(self, event):
+            self._mouseDown = False
+            # snap to the nearest tile
+            self._frames.wake()
 
         def play(self):
             if len(self._browser) == 0: return
 
             offset, mid = self.offsetMid()
-            filePaths = self._indexMapping[mid][0].getFilePaths()
+            filePaths = self._browser[mid].getFilePaths()
             path = None
             if len(filePaths) == 1:
                 path = filePaths[0]
@@ -358,22 +729,16 @@ class VideoCoverflow(QtGui.QMainWindow):
 
                 offset, mid = self.offsetMid()
 
-                media, oldInd = self._indexMapping[mid]
-
-                # copy image
-                shutil.copyfile(coverPath, media.getCoverPath())
+                media = self._browser[mid]
 
-                # remove old image
-                if oldInd != self._missing_tile:
-                    self._lists.remove(oldInd)
-                    GL.glDeleteLists(oldInd, 1)
+                # store image
+                if not self._covers.importFile(media.getKey(), coverPath):
+                    return
+                self._browser.recordCover(media.getKey())
 
-                # load new image
-                texture = self.bindTexture(QtGui.QPixmap( media.getCoverPath() ))
-                ind = GL.glGenLists(1)
-                self.generateTile(ind, texture)
-                self._lists.add(ind)
-                self._indexMapping[mid] = (media, ind)
+                # load new image (replacing the old one)
+                self.makeCurrent()
+                self.deleteTile(media)
 
                 self.updateGL()
 
@@ -389,11 +754,13 @@ class VideoCoverflow(QtGui.QMainWindow):
                     scale = float(self._browser.get('scale'))
                     scale = min(2, scale + VideoCoverflow.TileflowWidget._dscale)
                     self._browser.set('scale', scale)
+                    self.updateResolution()
                     self.updateGL()
                 elif event.delta() > 0:
                     scale = float(self._browser.get('scale'))
                     scale = max(0.5, scale - VideoCoverflow.TileflowWidget._dscale)
                     self._browser.set('scale', scale)
+                    self.updateResolution()
                     self.updateGL()
 
         def keyPressEvent(self, event):
@@ -405,60 +772,105 @@ class VideoCoverflow(QtGui.QMainWindow):
                 self.updateGL()
             elif event.key() == QtCore.Qt.Key_Return:
                 self.play()
-
-        def drawTile(self, position, offset):
-            matrix = [1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0]
-            trans = offset * VideoCoverflow.TileflowWidget._spreadImage
-            f = offset * VideoCoverflow.TileflowWidget._flankSpread
-            if (f > VideoCoverflow.TileflowWidget._flankSpread):
-                f = VideoCoverflow.TileflowWidget._flankSpread
-            elif (f < -VideoCoverflow.TileflowWidget._flankSpread):
-                f = -VideoCoverflow.TileflowWidget._flankSpread
-
-            matrix[3] = -1 * VideoCoverflow.TileflowWidget._direction * f
-            matrix[0] = 1 - abs(f)
-            scale = 0.45 * matrix[0]
-            trans += f * 1
+            elif event.key() == QtCore.Qt.Key_Backspace:
+                self.typeAhead(None)
+            elif len(event.text()) == 1 and event.text() >= ' ':
+                self.typeAhead(event.text())
+
+        def typeAhead(self, text):
+            """Add text (or remove the last character, if None) to what was typed and jump to the first title starting with it."""
+            now = time.time()
+            if now - self._typedAt > VideoCoverflow.TileflowWidget._typeAheadTimeout:
+                self._typed = ''
+            self._typedAt = now
+            self._typed = self._typed[:-1] if text is None else self._typed + text
+            if self._typed == '' or len(self._browser) == 0: return
+            position = self._browser.locatePrefix(self._typed)
+            if position is not None:
+                self.goTo(position)
+
+        def drawTile(self, position, transform):
             GL.glPushMatrix()
-            GL.glTranslatef(trans, 0, 0)
-            GL.glScalef(scale, scale, 1.0)
-            GL.glMultMatrixf(matrix)
-            GL.glCallList(self._indexMapping[position][1])
+            GL.glMultMatrixf(glMatrix(transform))
+            ind, texture, key, texCoords = self.tileFor(self._browser[position])
+            if texture != self._boundTexture:
+                GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+                self._boundTexture = texture
+                self._binds += 1
+            GL.glCallList(ind)
             GL.glPopMatrix()
 
+        def drawBatch(self, positions, transforms):
+            """Draw tiles (and reflections) from one vertex buffer, one draw call per texture run."""
+            tiles = [ self.tileFor(self._browser[i]) for i in positions ]
+            batch = Batch()
+            batch.addStrip(transforms, [ texture for ind, texture, key, texCoords in tiles ], [ texCoords for ind, texture, key, texCoords in tiles ])
+
+            if self._vertexBuffer is None:
+                self._vertexBuffer = GL.glGenBuffers(1)
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self._vertexBuffer)
+            GL.glBufferData(GL.GL_ARRAY_BUFFER, len(batch) * Batch.stride, batch.getData(), GL.GL_STREAM_DRAW)
+            GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
+            GL.glEnableClientState(GL.GL_TEXTURE_COORD_ARRAY)
+            GL.glEnableClientState(GL.GL_COLOR_ARRAY)
+            GL.glVertexPointer(4, GL.GL_FLOAT, Batch.stride, ctypes.c_void_p(0))
+            GL.glTexCoordPointer(2, GL.GL_FLOAT, Batch.stride, ctypes.c_void_p(16))
+            GL.glColorPointer(4, GL.GL_FLOAT, Batch.stride, ctypes.c_void_p(24))
+            for texture, first, count in batch.getRuns():
+                GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+                self._binds += 1
+                GL.glDrawArrays(GL.GL_QUADS, first, count)
+            GL.glDisableClientState(GL.GL_COLOR_ARRAY)
+            GL.glDisableClientState(GL.GL_TEXTURE_COORD_ARRAY)
+            GL.glDisableClientState(GL.GL_VERTEX_ARRAY)
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+            GL.glColor4f(1, 1, 1, 1)
+            self._boundTexture = None
+
         def goToCharacter(self, c):
-            k = 0
-            i = ord(c)
-            for media in self._browser:
-                if ord(media.getName()[0].upper()) >= i:
-                    break
-                k += 1
-            self._offset = k
+            position = self._browser.locatePrefix(c, True)
+            self.goTo(position if position is not None else len(self._browser))
+
+        def goTo(self, position):
+            """Centre the tile at position."""
+            self._offset = position
+            self.prioritizeDownloads()
             self.updateGL()
 
-        def downloadCoverDaemon(self, indexMapping):
-            # TODO: kill this thread explicitly
-            k = 0
+        def lookupStage(self, key, media, fetch):
+            if key in self._covers: return None
+            # covers saved as loose files by earlier versions are copied into
+            # the store (here for titles not shown yet, see loadTile)
+            if self._covers.importFile(key, media.getCoverPath()):
+                self._downloaded.append((key, None))
+                self.coversReady.emit()
+                return None
+            return (media, media.getMetadata(fetch, self._browser.getMetadataCache()))
 
-            for media, ind in indexMapping:
-                if media.getCover() is None:
-                    sys.stderr.write( 'info: attempting to download cover for `%s`...' % (media.getName()) )
-                    try:
-                        media = indexMapping[k][0]
+        def pageStage(self, key, value, fetch):
+            media, metadata = value
+            return (media, metadata.getId(), metadata.getCoverUrl())
 
-                        metadata = media.getMetadata()
-                        cover = metadata.downloadCover()
-                        mkdir_p(os.path.dirname(media.getCoverPath()))
-                        with open(media.getCoverPath(), 'wb') as f:
-                            f.write(cover)
+        def imageStage(self, key, value, fetch):
+            media, metadata, url = value
+            return (media, metadata, fetch(url))
 
-                        self._queue.put(k)
+        def writeStage(self, key, value, fetch):
+            media, metadata, cover = value
+            self._covers.put(key, cover)
 
-                        sys.stderr.write(' done\r\n')
-                        time.sleep(VideoCoverflow._sleep)
-                    except:
-                        sys.stderr.write(' fail\r\n')
-                k += 1
+            self._downloaded.append((key, metadata))
+            self.coversReady.emit()
+
+            sys.stderr.write( 'info: downloaded cover for `%s`\r\n' % (media.getName()) )
+
+        def stopDownloads(self):
+            self._downloads.stop()
+            self._decoder.stop()
+
+        def downloadFailed(self, key, exc):
+            self._failed.add(key)
+            sys.stderr.write( 'info: could not download cover for `%s` (%s)\r\n' % (key, exc) )
 
     class Metadata:
 
@@ -467,13 +879,35 @@ class VideoCoverflow(QtGui.QMainWindow):
         _imdb = 'http://www.imdb.com/title/%s'
         _omdbapi = 'http://omdbapi.com/?tomatoes=true&s=%s&y=%s'
 
-        def __init__(self, search, year=''):
+        def __init__(self, search, year='', fetch=None, cache=None):
+            self._fetch = fetch if fetch is not None else lambda url: urlopen( url ).read()
             url = VideoCoverflow.Metadata._omdbapi % (search.replace(' ', '%20'), year)
-            self._meta = json.load( urlopen( url ) )['Search'][0]
 
-        def downloadCover(self):
+            def lookup():
+                response = json.loads( self._fetch( url ) )
+                if 'Search' in response:
+                    return response['Search'][0]
+                # only a definite "no match" may be cached
+                error = response.get('Error', '')
+                if 'not found' in error.lower():
+                    return None
+                raise IOError(error)
+
+            self._meta = cache.lookup(search, year, lookup) if cache is not None else lookup()
+            if self._meta is None:
+                raise IOError('no match for `%s`' % (search))
+
+        def getId(self): return self._meta['imdbID']
+
+        def getCoverUrl(self):
             url = VideoCoverflow.Metadata._imdb % (self._meta['imdbID'])
-            return urlopen( VideoCoverflow.Metadata._pattern.search( urlopen( url ).read() ).group(1) ).read()
+            m = VideoCoverflow.Metadata._pattern.search( self._fetch( url ) )
+            if m is None:
+                raise IOError('no cover on %s' % (url))
+            return m.group(1)
+
+        def downloadCover(self):
+            return self._fetch( self.getCoverUrl() )
 
     class Media:
 
@@ -495,6 +929,10 @@ class VideoCoverflow(QtGui.QMainWindow):
                 self._collectionPath = absPath[1:]
 
         def addFilePaths(self, filePaths): self._filePaths.extend(filePaths)
+        def removeFilePaths(self, filePaths):
+            for filePath in filePaths:
+                if filePath in self._filePaths:
+                    self._filePaths.remove(filePath)
 
         def getKey(self): return self._key
         def getName(self): return self._name
@@ -502,17 +940,12 @@ class VideoCoverflow(QtGui.QMainWindow):
         def getFilePaths(self): return self._filePaths[:]
 
         def getCoverPath(self):
+            """Return where earlier versions saved the cover (covers are now kept in the cover store)."""
             identifier = ''.join([self._name, '_', self._year])
             path = os.path.join(VideoCoverflow._configPath, self._collectionPath, identifier)
             return path
 
-        def getCover(self):
-            coverPath = self.getCoverPath()
-            if os.path.isfile(coverPath):
-                return coverPath
-            return None
-
-        def getMetadata(self): return VideoCoverflow.Metadata(self._name, self._year)
+        def getMetadata(self, fetch=None, cache=None): return VideoCoverflow.Metadata(self._name, self._year, fetch, cache)
 
     class IndexAction(QtGui.QAction):
 
@@ -541,6 +974,15 @@ class VideoCoverflow(QtGui.QMainWindow):
         if not self._config.has_section(VideoCoverflow._iniSection):
             self._config.add_section(VideoCoverflow._iniSection)
 
+        # search results (and titles without any) survive restarts
+        self._metadataCache = MetadataCache(VideoCoverflow._metadataPath)
+        self._covers = CoverStore(VideoCoverflow._coverPath)
+
+        # the library can be kept on disk rather than in memory
+        self._catalog = None
+        if int(self.get('catalog')):
+            self._catalog = Catalog(VideoCoverflow._catalogPath, VideoCoverflow.Media)
+
         QtGui.QMainWindow.__init__(self, parent)
 
         self.setMinimumSize(800, 600)
@@ -599,7 +1041,7 @@ class VideoCoverflow(QtGui.QMainWindow):
         toolBar.addWidget(self._searchBox)
 
         self._previousSearch = None
-        self._searchBox.editingFinished.connect(self.search)
+        self._searchBox.textChanged.connect(self.search)
 
         palette = toolBar.palette()
         palette.setColor(QtGui.QPalette.Background, QtCore.Qt.black);
@@ -615,6 +1057,15 @@ class VideoCoverflow(QtGui.QMainWindow):
         self._count = 0
         self._collectionIsTrie = False
         self._collection = []
+        self._prefixIndex = None
+        self._tokens = []
+        self._searchIndex = SearchIndex()
+
+        # apply file-system changes as they are reported
+        self._watcher = None
+        timer = QtCore.QTimer(self)
+        timer.timeout.connect(self.updateLibrary)
+        timer.start(VideoCoverflow._watchInterval)
 
         # fire an event later to populate the library
         timer = QtCore.QTimer(self)
@@ -634,10 +1085,9 @@ class VideoCoverflow(QtGui.QMainWindow):
             indexC = VideoCoverflow.IndexAction(c, self._tileflow, self);
             indexMenu.addAction(indexC);
 
-        # daemon
-        self._tileflow.spawnDownloadCoverDaemon()
-
         QtGui.QShortcut(QtGui.QKeySequence(self.tr('Esc', 'Exit Fullscreen')), self, self.escape)
+        QtGui.QShortcut(QtGui.QKeySequence(self.tr('F12', 'Toggle Performance Overlay')), self, self._tileflow.toggleOverlay)
+        QtGui.QShortcut(QtGui.QKeySequence(self.tr('Shift+F12', 'Save Frame Timings')), self, self._tileflow.dumpProfile)
 
         self.updateFullScreen()
 
@@ -665,11 +1115,9 @@ class VideoCoverflow(QtGui.QMainWindow):
                 break
 
             self._previousSearch = None
+            # downloads start once the library is populated
             self.populate()
 
-            #if self._tileflowCreated:
-            self._tileflow.clear()
-
             if len(self) == 0:
                 msgBox = QtGui.QMessageBox(self)
                 msgBox.setText('No videos were found in the selected location(s). Would you like to select another?')
@@ -679,8 +1127,6 @@ class VideoCoverflow(QtGui.QMainWindow):
                 if ret == QtGui.QMessageBox.No:
                     break
             else:
-                # daemon
-                self._tileflow.spawnDownloadCoverDaemon()
                 break
 
     def updateFullScreen(self):
@@ -697,15 +1143,30 @@ class VideoCoverflow(QtGui.QMainWindow):
         self.updateFullScreen()
 
     def closeEvent(self, event):
+        self._tileflow.stopDownloads()
+        self._metadataCache.save()
+        if self._catalog is not None:
+            self._catalog.close()
+        statistics = self._covers.getStatistics()
+        if statistics['garbage'] > statistics['bytes']:
+            # most of the packs hold replaced covers
+            sys.stderr.write('info: compacted the cover store (%d KB reclaimed)\r\n' % (self._covers.compact() >> 10))
+        self._covers.close()
+        sys.stderr.write('info: %d covers stored (%d images, %d MB)\r\n' % (statistics['covers'], statistics['images'], statistics['bytes'] >> 20))
+        statistics = self._metadataCache.getStatistics()
+        sys.stderr.write('info: metadata cache answered %d of %d lookups\r\n' % (statistics['hits'] + statistics['negative hits'], statistics['hits'] + statistics['negative hits'] + statistics['misses']))
+        statistics = self._tileflow.getTextureStatistics()
+        sys.stderr.write('info: %d textures resident (%d MB), %d uploaded, %d evicted\r\n' % (statistics['resident'], statistics['bytes'] >> 20, statistics['loaded'], statistics['evicted']))
+        statistics = self._tileflow.getFrameStatistics()
+        sys.stderr.write('info: %d animation frames (%d over budget, %.1f ms mean), woken %d times\r\n' % (statistics['ticks'], statistics['late'], statistics['mean'] * 1000., statistics['wakes']))
+
         # write ini file
         with open(self._iniPath, 'wb') as f:
             self._config.write(f)
 
-    def __iter__(self):
-        if self._collectionIsTrie:
-            return self._collection.itervalues()
-        else:
-            return self._collection.__iter__()
+    def __iter__(self): return iter(self._collection)
+
+    def __getitem__(self, position): return self._collection[position]
 
     def __len__(self): return self._count
 
@@ -716,6 +1177,15 @@ class VideoCoverflow(QtGui.QMainWindow):
     def set(self, key, value):
         self._config.set(VideoCoverflow._iniSection, key, str(value))
 
+    def getMetadataCache(self): return self._metadataCache
+
+    def getCoverStore(self): return self._covers
+
+    def recordCover(self, key, metadata=None):
+        """Note that a title has a cover (found with the metadata of the given id)."""
+        if self._catalog is not None:
+            self._catalog.setCover(key, metadata)
+
     def getPaths(self):
         try: return [ path for path in self.get('paths').split(',') if path.strip() != '' ]
         except: return []
@@ -724,80 +1194,240 @@ class VideoCoverflow(QtGui.QMainWindow):
         try: return self.get('extensions').split(',')
         except: return VideoCoverflow._iniDefaults['extensions'].split(',')
 
-    def addMedia(self, name, filePaths, collectionPath):
+    @staticmethod
+    def parseName(name):
         # gets rid of delimiters and tags (as best as possible)
-        l = []
-        for c in name:
-            if c in VideoCoverflow._delimiters:
-                l.append(' ')
-            else:
-                l.append(c)
-        tokens = VideoCoverflow._pattern.match( ''.join(l) ).group(2).split(' ')
-        l = []
-        stop = False
-        year = None
-        for token in tokens:
-            m = VideoCoverflow._year.search(token)
-            if m:
-                stop = True
-                year = m.group(1)
-                break
-            for halt in VideoCoverflow._halts:
-                if halt.search(token):
-                    stop = True
-                    break
-            if stop: break
-            l.append(token)
-        name = ' '.join(l).strip()
+        return VideoCoverflow._parser.parse(name)
+
+    def addMedia(self, name, filePaths, collectionPath):
+        name, year = VideoCoverflow.parseName(name)
         if name == '': return
+        self.insertMedia(name, year, filePaths, collectionPath)
 
+    @staticmethod
+    def getMediaKey(name, year):
         # key is of the form MOVIE[_YEAR]
-        key = (''.join([name, '_', year]) if year is not None else name).lower()
+        return (''.join([name, '_', year]) if year is not None else name).lower()
+
+    @staticmethod
+    def getUnit(filePaths, collectionPath):
+        """Return the library entry (a file or directory directly in collectionPath) holding filePaths."""
+        return os.path.join(os.path.abspath(collectionPath), os.path.relpath(filePaths[0], collectionPath).split(os.sep)[0])
+
+    def insertMedia(self, name, year, filePaths, collectionPath):
+        key = VideoCoverflow.getMediaKey(name, year)
+        if self._catalog is not None:
+            # returns the title only if it is new
+            node = self._catalog.addFiles(key, name, year, filePaths, collectionPath, VideoCoverflow.getUnit(filePaths, collectionPath))
+            if node is not None:
+                self._totalCount += 1
+            return node
+
         node = None
         try:
             node = self._mediaTrie[key]
             node.addFilePaths(filePaths)
         except:
-            node = VideoCoverflow.Media(key, name, year, filePaths, collectionPath)
+            node = VideoCoverflow.Media(key, name, year, filePaths[:], collectionPath)
             self._mediaTrie[key] = node
             self._totalCount += 1
 
+        # remember which library entry contributed these files
+        self._units[VideoCoverflow.getUnit(filePaths, collectionPath)] = (key, filePaths[:])
+        return node
+
+    def catalogRecords(self, records):
+        """Yield the records of a scan as the catalog stores them."""
+        for k, (name, year, filePaths, collectionPath) in enumerate(records):
+            if name != '':
+                yield (VideoCoverflow.getMediaKey(name, year), name, year, filePaths, collectionPath, VideoCoverflow.getUnit(filePaths, collectionPath))
+            if k % VideoCoverflow._populateBatch == 0:
+                QtGui.QApplication.processEvents(QtCore.QEventLoop.ExcludeUserInputEvents)
+
+    def scanUnit(self, unit):
+        """Return the (name, filePaths, collectionPath) record of a single library entry, or None."""
+        scanner = Scanner(self.getExtensions())
+        collectionPath, name = os.path.split(unit)
+        if os.path.isfile(unit):
+            if scanner.isVideo(name):
+                return (os.path.splitext(name)[0], [unit], collectionPath)
+        elif os.path.isdir(unit):
+            filePaths = scanner.walk(unit)
+            if len(filePaths) > 0:
+                return (name, filePaths, collectionPath)
+        return None
+
+    def updateLibrary(self):
+        """Apply a batch of file-system changes without rebuilding the tileflow."""
+        if self._watcher is None: return
+        units = self._watcher.getBatch()
+        if len(units) == 0: return
+
+        # retract what the changed entries contributed before; titles are
+        # only dropped once the whole batch is applied, so that rewritten
+        # entries keep their tiles
+        touched = {}
+        for unit in units:
+            if self._catalog is not None:
+                for key in self._catalog.retract(unit):
+                    touched[key] = None
+                continue
+            old = self._units.pop(unit, None)
+            if old is None: continue
+            key, filePaths = old
+            media = self._mediaTrie[key]
+            media.removeFilePaths(filePaths)
+            touched[key] = media
+
+        records = [ record for record in (self.scanUnit(unit) for unit in units) if record is not None ]
+        inserted = []
+        for record, (name, year) in zip(records, VideoCoverflow._parser.parseBatch([ record[0] for record in records ])):
+            if name == '': continue
+            count = self._totalCount
+            media = self.insertMedia(name, year, record[1], record[2])
+            if self._totalCount > count:
+                inserted.append(media)
+
+        removed = []
+        if self._catalog is not None:
+            # titles are deleted from the catalog (and its indexes) below
+            removed = self._catalog.orphans(touched)
+            self._totalCount -= len(removed)
+        else:
+            for key, media in touched.items():
+                if len(media.getFilePaths()) == 0:
+                    del self._mediaTrie[key]
+                    self._totalCount -= 1
+                    removed.append(media)
+
+        sys.stderr.write('info: library changed (%d added, %d removed)\r\n' % (len(inserted), len(removed)))
+
+        if self._catalog is None:
+            for media in removed:
+                self._searchIndex.remove(media)
+            for media in inserted:
+                self._searchIndex.add(media)
+
+        # only the affected tiles are touched
+        for media in removed:
+            position = self.locate(media.getKey())
+            self._mediaOrder.remove(media.getKey())
+            if position is None: continue
+            if not self._collectionIsTrie:
+                del self._collection[position]
+                self._prefixIndex = None
+            self._count -= 1
+            self._tileflow.removeTile(position, media)
+        # in key order, so that every position counts the titles inserted before it
+        for media in sorted(inserted, key=VideoCoverflow.Media.getKey):
+            position = self._mediaOrder.add(media)
+            if not self._collectionIsTrie:
+                rank = self.rank(media, self._tokens)
+                if rank is None: continue
+                # where the search would have placed it
+                lo, hi = 0, len(self._collection)
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if self.rank(self._collection[mid], self._tokens) < rank: lo = mid + 1
+                    else: hi = mid
+                position = lo
+                self._collection.insert(position, media)
+                self._prefixIndex = None
+            self._count += 1
+            self._tileflow.insertTile(position, media)
+        if self._catalog is not None:
+            self._catalog.commit()
+
+        enabled = self._count > 0
+        self._playAction.setEnabled(enabled)
+        self._coverAction.setEnabled(enabled)
+        self._tileflow.updateGL()
+
+        if len(inserted) > 0:
+            self._tileflow.spawn(inserted)
+
+    def locate(self, key, insert=False):
+        """Return the position of a title in the browser.
+
+        If insert is True, the position at which a title with this key would
+        be inserted into the full library is returned instead.
+        """
+        if self._collectionIsTrie:
+            if insert:
+                return self._mediaOrder.bisect(key)
+            try: return self._mediaOrder.index(key)
+            except KeyError: return None
+        for position, media in enumerate(self._collection):
+            if media.getKey() == key:
+                return position
+        return None
+
+    def locatePrefix(self, prefix, following=False):
+        """Return the position of the first title (by name) starting with prefix, or None.
+
+        If following is True, the first title sorting at or after prefix is
+        returned instead.
+        """
+        # what is typed is unicode, whereas names and keys are byte strings
+        # on Python 2
+        prefix = toName(prefix).lower()
+        if self._collectionIsTrie:
+            # keys are lower case names (followed by the year)
+            position = self._mediaOrder.bisect(prefix)
+            if position < self._count and (following or self._mediaOrder[position].getKey().startswith(prefix)):
+                return position
+            return None
+        # search results are ordered by relevance; their names are indexed
+        # the first time they are jumped through
+        if self._prefixIndex is None:
+            self._prefixIndex = PrefixIndex(media.getName() for media in self._collection)
+        return self._prefixIndex.locate(prefix, following)
+
+    def unwatch(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+    def watch(self):
+        self.unwatch()
+        if int(self.get('watch')) and len(self.getPaths()) > 0:
+            self._watcher = createWatcher(self.getPaths())
+            self._watcher.start()
+
+    def rank(self, media, tokens):
+        return self._searchIndex.rank(media, tokens)
+
     def clearQuery(self):
         self._searchBox.setText('')
         self.search()
 
     def search(self):
-        if self.buildTrie(): self._tileflow.clear()
+        if self.buildTrie(): self._tileflow.refresh()
 
     def buildTrie(self):
         currentSearch = self._searchBox.text()
         if self._previousSearch == currentSearch: return False
         self._previousSearch = currentSearch
 
-        self._collectionIsTrie = True
-
         self.setMessage('')
 
-        tokens = [ token for token in currentSearch.split(' ') if token != '' ]
+        previousTokens = self._tokens if not self._collectionIsTrie else []
+        tokens = SearchIndex.tokenize(currentSearch)
+        self._tokens = tokens
+        self._collectionIsTrie = True
         if len(tokens) == 0:
             self._count = self._totalCount
-            self._collection = self._mediaTrie
+            self._collection = self._mediaOrder
         else:
             self._collectionIsTrie = False
 
-            tmp = []
-            for media in self._mediaTrie.itervalues():
-                matches = 0
-                for token in tokens:
-                    p = re.compile(''.join([token, '(?i)']))
-                    if p.search(media.getName()):
-                        matches += 1
-                if matches > 0:
-                    tmp.append( (-matches, media) )
-            tmp.sort()
-            self._collection = []
-            for matches, media in tmp:
-                self._collection.append(media)
+            # tokens are matched literally, best matches first; a query that
+            # only narrows the previous one is answered from its results
+            within = None
+            if SearchIndex.narrows(previousTokens, tokens):
+                within = self._collection
+            self._collection = self._searchIndex.search(currentSearch, within)
+            self._prefixIndex = None
             self._count = len(self._collection)
 
         enabled = self._count > 0
@@ -809,49 +1439,61 @@ class VideoCoverflow(QtGui.QMainWindow):
     def populate(self):
         sys.stderr.write('populating... ')
 
+        self._searchBox.blockSignals(True)
         self._searchBox.setText('')
+        self._searchBox.blockSignals(False)
+        self._previousSearch = None
+
+        # the scan itself picks up changes made until it finishes
+        self.unwatch()
 
         self._totalCount = 0
-        self._mediaTrie = Trie()
+        self._mediaTrie = RadixTrie()
+        self._units = {}
 
         extensions = self.getExtensions()
 
         self.statusBar().show()
 
-        for path in self.getPaths():
-            # check to make sure this is really a directory
-            if not os.path.isdir(path):
-                sys.stderr.write('warning: media directory `%s` was not found or is not a directory; skipping\r\n' % (path))
-                continue
-
-            subpaths = os.listdir(path)
-            self._progress.setMaximum(len(subpaths))
-            self._progress.setValue(0)
-            for subpath in subpaths:
-                self._progress.setValue(self._progress.value() + 1)
-
-                # full path to directory or file
-                fullPath = os.path.join(path, subpath)
-
-                if os.path.isfile(fullPath):
-                    # file
-                    name, extension = os.path.splitext(subpath)
-                    if extension.lower() in extensions:
-                        self.addMedia(name, [fullPath], path)
-                else:
-                    # directory
-                    filePaths = []
-                    for root, directories, filenames in os.walk(fullPath):
-                        for filename in filenames:
-                            name, extension = os.path.splitext(filename)
-                            if extension.lower() in extensions:
-                                filePaths.append(os.path.join(root, filename))
-                    if len(filePaths) == 0: continue
-                    self.addMedia(subpath, filePaths, path)
+        # the scanner walks the directories on a worker pool; keep the window
+        # painting while its records are consumed
+        self._progress.setMaximum(0)
+        scanner = Scanner(extensions, self.get('workers'))
+        index = None
+        if int(self.get('index')):
+            # only directories modified since the last scan are walked
+            index = ScanIndex(VideoCoverflow._indexPath, scanner, VideoCoverflow.parseName)
+            records = index.scan(self.getPaths())
+        else:
+            records = ( VideoCoverflow.parseName(name) + (filePaths, collectionPath) for name, filePaths, collectionPath in scanner.scan(self.getPaths()) )
+        if self._catalog is not None:
+            # the catalog keeps the library in key order and answers searches
+            self._catalog.scan(self.catalogRecords(records))
+            self._totalCount = len(self._catalog)
+            self._mediaOrder = self._catalog
+            self._searchIndex = self._catalog
+        else:
+            for k, (name, year, filePaths, collectionPath) in enumerate(records):
+                if name != '':
+                    self.insertMedia(name, year, filePaths, collectionPath)
+                if k % VideoCoverflow._populateBatch == 0:
+                    QtGui.QApplication.processEvents(QtCore.QEventLoop.ExcludeUserInputEvents)
+
+            # the library in key order, for positional access
+            self._mediaOrder = SortedCollection(self._mediaTrie.itervalues(), VideoCoverflow.Media.getKey)
+            self._searchIndex = SearchIndex(self._mediaOrder)
+        if index is not None:
+            index.save()
 
         self.buildTrie()
         self._tileflow.clear()
 
+        # the scan yields to the event loop, so downloads only start once it
+        # is done (clear cancels whatever was queued before)
+        self._tileflow.spawn()
+
+        self.watch()
+
         self.statusBar().hide()
 
         if len(self) == 0:
@@ -0,0 +1,312 @@
+import collections
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+from threading import Event, Thread
+
+from scanner import listEntries
+
+
+class Watcher(object):
+    """Watches library roots and reports changed library entries in batches.
+
+    A library entry (a "unit") is a top-level entry of a root: either a loose
+    video file or a subdirectory whose files make up one title. Changes are
+    debounced: a batch is only emitted once no event has arrived for
+    `debounce` seconds (or `latency` seconds after the first pending event),
+    so copying a season of episodes into a directory costs one update.
+
+    Batches are sets of unit paths and are collected with getBatch, which
+    never blocks and is meant to be called from the GUI thread. Backends
+    implement wait.
+
+    >>> import shutil, tempfile
+    >>> root = tempfile.mkdtemp()
+    >>> watcher = Watcher([root])
+    >>> watcher.unitOf(os.path.join(root, 'Show', 'Season 1', 'e1.avi')) == os.path.join(root, 'Show')
+    True
+    >>> watcher.unitOf(root), watcher.unitOf(root + '-other')
+    (None, None)
+    >>> shutil.rmtree(root)
+    """
+
+    _debounce = 1.0
+    _latency = 5.0
+
+    def __init__(self, roots, debounce=None, latency=None):
+        self._roots = [os.path.abspath(root) for root in roots if os.path.isdir(root)]
+        self._debounce = debounce if debounce is not None else Watcher._debounce
+        self._latency = latency if latency is not None else Watcher._latency
+        # appended to by the watcher thread, drained by the GUI thread
+        self._batches = collections.deque()
+        self._stop = Event()
+        self._thread = None
+
+    def unitOf(self, path):
+        """Return the unit a path belongs to, or None if it is a root or outside all roots."""
+        for root in self._roots:
+            prefix = os.path.join(root, '')
+            if path.startswith(prefix):
+                top = path[len(prefix):].split(os.sep)[0]
+                return os.path.join(root, top) if top != '' else None
+        return None
+
+    def start(self):
+        self._thread = Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def getBatch(self):
+        """Return the units of every batch emitted so far (possibly empty)."""
+        units = set()
+        while self._batches:
+            units.update(self._batches.popleft())
+        return units
+
+    def run(self):
+        pending = set()
+        first = last = None
+        while not self._stop.is_set():
+            timeout = self._debounce if pending else None
+            units = self.wait(timeout)
+            now = time.time()
+            if units:
+                if not pending: first = now
+                pending.update(units)
+                last = now
+            if pending and (now - last >= self._debounce or now - first >= self._latency):
+                self._batches.append(pending)
+                pending = set()
+        self.close()
+
+    def wait(self, timeout):
+        """Block for at most timeout seconds (None for a backend-defined period) and return changed units.
+
+        Abstract: every backend overrides it.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(Watcher):
+    """Linux inotify backend. Raises OSError if inotify is unavailable."""
+
+    _IN_MOVED_FROM = 0x00000040
+    _IN_MOVED_TO = 0x00000080
+    _IN_CREATE = 0x00000100
+    _IN_DELETE = 0x00000200
+    _IN_DELETE_SELF = 0x00000400
+    _IN_MOVE_SELF = 0x00000800
+    _IN_Q_OVERFLOW = 0x00004000
+    _IN_IGNORED = 0x00008000
+    _IN_ISDIR = 0x40000000
+    _mask = _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF
+
+    _header = struct.Struct('iIII')
+    _poll = 1.0
+
+    def __init__(self, roots, debounce=None, latency=None):
+        Watcher.__init__(self, roots, debounce, latency)
+
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = self._libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        self._paths = {}
+        # set once the watches run out
+        self._polling = None
+
+        try:
+            for root in self._roots:
+                self.addTree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def addWatch(self, path):
+        encoded = path.encode(sys.getfilesystemencoding()) if not isinstance(path, bytes) else path
+        wd = self._libc.inotify_add_watch(self._fd, encoded, InotifyWatcher._mask)
+        if wd < 0:
+            code = ctypes.get_errno()
+            if code == errno.ENOSPC:
+                raise OSError(code, 'inotify watch limit reached (see fs.inotify.max_user_watches)')
+            return # the directory vanished or is unreadable
+        self._paths[wd] = path
+
+    def addTree(self, path):
+        directories = [path]
+        while directories:
+            directory = directories.pop()
+            self.addWatch(directory)
+            try:
+                entries = listEntries(directory)
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir() and not entry.is_symlink():
+                        directories.append(entry.path)
+                except OSError:
+                    pass
+
+    def wait(self, timeout):
+        if self._polling is not None:
+            return self._polling.wait(timeout)
+        readable, _, _ = select.select([self._fd], [], [], timeout if timeout is not None else InotifyWatcher._poll)
+        if not readable:
+            return set()
+
+        units = set()
+        data = os.read(self._fd, 65536)
+        position = 0
+        while position + InotifyWatcher._header.size <= len(data):
+            wd, mask, cookie, length = InotifyWatcher._header.unpack_from(data, position)
+            position += InotifyWatcher._header.size
+            name = data[position:position + length].rstrip(b'\0')
+            position += length
+
+            if mask & InotifyWatcher._IN_Q_OVERFLOW:
+                # events were dropped; every unit may have changed
+                units.update(self.allUnits())
+                continue
+            directory = self._paths.get(wd)
+            if directory is None:
+                continue
+            if mask & InotifyWatcher._IN_IGNORED:
+                del self._paths[wd]
+                continue
+            path = directory
+            if name:
+                path = os.path.join(directory, name.decode(sys.getfilesystemencoding()) if isinstance(directory, type(u'')) else name)
+            if mask & InotifyWatcher._IN_ISDIR and mask & (InotifyWatcher._IN_CREATE | InotifyWatcher._IN_MOVED_TO) and self._polling is None:
+                try:
+                    self.addTree(path)
+                except OSError as exc:
+                    self.fallBack(exc)
+            unit = self.unitOf(path)
+            if unit is not None:
+                units.add(unit)
+        return units
+
+    def fallBack(self, exc):
+        """Stop using inotify (e.g. once the watches run out) and poll for changes instead."""
+        sys.stderr.write('warning: falling back to polling for library changes: %s\r\n' % (exc))
+        self.close()
+        self._paths = {}
+        self._polling = PollingWatcher(self._roots, self._debounce, self._latency)
+        # stopping this watcher stops the polling
+        self._polling._stop = self._stop
+
+    def allUnits(self):
+        units = set()
+        for root in self._roots:
+            try:
+                units.update(entry.path for entry in listEntries(root))
+            except OSError:
+                pass
+        return units
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher(Watcher):
+    """Portable backend that periodically compares directory modification times.
+
+    Changes found by one look (or by looks less than `debounce` seconds
+    apart) make up one batch.
+
+    >>> import shutil, tempfile
+    >>> root = tempfile.mkdtemp()
+    >>> watcher = PollingWatcher([root], debounce=0.1, interval=0.05)
+    >>> for name in ['a.avi', 'b.avi', 'Show']:
+    ...     open(os.path.join(root, name), 'w').close()
+    >>> watcher.start()
+    >>> deadline = time.time() + 5
+    >>> while not watcher._batches and time.time() < deadline: time.sleep(0.05)
+    >>> time.sleep(0.2); len(watcher._batches)
+    1
+    >>> sorted(os.path.basename(unit) for unit in watcher.getBatch()), len(watcher.getBatch())
+    (['Show', 'a.avi', 'b.avi'], 0)
+    >>> watcher.stop(); shutil.rmtree(root)
+    """
+
+    _interval = 10.0
+
+    def __init__(self, roots, debounce=None, latency=None, interval=None):
+        Watcher.__init__(self, roots, debounce, latency)
+        self._interval = interval if interval is not None else PollingWatcher._interval
+        self._snapshot = self.snapshot()
+
+    def snapshot(self):
+        """Return ({directory: mtime}, {root: set of entry paths})."""
+        mtimes = {}
+        listings = {}
+        for root in self._roots:
+            directories = [root]
+            while directories:
+                directory = directories.pop()
+                try:
+                    mtimes[directory] = os.stat(directory).st_mtime
+                    entries = listEntries(directory)
+                except OSError:
+                    continue
+                if directory == root:
+                    listings[root] = set(entry.path for entry in entries)
+                for entry in entries:
+                    try:
+                        if entry.is_dir() and not entry.is_symlink():
+                            directories.append(entry.path)
+                    except OSError:
+                        pass
+        return mtimes, listings
+
+    def wait(self, timeout):
+        # pending units are flushed after the debounce period; new changes
+        # are only looked for once per interval
+        if self._stop.wait(timeout if timeout is not None else self._interval) or timeout is not None:
+            return set()
+
+        mtimes, listings = self.snapshot()
+        oldMtimes, oldListings = self._snapshot
+        self._snapshot = (mtimes, listings)
+
+        units = set()
+        for directory in set(mtimes) | set(oldMtimes):
+            if mtimes.get(directory) != oldMtimes.get(directory):
+                unit = self.unitOf(directory)
+                if unit is not None:
+                    units.add(unit)
+        for root in set(listings) | set(oldListings):
+            units.update(listings.get(root, set()) ^ oldListings.get(root, set()))
+        return units
+
+
+def createWatcher(roots, debounce=None, latency=None):
+    """Return an inotify watcher where available, otherwise a polling one."""
+    try:
+        return InotifyWatcher(roots, debounce, latency)
+    except (OSError, AttributeError) as exc:
+        if sys.platform.startswith('linux'):
+            sys.stderr.write('warning: falling back to polling for library changes: %s\r\n' % (exc))
+        return PollingWatcher(roots, debounce, latency)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()